@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from PIL import Image
+from accounts.models import UserProfile
+from media_manager.models import MediaBlob, MediaFile
+from posts.models import Post
+from social_platform.images import generate_placeholder
+
+
+class Command(BaseCommand):
+    help = 'Add dimensions and inline placeholders to the variant manifests of existing images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate placeholders that already exist',
+        )
+
+    def handle(self, *args, **options):
+        self.force = options['force']
+        self.verbosity = options['verbosity']
+        # Many rows share a file (the default profile picture, deduplicated media)
+        self.cache = {}
+        self.totals = dict.fromkeys(['generated', 'stale', 'missing', 'error'], 0)
+
+        self.stdout.write('Generating image placeholders...')
+        for model in (UserProfile, Post):
+            for field_name, (manifest_field, _) in model.variant_fields.items():
+                self.fill(model.objects.all(), field_name, manifest_field)
+        self.fill(MediaFile.objects.filter(media_type='image', is_processed=True), 'original_file', 'variants')
+        self.fill(
+            MediaBlob.objects.filter(is_processed=True, media_files__media_type='image').distinct(),
+            'file', 'variants',
+        )
+
+        totals = self.totals
+        self.stdout.write(
+            f'{totals["generated"]} placeholders generated, {totals["stale"]} skipped '
+            f'(awaiting processing), {totals["missing"]} missing, {totals["error"]} errors'
+        )
+        self.stdout.write(self.style.SUCCESS('Placeholder generation complete!'))
+
+    def fill(self, queryset, field_name, manifest_field):
+        storage = queryset.model._meta.get_field(field_name).storage
+        queryset = queryset.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        if not self.force:
+            queryset = queryset.exclude(**{f'{manifest_field}__has_key': 'placeholder'})
+
+        rows = queryset.order_by('pk').values_list('pk', field_name, manifest_field)
+        for pk, name, manifest in rows.iterator(chunk_size=2000):
+            if manifest and manifest.get('source') != name:
+                # Variants of an earlier file; the pending processing job replaces them
+                self.totals['stale'] += 1
+                continue
+
+            if name not in self.cache:
+                try:
+                    self.cache[name] = generate_placeholder(storage, name)
+                except FileNotFoundError:
+                    self.cache[name] = 'missing'
+                except (OSError, Image.UnidentifiedImageError) as e:
+                    self.cache[name] = 'error'
+                    self.stdout.write(self.style.ERROR(f'Error reading {name}: {e}'))
+            if isinstance(self.cache[name], str):
+                self.totals[self.cache[name]] += 1
+                continue
+
+            updated = queryset.model._default_manager.filter(pk=pk, **{field_name: name})
+            if not self.force:
+                # Leave rows a processing job has refreshed in the meantime alone
+                updated = updated.exclude(**{f'{manifest_field}__has_key': 'placeholder'})
+            if updated.update(**{manifest_field: {**(manifest or {}), **self.cache[name]}}):
+                self.totals['generated'] += 1
+                if self.verbosity > 1:
+                    self.stdout.write(f'{queryset.model._meta.label} {pk}: {name}')
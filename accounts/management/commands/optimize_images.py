@@ -1,9 +1,15 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from PIL import Image
-import os
+from django.core.files.storage import default_storage
 from accounts.models import UserProfile
 from posts.models import Post
+from social_platform.images import optimize_image_batch
 
 
 class Command(BaseCommand):
@@ -22,44 +28,166 @@ class Command(BaseCommand):
             default=1200,
             help='Maximum image dimension (default: 1200px)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Images handed to a worker at a time (default: 50)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Reprocess images even if they were optimized before',
+        )
+        parser.add_argument(
+            '--marker-file',
+            default=None,
+            help='Log recording which images are already optimized '
+                 '(default: optimize_images.jsonl in COMMAND_STATE_DIR)',
+        )
 
     def handle(self, *args, **options):
         quality = options['quality']
         max_size = options['max_size']
-        
+        self.verbosity = options['verbosity']
+        self.marker_path = options['marker_file'] or os.path.join(
+            getattr(settings, 'COMMAND_STATE_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'state')),
+            'optimize_images.jsonl',
+        )
+        self.log_lines = 0
+        self.markers = {} if options['force'] else self.load_markers()
+        self.open_log(truncate=options['force'])
+        self.totals = dict.fromkeys(['optimized', 'kept', 'unchanged', 'skipped', 'error', 'before', 'after'], 0)
+
         self.stdout.write('Starting image optimization...')
-        
-        # Optimize profile pictures
-        profiles = UserProfile.objects.exclude(profile_picture='profile_pics/default.jpg')
-        for profile in profiles:
-            if profile.profile_picture and os.path.exists(profile.profile_picture.path):
-                self.optimize_image(profile.profile_picture.path, quality, 300)  # Profile pics smaller
-                
-        # Optimize post images
-        posts = Post.objects.exclude(image='')
-        for post in posts:
-            if post.image and os.path.exists(post.image.path):
-                self.optimize_image(post.image.path, quality, max_size)
-                
+        started = time.monotonic()
+
+        sources = [
+            # Profile pics smaller
+            (UserProfile.objects.exclude(profile_picture='profile_pics/default.jpg').exclude(
+                profile_picture=''
+            ).order_by('pk').values_list('profile_picture', flat=True), 300),
+            (Post.objects.exclude(image='').exclude(image__isnull=True).order_by('pk').values_list(
+                'image', flat=True
+            ), max_size),
+        ]
+        batches = self.iter_batches(sources, quality, options['batch_size'])
+
+        workers = max(1, options['workers'])
+        # Spawned workers only run Pillow, so they need no Django setup or DB connection
+        try:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                pending = {}
+                for batch in batches:
+                    # Keep a bounded number of batches in flight instead of queueing every image
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        self.collect({future: pending.pop(future) for future in done})
+                    pending[pool.submit(optimize_image_batch, batch, quality)] = batch
+                self.collect(pending)
+        finally:
+            self.log.close()
+
+        self.compact_log()
+        self.report(time.monotonic() - started)
+
+    def iter_batches(self, sources, quality, batch_size):
+        """Stream image names from the database and yield batches that need work."""
+        batch = []
+        for names, max_size in sources:
+            for name in names.iterator(chunk_size=2000):
+                path = default_storage.path(name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                marker = self.markers.get(name)
+                same_settings = marker and marker['quality'] == quality and marker['max_size'] == max_size
+                if same_settings and marker['mtime'] == stat.st_mtime and marker['size'] == stat.st_size:
+                    self.totals['skipped'] += 1
+                    continue
+
+                # A touched but identical file is recognised by its hash in the worker
+                batch.append((name, path, max_size, marker['sha256'] if same_settings else None))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def collect(self, futures):
+        """Record the results of finished batches, given as ``{future: batch}``."""
+        for future, batch in futures.items():
+            try:
+                results = future.result()
+            except Exception as e:
+                # A crashed worker loses its batch, not the run
+                results = [(name, 'error', 0, 0, str(e)) for name, *_ in batch]
+
+            for name, status, before, after, detail in results:
+                self.totals[status] += 1
+                if status == 'error':
+                    self.stdout.write(self.style.ERROR(f'Error optimizing {name}: {detail}'))
+                    continue
+                self.totals['before'] += before
+                self.totals['after'] += after
+                self.markers[name] = detail
+                # Appended as it finishes, so an interrupted run does not redo finished work
+                self.log.write(json.dumps({'name': name, **detail}) + '\n')
+                self.log_lines += 1
+                if status == 'optimized' and self.verbosity > 1:
+                    self.stdout.write(f'{name}: {before} -> {after} bytes')
+            self.log.flush()
+
+    def report(self, elapsed):
+        totals = self.totals
+        processed = totals['optimized'] + totals['kept'] + totals['unchanged']
+        saved = totals['before'] - totals['after']
+        percent = saved / totals['before'] * 100 if totals['before'] else 0
+        self.stdout.write(
+            f'Processed {processed} images in {elapsed:.1f}s ({processed / max(elapsed, 1e-6):.1f}/s): '
+            f'{totals["optimized"]} optimized, {totals["kept"] + totals["unchanged"]} already optimal, '
+            f'{totals["skipped"]} skipped, {totals["error"]} errors'
+        )
+        self.stdout.write(f'Saved {saved} bytes ({percent:.1f}%)')
         self.stdout.write(
             self.style.SUCCESS('Successfully optimized all images!')
         )
 
-    def optimize_image(self, image_path, quality, max_size):
+    def load_markers(self):
+        """Read the marker log; later lines for an image replace earlier ones."""
+        markers = {}
         try:
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                
-                # Resize if too large
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # Save with optimization
-                img.save(image_path, 'JPEG', quality=quality, optimize=True)
-                
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f'Error optimizing {image_path}: {str(e)}')
-            )
+            with open(self.marker_path) as f:
+                for line in f:
+                    self.log_lines += 1
+                    try:
+                        marker = json.loads(line)
+                        markers[marker.pop('name')] = marker
+                    except (ValueError, KeyError, AttributeError):
+                        # A line cut short by an interrupted run
+                        continue
+        except OSError:
+            pass
+        return markers
+
+    def open_log(self, truncate=False):
+        os.makedirs(os.path.dirname(self.marker_path) or '.', exist_ok=True)
+        self.log = open(self.marker_path, 'w' if truncate else 'a')
+
+    def compact_log(self):
+        """Rewrite the log with one line per image once it is mostly superseded lines."""
+        if self.log_lines < 2 * len(self.markers):
+            return
+        tmp_path = f'{self.marker_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            for name, marker in self.markers.items():
+                f.write(json.dumps({'name': name, **marker}) + '\n')
+        os.replace(tmp_path, self.marker_path)
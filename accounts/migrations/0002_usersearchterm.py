@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=150)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_search_terms',
+                'indexes': [models.Index(fields=['term', '-followers_count'], name='user_search_term_2687b7_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usersearchterm',
+            constraint=models.UniqueConstraint(fields=('user', 'term'), name='unique_user_search_term'),
+        ),
+    ]
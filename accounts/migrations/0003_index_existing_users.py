@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def index_users(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    UserSearchTerm = apps.get_model('accounts', 'UserSearchTerm')
+
+    followers = dict(UserProfile.objects.values_list('user_id', 'followers_count'))
+    batch = []
+    for user in User.objects.order_by('id').iterator(chunk_size=1000):
+        names = [user.username, user.first_name, user.last_name, f'{user.first_name} {user.last_name}']
+        terms = {' '.join(name.lower().split())[:150] for name in names}
+        batch.extend(
+            UserSearchTerm(user_id=user.id, term=term, followers_count=followers.get(user.id, 0))
+            for term in terms if term
+        )
+        if len(batch) >= 1000:
+            UserSearchTerm.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    UserSearchTerm.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_usersearchterm'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_users, migrations.RunPython.noop),
+    ]
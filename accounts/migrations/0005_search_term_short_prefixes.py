@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:03
+
+from django.db import migrations, models
+
+SHORT_PREFIX_LENGTH = 3
+
+
+def index_short_prefixes(apps, schema_editor):
+    UserSearchTerm = apps.get_model('accounts', 'UserSearchTerm')
+
+    # Only the rows that were there before this migration started adding some
+    last_id = UserSearchTerm.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    terms = UserSearchTerm.objects.filter(id__lte=last_id).order_by('id')
+    batch = []
+    for user_id, term, followers_count in terms.values_list(
+        'user_id', 'term', 'followers_count'
+    ).iterator(chunk_size=1000):
+        batch.extend(
+            UserSearchTerm(user_id=user_id, term=term[:length], followers_count=followers_count)
+            for length in range(1, SHORT_PREFIX_LENGTH + 1)
+        )
+        if len(batch) >= 1000:
+            UserSearchTerm.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    UserSearchTerm.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_image_variants'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='usersearchterm',
+            name='user_search_term_2687b7_idx',
+        ),
+        migrations.AddIndex(
+            model_name='usersearchterm',
+            index=models.Index(fields=['term', '-followers_count', 'user'], name='user_search_term_417df6_idx'),
+        ),
+        migrations.RunPython(index_short_prefixes, migrations.RunPython.noop),
+    ]
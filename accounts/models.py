@@ -1,11 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
-from PIL import Image
-import os
+from social_platform.images import ResizeImagesMixin
 
 
-class UserProfile(models.Model):
+class UserProfile(ResizeImagesMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(
@@ -13,6 +12,7 @@ class UserProfile(models.Model):
         default='profile_pics/default.jpg',
         blank=True
     )
+    picture_variants = models.JSONField(default=dict, blank=True)
     location = models.CharField(max_length=100, blank=True)
     website = models.URLField(blank=True)
     birth_date = models.DateField(null=True, blank=True)
@@ -24,6 +24,10 @@ class UserProfile(models.Model):
     following_count = models.PositiveIntegerField(default=0)
     posts_count = models.PositiveIntegerField(default=0)
 
+    # Uploaded pictures are shrunk to fit and encoded at smaller widths in the background
+    resize_fields = {'profile_picture': (300, 300)}
+    variant_fields = {'profile_picture': ('picture_variants', (64, 150, 300))}
+
     class Meta:
         db_table = 'user_profiles'
         indexes = [
@@ -37,17 +41,30 @@ class UserProfile(models.Model):
     def get_absolute_url(self):
         return reverse('accounts:profile', kwargs={'username': self.user.username})
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # Resize profile picture if it exists
-        if self.profile_picture and os.path.exists(self.profile_picture.path):
-            img = Image.open(self.profile_picture.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                img.save(self.profile_picture.path)
-
     @property
     def full_name(self):
         return f"{self.user.first_name} {self.user.last_name}".strip() or self.user.username
+
+
+class UserSearchTerm(models.Model):
+    """
+    Lowercased name fragment of a user (username, first name, last name or
+    full name), indexed for prefix lookups by the people search typeahead.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=150)
+    # Copied from the profile so matches can be ranked without a join
+    followers_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'user_search_terms'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'term'], name='unique_user_search_term'),
+        ]
+        indexes = [
+            # Covers the ranked lookup, so it never reads the table
+            models.Index(fields=['term', '-followers_count', 'user']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.user_id}"
@@ -0,0 +1,126 @@
+"""
+Prefix index for people search.
+
+Every user is stored as a handful of lowercased terms (username, first name,
+last name and full name) in ``UserSearchTerm``. A query is answered with an
+index range scan ``term >= q AND term < q + U+FFFF`` that works on every
+backend, and results are boosted by whether the searcher already follows
+the user and by follower count. Names only match from the start of a word
+run: "smi" finds "Anna Smith" through her last name, "mith" finds nobody.
+
+A range over a short prefix can cover a large part of the index, and
+ranking it by follower count would sort all of it. The first
+``SHORT_PREFIX_LENGTH`` characters of every name are therefore stored as
+terms of their own, so short queries are an equality lookup that reads the
+``(term, -followers_count)`` index in ranking order and stops at the limit. The terms are refreshed from the ``User``
+and ``UserProfile`` save signals, and their follower counts whenever the
+counter is written.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from social.models import Follow
+from .models import UserProfile, UserSearchTerm
+
+MAX_TERM_LENGTH = 150
+
+SHORT_PREFIX_LENGTH = 3
+
+
+def normalize(value):
+    return ' '.join(value.lower().split())[:MAX_TERM_LENGTH]
+
+
+def get_terms(user):
+    """Return the set of search terms for a user."""
+    names = [user.username, user.first_name, user.last_name, f'{user.first_name} {user.last_name}']
+    terms = {term for term in map(normalize, names) if term}
+    return terms | {
+        term[:length] for term in terms for length in range(1, SHORT_PREFIX_LENGTH + 1)
+    }
+
+
+@transaction.atomic
+def index_user(user, followers_count=None):
+    """Replace a user's search terms with ones built from their current names."""
+    if followers_count is None:
+        followers_count = UserProfile.objects.filter(user=user).values_list(
+            'followers_count', flat=True
+        ).first() or 0
+
+    terms = get_terms(user)
+    UserSearchTerm.objects.filter(user=user).exclude(term__in=terms).delete()
+    UserSearchTerm.objects.bulk_create(
+        [UserSearchTerm(user=user, term=term, followers_count=followers_count) for term in terms],
+        ignore_conflicts=True,
+    )
+    UserSearchTerm.objects.filter(user=user).exclude(
+        followers_count=followers_count
+    ).update(followers_count=followers_count)
+
+
+def update_followers_count(user_id, followers_count):
+    """Refresh the ranking boost stored with a user's terms."""
+    UserSearchTerm.objects.filter(user_id=user_id).exclude(
+        followers_count=followers_count
+    ).update(followers_count=followers_count)
+
+
+def refresh_followers_count(profiles):
+    """Copy the stored follower counts of a ``UserProfile`` queryset onto their users' terms."""
+    stored = UserProfile.objects.filter(user_id=OuterRef('user_id')).values('followers_count')[:1]
+    UserSearchTerm.objects.filter(user_id__in=profiles.values('user_id')).update(
+        followers_count=Subquery(stored)
+    )
+
+
+def _prefix_matches(prefix):
+    if len(prefix) <= SHORT_PREFIX_LENGTH:
+        return UserSearchTerm.objects.filter(term=prefix)
+    return UserSearchTerm.objects.filter(term__gte=prefix, term__lt=prefix + '\uffff')
+
+
+def search_users(query, searcher=None, limit=8):
+    """
+    Return up to ``limit`` users whose names start with ``query``, users the
+    searcher follows first, then by follower count. Each user gets an
+    ``is_following`` attribute and has its profile loaded.
+    """
+    prefix = normalize(query)
+    if not prefix:
+        return []
+
+    searcher_id = searcher.id if searcher is not None and searcher.is_authenticated else None
+    matches = _prefix_matches(prefix)
+    if searcher_id:
+        matches = matches.exclude(user_id=searcher_id)
+
+    # Best candidates by follower count; a user can match on several terms
+    candidates = set(matches.order_by('-followers_count').values_list(
+        'user_id', flat=True
+    )[:limit * 4])
+
+    if searcher_id:
+        # Followed users get the biggest boost, even with few followers
+        candidates.update(matches.filter(user__followers__follower_id=searcher_id).order_by(
+            '-followers_count'
+        ).values_list('user_id', flat=True)[:limit])
+
+    if not candidates:
+        return []
+
+    users = User.objects.filter(id__in=candidates).select_related('profile')
+    if searcher_id:
+        users = users.annotate(is_following=Exists(
+            Follow.objects.filter(follower_id=searcher_id, following_id=OuterRef('pk'))
+        ))
+
+    users = list(users)
+    for user in users:
+        user.is_following = getattr(user, 'is_following', False)
+
+    return sorted(
+        users,
+        key=lambda user: (not user.is_following, -user.profile.followers_count, user.username),
+    )[:limit]
@@ -1,7 +1,9 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from social import counters
 from .models import UserProfile
+from . import search_index
 
 
 @receiver(post_save, sender=User)
@@ -18,3 +20,25 @@ def save_user_profile(sender, instance, **kwargs):
         instance.profile.save()
     else:
         UserProfile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, **kwargs):
+    """Refresh the user's people-search terms when their names may have changed."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    search_index.index_user(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+def update_search_boost(sender, instance, **kwargs):
+    """Keep the follower-count boost on the user's search terms current."""
+    search_index.update_followers_count(instance.user_id, instance.followers_count)
+
+
+@receiver(counters.counter_written, sender=UserProfile)
+def update_search_boost_from_counter(sender, lookup, fields, **kwargs):
+    """Follows change the count with an UPDATE, which sends no post_save."""
+    if 'followers_count' in fields:
+        search_index.refresh_followers_count(UserProfile.objects.filter(**lookup))
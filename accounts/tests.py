@@ -1,9 +1,23 @@
-from django.test import TestCase, Client
+import json
+import os
+from concurrent.futures import Future
+from io import BytesIO, StringIO
+
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, Client, override_settings
+from PIL import Image
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import UserProfile
+from social import counters
+from social.models import Follow
+from .models import UserProfile, UserSearchTerm
+from .search_index import search_users
+from posts.models import Post
+from social_platform.test_utils import MediaStorageMixin
 from .forms import CustomUserCreationForm, UserProfileForm
+from .management.commands.optimize_images import Command as OptimizeImagesCommand
 
 
 class UserProfileModelTest(TestCase):
@@ -136,3 +150,234 @@ class UserFormsTest(TestCase):
         }
         form = UserProfileForm(data=form_data, instance=user.profile)
         self.assertTrue(form.is_valid())
+
+
+class UserSearchIndexTest(TestCase):
+    def setUp(self):
+        self.searcher = User.objects.create_user(username='searcher', password='testpass123')
+        self.popular = User.objects.create_user(
+            username='annapopular', first_name='Anna', last_name='Smith', password='testpass123'
+        )
+        self.friend = User.objects.create_user(
+            username='annafriend', first_name='Anna', last_name='Jones', password='testpass123'
+        )
+        self.other = User.objects.create_user(username='bob', password='testpass123')
+        for i in range(3):
+            fan = User.objects.create_user(username=f'fan{i}', password='testpass123')
+            Follow.objects.create(follower=fan, following=self.popular)
+        Follow.objects.create(follower=self.searcher, following=self.friend)
+        self.client = Client()
+        self.client.login(username='searcher', password='testpass123')
+
+    def test_terms_follow_name_changes(self):
+        """Test that a user's search terms are rebuilt when their names change."""
+        self.assertEqual(
+            set(self.popular.search_terms.values_list('term', flat=True)),
+            {'annapopular', 'anna', 'smith', 'anna smith', 'a', 'an', 'ann', 's', 'sm', 'smi'},
+        )
+        self.popular.last_name = 'Brown'
+        self.popular.save()
+        terms = set(self.popular.search_terms.values_list('term', flat=True))
+        self.assertIn('anna brown', terms)
+        self.assertIn('bro', terms)
+        self.assertNotIn('smith', terms)
+        self.assertNotIn('smi', terms)
+
+    def boosts(self):
+        return set(self.popular.search_terms.values_list('followers_count', flat=True))
+
+    def test_follows_update_followers_boost(self):
+        """Test that following and unfollowing refresh the stored follower count."""
+        self.assertEqual(self.boosts(), {3})
+        Follow.objects.filter(following=self.popular).first().delete()
+        self.assertEqual(self.boosts(), {2})
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_buffered_follows_update_boost_on_flush(self):
+        """Test that buffered follower counts reach the search terms when they are flushed."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.other, following=self.popular)
+        self.assertEqual(self.boosts(), {3})
+        counters.flush_counters()
+        self.assertEqual(self.boosts(), {4})
+
+    def test_prefix_match_ranks_followed_users_first(self):
+        """Test that followed users rank above more popular matches."""
+        results = search_users('ann', self.searcher)
+        self.assertEqual([user.username for user in results], ['annafriend', 'annapopular'])
+        self.assertTrue(results[0].is_following)
+        self.assertFalse(results[1].is_following)
+
+    def test_matches_full_name_and_is_case_insensitive(self):
+        """Test matching on a full-name prefix regardless of case."""
+        results = search_users('ANNA SM', self.searcher)
+        self.assertEqual([user.username for user in results], ['annapopular'])
+
+    def test_short_and_long_prefixes_match_the_same_users(self):
+        """Test that short prefixes find the users their longer forms find."""
+        for query in ['s', 'sm', 'smi', 'smit']:
+            results = search_users(query, self.searcher)
+            self.assertEqual([user.username for user in results], ['annapopular'])
+
+    def test_matches_start_of_names_only(self):
+        """Test that a query in the middle of a name does not match."""
+        self.assertEqual(search_users('mith', self.searcher), [])
+
+    def test_excludes_searcher_and_blank_queries(self):
+        """Test that searchers never find themselves and blank queries return nothing."""
+        self.assertEqual(search_users('search', self.searcher), [])
+        self.assertEqual(search_users('   ', self.searcher), [])
+
+    def test_user_deletion_removes_terms(self):
+        """Test that deleting a user drops their search terms."""
+        self.other.delete()
+        self.assertFalse(UserSearchTerm.objects.filter(term='bob').exists())
+
+    def test_search_page(self):
+        """Test the search page lists prefix matches."""
+        response = self.client.get(reverse('accounts:search_users'), {'q': 'anna'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'annafriend')
+        self.assertContains(response, 'annapopular')
+        self.assertNotContains(response, '>bob<')
+
+    def test_typeahead_endpoint(self):
+        """Test the typeahead endpoint returns ranked suggestions as JSON."""
+        response = self.client.get(reverse('accounts:search_users_typeahead'), {'q': 'an'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['username'] for result in results], ['annafriend', 'annapopular'])
+        self.assertTrue(results[0]['is_following'])
+        self.assertEqual(results[1]['followers_count'], 3)
+        self.assertEqual(results[1]['full_name'], 'Anna Smith')
+
+
+class OptimizeImagesCommandTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.state_dir = self.make_temp_dir()
+        self.marker_file = os.path.join(self.state_dir, 'markers.jsonl')
+
+        buffer = BytesIO()
+        Image.effect_noise((2000, 1500), 64).convert('RGB').save(buffer, 'JPEG', quality=100)
+        user = User.objects.create_user(username='photographer', password='testpass123')
+        self.post = Post.objects.create(
+            author=user,
+            content='Photo',
+            image=SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg'),
+        )
+
+    def run_command(self):
+        out = StringIO()
+        call_command('optimize_images', workers=1, marker_file=self.marker_file, stdout=out)
+        return out.getvalue()
+
+    def test_optimizes_and_reports_savings(self):
+        """Test that large images are shrunk and the savings are reported."""
+        size_before = os.path.getsize(self.post.image.path)
+        output = self.run_command()
+
+        self.assertIn('Processed 1 images', output)
+        self.assertIn('1 optimized', output)
+        self.assertIn(f'Saved {size_before - os.path.getsize(self.post.image.path)} bytes', output)
+        with Image.open(self.post.image.path) as img:
+            self.assertEqual(img.size, (1200, 900))
+
+    def test_second_run_skips_optimized_images(self):
+        """Test that images recorded in the marker file are not recompressed."""
+        self.run_command()
+        with open(self.post.image.path, 'rb') as f:
+            optimized = f.read()
+
+        self.assertIn('1 skipped', self.run_command())
+
+        # Touching the file changes its mtime, but the hash still matches
+        os.utime(self.post.image.path, None)
+        self.assertIn('0 optimized, 1 already optimal', self.run_command())
+        with open(self.post.image.path, 'rb') as f:
+            self.assertEqual(f.read(), optimized)
+
+    def test_markers_are_appended_outside_media_root(self):
+        """Test that progress is logged per image in COMMAND_STATE_DIR, not in MEDIA_ROOT."""
+        with override_settings(COMMAND_STATE_DIR=self.state_dir):
+            call_command('optimize_images', workers=1, stdout=StringIO())
+        with open(os.path.join(self.state_dir, 'optimize_images.jsonl')) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['name'] for line in lines], [self.post.image.name])
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'post_images')), [os.path.basename(self.post.image.name)])
+
+    def test_failed_batch_does_not_stop_the_run(self):
+        """Test that a batch whose worker failed is reported and the rest are still recorded."""
+        command = OptimizeImagesCommand(stdout=StringIO())
+        command.verbosity = 1
+        command.markers = {}
+        command.log_lines = 0
+        command.log = StringIO()
+        command.totals = dict.fromkeys(['optimized', 'kept', 'unchanged', 'skipped', 'error', 'before', 'after'], 0)
+
+        failed, finished = Future(), Future()
+        failed.set_exception(RuntimeError('worker died'))
+        finished.set_result([('b.jpg', 'optimized', 100, 50, {'sha256': 'x'})])
+        command.collect({failed: [('a.jpg', '/a.jpg', 1200, None)], finished: [('b.jpg', '/b.jpg', 1200, None)]})
+
+        self.assertEqual((command.totals['error'], command.totals['optimized']), (1, 1))
+        self.assertIn('Error optimizing a.jpg: worker died', command.stdout.getvalue())
+        self.assertEqual(list(command.markers), ['b.jpg'])
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class ImagePlaceholderTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='photographer', password='testpass123')
+
+    def create_post(self):
+        buffer = BytesIO()
+        Image.new('RGB', (900, 600), 'teal').save(buffer, 'JPEG')
+        return Post.objects.create(
+            author=self.user,
+            content='Photo',
+            image=SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg'),
+        )
+
+    def render(self, post):
+        template = Template(
+            '{% load responsive_images %}<img {% image_placeholder post.image post.image_variants %}>'
+        )
+        return template.render(Context({'post': post}))
+
+    def test_processing_adds_placeholder_and_dimensions(self):
+        """Test that processed images get their dimensions and an inline placeholder."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.create_post()
+        post.refresh_from_db()
+
+        manifest = post.image_variants
+        self.assertEqual((manifest['width'], manifest['height']), (800, 533))
+        self.assertTrue(manifest['placeholder'].startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(manifest['placeholder']), 1000)
+
+        html = self.render(post)
+        self.assertIn('width="800" height="533"', html)
+        self.assertIn(manifest['placeholder'], html)
+
+    def test_no_placeholder_for_unprocessed_image(self):
+        """Test that nothing is rendered while the image has no current manifest."""
+        post = self.create_post()
+        self.assertEqual(self.render(post), '<img >')
+
+    def test_command_backfills_placeholders(self):
+        """Test that the backfill command fills in missing placeholders once."""
+        post = self.create_post()
+        out = StringIO()
+        call_command('generate_placeholders', stdout=out)
+        self.assertIn('1 placeholders generated', out.getvalue())
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['source'], post.image.name)
+        self.assertEqual((post.image_variants['width'], post.image_variants['height']), (900, 600))
+        self.assertIn('placeholder', post.image_variants)
+
+        out = StringIO()
+        call_command('generate_placeholders', stdout=out)
+        self.assertIn('0 placeholders generated', out.getvalue())
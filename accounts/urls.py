@@ -26,6 +26,7 @@ urlpatterns = [
     
     # Search
     path('search/', views.search_users_view, name='search_users'),
+    path('search/typeahead/', views.search_users_typeahead_view, name='search_users_typeahead'),
     
     # Password reset URLs
     path('password-reset/', auth_views.PasswordResetView.as_view(
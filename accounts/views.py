@@ -3,12 +3,14 @@ from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.http import JsonResponse
 from .forms import CustomUserCreationForm, UserProfileForm, UserUpdateForm
 from .models import UserProfile
+from .search_index import search_users
 from posts.models import Post
+from social import counters
 from social.models import Follow
+from social_platform.pagination import CursorPaginator
 
 
 def register_view(request):
@@ -27,12 +29,12 @@ def register_view(request):
 def profile_view(request, username):
     user = get_object_or_404(User, username=username)
     profile = user.profile
-    posts = Post.objects.filter(author=user).order_by('-created_at')
+    counters.apply_pending([profile], 'followers_count', 'following_count', 'posts_count', key='user_id')
+    posts = Post.objects.filter(author=user)
 
-    # Pagination
-    paginator = Paginator(posts, 12)  # Show 12 posts per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: no COUNT(*) and no OFFSET scan
+    paginator = CursorPaginator(posts, 12)  # Show 12 posts per page
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     # Check if current user is following this profile
     is_following = False
@@ -116,9 +118,8 @@ def followers_view(request, username):
     user = get_object_or_404(User, username=username)
     followers = Follow.objects.filter(following=user).select_related('follower__profile')
 
-    paginator = Paginator(followers, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(followers, 20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'profile_user': user,
@@ -133,9 +134,8 @@ def following_view(request, username):
     user = get_object_or_404(User, username=username)
     following = Follow.objects.filter(follower=user).select_related('following__profile')
 
-    paginator = Paginator(following, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(following, 20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'profile_user': user,
@@ -150,20 +150,31 @@ def search_users_view(request):
     users = []
 
     if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) |
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query)
-        ).select_related('profile').exclude(id=request.user.id if request.user.is_authenticated else None)[:20]
-
-        # Add following status for each user
-        if request.user.is_authenticated:
-            following_ids = Follow.objects.filter(follower=request.user).values_list('following_id', flat=True)
-            for user in users:
-                user.is_following = user.id in following_ids
+        # Prefix search, followed users first, then by follower count
+        users = search_users(query, request.user, limit=20)
 
     context = {
         'users': users,
         'query': query
     }
     return render(request, 'accounts/search_users.html', context)
+
+
+def search_users_typeahead_view(request):
+    """Return people-search suggestions as JSON for keystroke-by-keystroke lookups."""
+    query = request.GET.get('q', '')
+    users = search_users(query, request.user, limit=8)
+
+    return JsonResponse({
+        'results': [
+            {
+                'username': user.username,
+                'full_name': user.profile.full_name,
+                'profile_picture': user.profile.profile_picture.url if user.profile.profile_picture else None,
+                'followers_count': user.profile.followers_count,
+                'is_following': user.is_following,
+                'url': user.profile.get_absolute_url(),
+            }
+            for user in users
+        ]
+    })
@@ -0,0 +1,159 @@
+"""
+Content-addressed storage for uploaded media.
+
+Uploads are hashed while they are read and stored once per SHA-256 digest
+under ``media/blobs/<first two hex digits>/<digest><ext>``, the extension
+following the detected MIME type rather than the uploaded file's name, so
+it always matches how the file is served. A ``MediaBlob``
+row tracks how many ``MediaFile`` rows reference the stored file; uploading
+content that already exists only bumps the count, and the blob's files are
+deleted when the last reference is released.
+
+Storing takes two steps so no file is copied while rows are locked: the
+upload is first staged as a hidden file next to the blobs, outside any
+transaction, and ``commit`` then renames it into place in the transaction
+that records the blob.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from social_platform import images
+from .models import MediaBlob
+
+# MediaFile fields copied from an already processed blob
+SHARED_FIELDS = [
+    'optimized_file', 'thumbnail', 'variants', 'width', 'height', 'duration', 'processed_size', 'is_processed',
+]
+
+
+def hash_file(uploaded_file):
+    """Return the SHA-256 hex digest of an uploaded file, reading it in chunks."""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+# Allowed types mimetypes has no extension for
+EXTENSIONS = {
+    'audio/mp3': '.mp3',
+    'audio/wav': '.wav',
+}
+
+
+def blob_name(digest, mime_type):
+    extension = EXTENSIONS.get(mime_type) or mimetypes.guess_extension(mime_type or '') or ''
+    return f'media/blobs/{digest[:2]}/{digest}{extension}'
+
+
+def _storage():
+    return MediaBlob._meta.get_field('file').storage
+
+
+def _blob_dir():
+    path = _storage().path('media/blobs')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def stage_upload(uploaded_file):
+    """
+    Copy an upload to a hidden file in the blob directory, for ``commit``.
+    Call outside transactions. Returns the staged path.
+    """
+    fd, staged = tempfile.mkstemp(dir=_blob_dir(), prefix='.staged-')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in uploaded_file.chunks():
+            f.write(chunk)
+    return staged
+
+
+def stage_file(path):
+    """
+    Like ``stage_upload`` for a local file, which is used in place when it
+    is already on the blob directory's filesystem.
+    """
+    if os.stat(path).st_dev == os.stat(_blob_dir()).st_dev:
+        return path
+    with open(path, 'rb') as f:
+        return stage_upload(File(f))
+
+
+def commit(staged, digest, mime_type):
+    """
+    Rename a staged file to the blob name for its content. Returns the name.
+    A file already at that name has the same content, so replacing it is
+    harmless.
+    """
+    name = blob_name(digest, mime_type)
+    path = _storage().path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(staged, path)
+    return name
+
+
+def uncommit(name, staged):
+    """Move a committed file back to ``staged`` after its transaction failed, unless a blob uses it."""
+    if not MediaBlob.objects.filter(file=name).exists():
+        os.replace(_storage().path(name), staged)
+
+
+def acquire(digest):
+    """Take a reference on an existing blob. Returns the blob or None."""
+    if MediaBlob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+        return MediaBlob.objects.get(digest=digest)
+    return None
+
+
+def create(digest, name, size):
+    """
+    Record the committed file ``name`` as a blob with one reference taken
+    for the caller.
+    """
+    try:
+        with transaction.atomic():
+            return MediaBlob.objects.create(digest=digest, file=name, size=size, ref_count=1)
+    except IntegrityError:
+        # Someone stored the same content at the same time, under the same name
+        return acquire(digest)
+
+
+def shared_fields(blob):
+    """Processing results of a blob to copy onto a new MediaFile, if it has any."""
+    if not blob.is_processed:
+        return {}
+    return {field: getattr(blob, field) for field in SHARED_FIELDS}
+
+
+@transaction.atomic
+def release(blob_id):
+    """Drop a reference to a blob, deleting it and its files if it was the last."""
+    MediaBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+    blob = MediaBlob.objects.filter(pk=blob_id, ref_count=0).first()
+    if blob is None:
+        return False
+
+    # Conditional, so a reference taken by a concurrent upload keeps the blob alive
+    deleted, _ = MediaBlob.objects.filter(pk=blob_id, ref_count=0).delete()
+    if not deleted:
+        return False
+    transaction.on_commit(lambda: delete_files(
+        [blob.file, blob.optimized_file, blob.thumbnail], blob.variants
+    ))
+    return True
+
+
+def delete_files(files, variants=None):
+    """Delete stored files and a variant manifest's files."""
+    storage = MediaBlob._meta.get_field('file').storage
+    for file in files:
+        if file:
+            storage.delete(file.name)
+    images.delete_variants(storage, variants)
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from media_manager.models import UploadSession
+from media_manager.uploads import discard
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions that have not received data for a while'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Idle time after which an upload is abandoned (default: 24)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        count = 0
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+            discard(session)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} stale upload sessions.'))
@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from media_manager.models import MediaUsage
+from media_manager.usage import USAGE_FIELDS, compute_usage_for
+from social_platform import repair
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user media usage totals from media files and fix drifted rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Users recomputed per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to pause between batches to limit database load (default: 0)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted rows without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        scanned = drifted = fixed = 0
+
+        for rows in repair.iter_chunks(User.objects.all(), 'pk', (), options['chunk_size'], sleep=options['sleep']):
+            user_ids = [row[0] for row in rows]
+
+            # One grouped aggregate over the batch's media files
+            expected = compute_usage_for(user_ids)
+            stored = {
+                row[0]: dict(zip(USAGE_FIELDS, row[1:]))
+                for row in MediaUsage.objects.filter(user_id__in=user_ids).values_list('user_id', *USAGE_FIELDS)
+            }
+
+            missing = []
+            for user_id in user_ids:
+                totals = expected[user_id]
+                if user_id not in stored:
+                    if totals['total_files']:
+                        drifted += 1
+                        missing.append(MediaUsage(user_id=user_id, **totals))
+                    continue
+                if stored[user_id] == totals:
+                    continue
+
+                drifted += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'user {user_id}: {repair.describe_changes(stored[user_id], totals)}')
+                if not dry_run:
+                    # Uploads, deletes and processing adjust the totals with F()
+                    # increments; one that landed after the aggregate changed the
+                    # row, which is then repaired by the next run
+                    fixed += repair.compare_and_swap(MediaUsage.objects.filter(user_id=user_id), stored[user_id], totals)
+
+            if missing and not dry_run:
+                # A first upload racing the repair creates the row itself
+                fixed += len(MediaUsage.objects.bulk_create(missing, ignore_conflicts=True))
+
+            scanned += len(user_ids)
+
+        if dry_run:
+            self.stdout.write(f'usage: scanned {scanned} users, {drifted} drifted')
+        else:
+            self.stdout.write(f'usage: scanned {scanned} users, {drifted} drifted, {fixed} fixed')
+        self.stdout.write(self.style.SUCCESS('Media usage repair complete!'))
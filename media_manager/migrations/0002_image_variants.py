@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('media_manager', '0004_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='media_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_files', models.PositiveIntegerField(default=0)),
+                ('total_size', models.PositiveBigIntegerField(default=0)),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('image_size', models.PositiveBigIntegerField(default=0)),
+                ('video_count', models.PositiveIntegerField(default=0)),
+                ('video_size', models.PositiveBigIntegerField(default=0)),
+                ('audio_count', models.PositiveIntegerField(default=0)),
+                ('audio_size', models.PositiveBigIntegerField(default=0)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+                ('document_size', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
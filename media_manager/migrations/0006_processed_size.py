@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media_manager', '0005_mediausage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='processed_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='processed_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediausage',
+            name='processed_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,11 +1,50 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
+from django.core.files import File
+from django.core.files.base import ContentFile
+from io import BytesIO
 from PIL import Image
+from social_platform import background, images
+from . import video
 import os
+import tempfile
 import uuid
 
 
+VARIANT_WIDTHS = (320, 640, 1280, 1920)
+
+
+class MediaBlob(models.Model):
+    """
+    One stored copy of an uploaded file, addressed by its SHA-256 digest.
+
+    Every ``MediaFile`` with the same content points at the same blob, which
+    also keeps the processed versions so they are generated only once. The
+    physical files are deleted when the last referencing ``MediaFile`` is.
+    """
+
+    digest = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='media/blobs/', max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # Processing results shared by every referencing MediaFile
+    optimized_file = models.FileField(upload_to='media/optimized/%Y/%m/', blank=True, null=True)
+    thumbnail = models.ImageField(upload_to='media/thumbnails/%Y/%m/', blank=True, null=True)
+    variants = models.JSONField(default=dict, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    processed_size = models.PositiveBigIntegerField(default=0)
+    is_processed = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.ref_count} refs)"
+
+
 class MediaFile(models.Model):
     """Advanced media file model with optimization and metadata"""
 
@@ -21,13 +60,18 @@ class MediaFile(models.Model):
 
     # File information
     original_file = models.FileField(upload_to='media/original/%Y/%m/')
+    blob = models.ForeignKey(
+        MediaBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='media_files'
+    )
     optimized_file = models.FileField(upload_to='media/optimized/%Y/%m/', blank=True, null=True)
     thumbnail = models.ImageField(upload_to='media/thumbnails/%Y/%m/', blank=True, null=True)
+    variants = models.JSONField(default=dict, blank=True)
 
     # Metadata
     media_type = models.CharField(max_length=20, choices=MEDIA_TYPES)
     file_name = models.CharField(max_length=255)
     file_size = models.PositiveIntegerField()  # in bytes
+    processed_size = models.PositiveBigIntegerField(default=0)  # optimized copy, thumbnail and variants
     mime_type = models.CharField(max_length=100)
 
     # Image/Video specific
@@ -60,11 +104,12 @@ class MediaFile(models.Model):
     @property
     def file_size_human(self):
         """Return human readable file size"""
+        size = self.file_size
         for unit in ['B', 'KB', 'MB', 'GB']:
-            if self.file_size < 1024.0:
-                return f"{self.file_size:.1f} {unit}"
-            self.file_size /= 1024.0
-        return f"{self.file_size:.1f} TB"
+            if size < 1024.0:
+                return f"{size:.1f} {unit}"
+            size /= 1024.0
+        return f"{size:.1f} TB"
 
     @property
     def aspect_ratio(self):
@@ -73,10 +118,26 @@ class MediaFile(models.Model):
             return self.width / self.height
         return None
 
+    @property
+    def processing_status(self):
+        if self.is_processed:
+            return 'processed'
+        if self.processing_error:
+            return 'failed'
+        return 'pending'
+
     def save(self, *args, **kwargs):
-        if not self.pk:  # New file
-            self.process_file()
+        # The UUID primary key is set on creation, so self.pk can't tell new rows apart
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        # Files whose blob was processed before are copied processed already
+        if adding and not self.is_processed:
+            self.enqueue_processing()
+
+    def enqueue_processing(self):
+        """Process the file on the background worker pool after the upload commits."""
+        from .processing import process_media_file
+        background.enqueue(process_media_file, str(self.pk))
 
     def process_file(self):
         """Process the uploaded file based on type"""
@@ -88,42 +149,158 @@ class MediaFile(models.Model):
     def process_image(self):
         """Optimize and create thumbnails for images"""
         try:
-            with Image.open(self.original_file.path) as img:
+            with self.original_file.open('rb') as f, Image.open(f) as img:
                 # Get dimensions
                 self.width, self.height = img.size
 
                 # Create optimized version
-                optimized = img.copy()
-                if optimized.mode in ('RGBA', 'P'):
-                    optimized = optimized.convert('RGB')
+                optimized = img.convert('RGB') if img.mode != 'RGB' else img.copy()
 
                 # Resize if too large
-                max_size = (1920, 1920)
-                if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                    optimized.thumbnail(max_size, Image.Resampling.LANCZOS)
+                optimized.thumbnail((1920, 1920), Image.Resampling.LANCZOS)
 
-                # Save optimized version
-                optimized_path = self.original_file.path.replace('original', 'optimized')
-                os.makedirs(os.path.dirname(optimized_path), exist_ok=True)
-                optimized.save(optimized_path, 'JPEG', quality=85, optimize=True)
+                name = os.path.splitext(os.path.basename(self.original_file.name))[0] + '.jpg'
+                self.optimized_file.save(name, _encode_jpeg(optimized, quality=85, optimize=True), save=False)
 
                 # Create thumbnail
-                thumbnail = img.copy()
+                thumbnail = optimized.copy()
                 thumbnail.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                thumbnail_path = self.original_file.path.replace('original', 'thumbnails')
-                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
-                thumbnail.save(thumbnail_path, 'JPEG', quality=80)
+                self.thumbnail.save(name, _encode_jpeg(thumbnail, quality=80), save=False)
 
-                self.is_processed = True
+            # Responsive WebP/AVIF versions for srcset
+            self.variants = images.generate_variants(
+                self.original_file.storage, self.original_file.name, VARIANT_WIDTHS
+            )
+
+            self.processed_size = self.get_processed_size()
+            self.is_processed = True
+            self.processing_error = None
 
         except Exception as e:
             self.processing_error = str(e)
 
+    def get_processed_size(self):
+        """Bytes taken by the files generated from the original."""
+        storage = self.original_file.storage
+        names = [file.name for file in (self.optimized_file, self.thumbnail) if file]
+        names += images.variant_names(self.variants)
+        return sum(storage.size(name) for name in names)
+
     def process_video(self):
-        """Process video files (placeholder for video processing)"""
-        # This would integrate with FFmpeg or similar for video processing
-        # For now, just mark as processed
-        self.is_processed = True
+        """Read video metadata, extract a poster frame and make a faststart MP4 copy"""
+        if not video.is_available():
+            # Without ffmpeg the video is served as uploaded
+            self.is_processed = True
+            return
+
+        stem = os.path.splitext(os.path.basename(self.original_file.name))[0]
+        try:
+            with video.processing_slot(), tempfile.TemporaryDirectory() as tmp_dir:
+                path = self.original_file.path
+                metadata = video.probe(path)
+                self.width, self.height, self.duration = metadata['width'], metadata['height'], metadata['duration']
+
+                # Poster frame, also used for the video's responsive variants
+                with Image.open(BytesIO(video.extract_poster(path, self.duration))) as frame:
+                    poster = frame.convert('RGB')
+                poster.thumbnail((1280, 1280), Image.Resampling.LANCZOS)
+                self.thumbnail.save(stem + '.jpg', _encode_jpeg(poster, quality=85, optimize=True), save=False)
+
+                output = os.path.join(tmp_dir, stem + '.mp4')
+                video.transcode(path, output, metadata)
+                with open(output, 'rb') as f:
+                    self.optimized_file.save(stem + '.mp4', File(f), save=False)
+
+            self.variants = images.generate_variants(
+                self.thumbnail.storage, self.thumbnail.name, VARIANT_WIDTHS
+            )
+
+            self.processed_size = self.get_processed_size()
+            self.is_processed = True
+            self.processing_error = None
+
+        except Exception as e:
+            # Drop whatever was written before the failure
+            for file in (self.thumbnail, self.optimized_file):
+                if file:
+                    file.storage.delete(file.name)
+                    file.name = None
+            self.processing_error = str(e)
+
+
+def _encode_jpeg(image, **options):
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', **options)
+    return ContentFile(buffer.getvalue())
+
+
+class UploadSession(models.Model):
+    """
+    A chunked upload in progress. Chunks are appended to a temporary file
+    until ``received_bytes`` reaches ``file_size``; a client whose connection
+    dropped asks for ``received_bytes`` and resumes from there.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+
+    file_name = models.CharField(max_length=255)
+    file_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+
+    # Detected from the first chunk's magic bytes
+    media_type = models.CharField(max_length=20, choices=MediaFile.MEDIA_TYPES, blank=True)
+    mime_type = models.CharField(max_length=100, blank=True)
+
+    alt_text = models.CharField(max_length=255, blank=True)
+    caption = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.received_bytes}/{self.file_size} bytes)"
+
+    @property
+    def is_complete(self):
+        return self.received_bytes == self.file_size
+
+
+class MediaUsage(models.Model):
+    """
+    Running totals of a user's uploaded media, updated as media files are
+    created and deleted so stats and quota checks never scan ``MediaFile``.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='media_usage')
+
+    total_files = models.PositiveIntegerField(default=0)
+    total_size = models.PositiveBigIntegerField(default=0)  # in bytes
+    processed_size = models.PositiveBigIntegerField(default=0)  # generated copies and thumbnails
+
+    image_count = models.PositiveIntegerField(default=0)
+    image_size = models.PositiveBigIntegerField(default=0)
+    video_count = models.PositiveIntegerField(default=0)
+    video_size = models.PositiveBigIntegerField(default=0)
+    audio_count = models.PositiveIntegerField(default=0)
+    audio_size = models.PositiveBigIntegerField(default=0)
+    document_count = models.PositiveIntegerField(default=0)
+    document_size = models.PositiveBigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.total_files} files, {self.used_bytes} bytes"
+
+    @property
+    def used_bytes(self):
+        """Bytes counted against the storage quota."""
+        return self.total_size + self.processed_size
 
 
 class MediaCollection(models.Model):
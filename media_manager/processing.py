@@ -0,0 +1,79 @@
+"""
+Background processing of uploaded media files.
+
+``upload_media`` only stores the original file; ``MediaFile.save`` then
+enqueues ``process_media_file`` on the background worker pool, which decodes
+the file, writes the optimized copy and thumbnail and marks the row as
+processed. Clients poll the detail endpoint for ``status``.
+
+Results are also stored on the file's ``MediaBlob`` and copied to every
+other file with the same content, so duplicates are processed only once.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .blobs import SHARED_FIELDS, delete_files
+from .models import MediaBlob, MediaFile
+from . import usage
+
+PROCESSED_FIELDS = [
+    'width', 'height', 'duration', 'optimized_file', 'thumbnail', 'variants', 'processed_size',
+    'is_processed', 'processing_error',
+]
+
+
+def process_media_file(media_id):
+    """Generate variants and metadata for one media file."""
+    try:
+        media_file = MediaFile.objects.get(pk=media_id)
+    except MediaFile.DoesNotExist:
+        # Deleted before the worker got to it
+        return
+
+    blob = media_file.blob
+    if blob is not None and blob.is_processed:
+        # Another upload of the same content was processed first
+        processed = {field: getattr(blob, field) for field in SHARED_FIELDS}
+    else:
+        media_file.process_file()
+        processed = {field: getattr(media_file, field) for field in PROCESSED_FIELDS}
+        if blob is not None and media_file.is_processed:
+            processed = share_results(blob, media_file, processed)
+
+    save_results(media_id, processed)
+
+
+@transaction.atomic
+def save_results(media_id, processed):
+    """
+    Write processing results to a media file and charge the bytes of the
+    generated files to its owner's usage in the same transaction.
+    """
+    row = MediaFile.objects.select_for_update().filter(pk=media_id).values_list(
+        'user_id', 'processed_size'
+    ).first()
+    if row is None:
+        return
+    user_id, old_size = row
+
+    # Update only the processing fields, so metadata edited while the job ran is kept
+    MediaFile.objects.filter(pk=media_id).update(updated_at=timezone.now(), **processed)
+    usage.apply_processed(user_id, processed.get('processed_size', old_size) - old_size)
+
+
+def share_results(blob, media_file, processed):
+    """
+    Store processing results on the blob and hand them to the blob's other
+    unprocessed files. Returns the results the file should keep.
+    """
+    shared = {field: getattr(media_file, field) for field in SHARED_FIELDS}
+    if not MediaBlob.objects.filter(pk=blob.pk, is_processed=False).update(**shared):
+        # A concurrent job for the same content won; use its files and drop ours
+        delete_files([media_file.optimized_file, media_file.thumbnail], media_file.variants)
+        blob.refresh_from_db()
+        return {field: getattr(blob, field) for field in SHARED_FIELDS}
+
+    pending = MediaFile.objects.filter(blob=blob, is_processed=False).exclude(pk=media_file.pk)
+    for pending_id in pending.values_list('pk', flat=True):
+        save_results(pending_id, shared)
+    return processed
@@ -0,0 +1,51 @@
+"""
+Per-user storage quota.
+
+A user's storage is the bytes of their uploads plus the files generated from
+them, as recorded in their ``MediaUsage`` row, plus the declared size of
+chunked uploads still in progress. ``MEDIA_STORAGE_QUOTA`` sets the limit in
+bytes; 0 disables it.
+"""
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import UploadSession
+from .usage import get_usage, lock_usage
+
+
+class QuotaExceeded(Exception):
+    """An upload that would take a user over their storage quota."""
+
+    def __init__(self, used, quota):
+        super().__init__('Storage quota exceeded')
+        self.used = used
+        self.quota = quota
+
+
+def get_quota():
+    return getattr(settings, 'MEDIA_STORAGE_QUOTA', 0)
+
+
+def reserved_bytes(user, exclude_session=None):
+    """Bytes promised to the user's unfinished chunked uploads."""
+    sessions = UploadSession.objects.filter(user=user)
+    if exclude_session is not None:
+        sessions = sessions.exclude(pk=exclude_session.pk)
+    return sessions.aggregate(total=Sum('file_size'))['total'] or 0
+
+
+def check_quota(user, size, exclude_session=None, lock=False):
+    """
+    Raise ``QuotaExceeded`` if adding ``size`` bytes would take the user over
+    their quota. With ``lock``, the usage row stays locked until the current
+    transaction ends, so the bytes can be recorded before another upload by
+    the same user is checked.
+    """
+    quota = get_quota()
+    if not quota:
+        return
+
+    usage = lock_usage(user) if lock else get_usage(user)
+    used = usage.used_bytes + reserved_bytes(user, exclude_session)
+    if used + size > quota:
+        raise QuotaExceeded(used, quota)
@@ -0,0 +1,208 @@
+"""
+Serving uploaded files from ``MEDIA_ROOT``.
+
+Every response carries an ``ETag`` and ``Last-Modified``, so
+``If-None-Match`` and ``If-Modified-Since`` revalidations are answered with
+a 304 without reading the file. Content-addressed blobs and image variants
+use the content hash in their name; other files get a validator built from
+their modification time and size, so no file is ever hashed in a request.
+
+Single ``Range`` requests (honouring ``If-Range``) get a 206 with just the
+requested bytes, so seeking in a video does not download it from the
+start. Files whose name includes a hash of their content (blobs and image
+variants) are sent with a year-long ``immutable`` ``Cache-Control``; other
+files may be reused for ``MEDIA_CACHE_MAX_AGE`` seconds and are then
+revalidated.
+
+Only files under the upload directories in ``MEDIA_SERVE_PREFIXES`` are
+served, never dotfiles such as the working files of management commands.
+Responses carry ``X-Content-Type-Options: nosniff``, and anything but
+images, video and audio (SVG included, as it can run scripts) is sent as
+an attachment so it is never rendered on this origin.
+
+With ``MEDIA_SENDFILE`` set to ``'x-sendfile'`` (Apache, lighttpd) or
+``'x-accel-redirect'`` (nginx), Django only checks the request and sets
+the headers; the front proxy sends the file and handles ranges itself.
+"""
+import mimetypes
+import os
+import re
+import stat as stat_module
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from social_platform.images import CONTENT_HASH_LENGTH
+
+BLOB_NAME = re.compile(r'(?:^|/)media/blobs/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:\.\w+)?$')
+VARIANT_NAME = re.compile(rf'/variants/[^/]+\.(?P<digest>[0-9a-f]{{{CONTENT_HASH_LENGTH}}})\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+READ_SIZE = 64 * 1024
+
+
+def get_serve_prefixes():
+    return getattr(settings, 'MEDIA_SERVE_PREFIXES', ('media/', 'post_images/', 'profile_pics/'))
+
+
+def is_servable(name):
+    """Whether ``name`` is an uploaded file that may be served publicly."""
+    parts = name.split('/')
+    if any(not part or part.startswith('.') for part in parts):
+        return False
+    return name.startswith(tuple(get_serve_prefixes()))
+
+
+def is_inline(content_type):
+    """Whether browsers may display a file of this type in place."""
+    return content_type.split('/')[0] in ('image', 'video', 'audio') and content_type != 'image/svg+xml'
+
+
+def get_max_age():
+    return getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+
+
+def get_sendfile_mode():
+    return getattr(settings, 'MEDIA_SENDFILE', '')
+
+
+def get_accel_redirect_prefix():
+    return getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+
+def is_immutable(name):
+    return bool(BLOB_NAME.search(name) or VARIANT_NAME.search(name))
+
+
+def file_etag(name, stat):
+    """
+    Return the file's ETag: the content hash in a blob or variant name, or
+    else one derived from its modification time and size.
+    """
+    match = BLOB_NAME.search(name) or VARIANT_NAME.search(name)
+    if match:
+        return f'"{match["digest"]}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive ``(start, end)`` byte range requested by a
+    ``Range`` header, or None if the whole file should be sent (multiple or
+    malformed ranges). Raises ``ValueError`` if the range is unsatisfiable.
+    """
+    match = RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length or not size:
+            raise ValueError('Empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('Range starts after the end of the file')
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _file_response(request, name, path, size, etag, last_modified, content_type):
+    mode = get_sendfile_mode()
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Accel-Redirect'] = get_accel_redirect_prefix().rstrip('/') + '/' + quote(name)
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Sendfile'] = path
+        return response
+
+    byte_range = None
+    if 'Range' in request.headers and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    head = request.method == 'HEAD'
+    if byte_range is None:
+        if head:
+            response = HttpResponse(content_type=content_type)
+        else:
+            # FileResponse lets the WSGI server use sendfile() where it can
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.headers['Content-Length'] = size
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    if head:
+        response = HttpResponse(status=206, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(_iter_range(path, start, length), status=206, content_type=content_type)
+    response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.headers['Content-Length'] = length
+    return response
+
+
+def serve_file(request, name):
+    """Return a response for the file stored at ``name`` in ``MEDIA_ROOT``."""
+    if not is_servable(name):
+        raise Http404('File not found')
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('File not found')
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise Http404('File not found')
+
+    etag = file_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, name, path, stat.st_size, etag, last_modified, content_type)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if not is_inline(content_type):
+        response.headers['Content-Disposition'] = 'attachment'
+    if response.status_code in (200, 206, 304):
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = (
+            IMMUTABLE_CACHE_CONTROL if is_immutable(name) else f'public, max-age={get_max_age()}'
+        )
+    return response
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from .models import MediaFile
+from . import blobs, usage
+
+
+@receiver(post_save, sender=MediaFile)
+def add_media_usage(sender, instance, created, **kwargs):
+    """Count a new media file towards its owner's usage."""
+    if created:
+        usage.apply_change(
+            instance.user_id, instance.media_type, files=1, size=instance.file_size,
+            processed_size=instance.processed_size,
+        )
+
+
+@receiver(post_delete, sender=MediaFile)
+def remove_media_usage(sender, instance, **kwargs):
+    """Take a deleted media file off its owner's usage."""
+    if isinstance(kwargs.get('origin'), User):
+        # The owner is being deleted, and their usage row with them
+        return
+    usage.apply_change(
+        instance.user_id, instance.media_type, files=-1, size=-instance.file_size,
+        processed_size=-instance.processed_size,
+    )
+
+
+@receiver(post_delete, sender=MediaFile)
+def release_media_files(sender, instance, **kwargs):
+    """Release a deleted media file's stored files, however it was deleted."""
+    if instance.blob_id:
+        # Physical files are shared and only deleted with the last reference
+        blobs.release(instance.blob_id)
+    else:
+        files = [instance.original_file, instance.optimized_file, instance.thumbnail]
+        transaction.on_commit(lambda: blobs.delete_files(files, instance.variants))
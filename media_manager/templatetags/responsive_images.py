@@ -0,0 +1,51 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+def _is_current(image, manifest):
+    return bool(image and manifest and manifest.get('source') == image.name)
+
+
+@register.simple_tag
+def image_sources(image, manifest, sizes='100vw'):
+    """
+    Render ``<source>`` elements for the responsive variants of an image, to
+    be placed in a ``<picture>`` ahead of its ``<img>`` fallback::
+
+        <picture>{% image_sources post.image post.image_variants "50vw" %}<img src="..."></picture>
+
+    Renders nothing until variants exist for the image's current file.
+    """
+    if not _is_current(image, manifest):
+        return ''
+
+    storage = image.storage
+    return format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+        (mime_type, ', '.join(f'{storage.url(name)} {width}w' for width, name in candidates), sizes)
+        for mime_type, candidates in manifest.get('formats', {}).items() if candidates
+    ))
+
+
+@register.simple_tag
+def image_placeholder(image, manifest):
+    """
+    Render ``width``/``height`` attributes and an inline blurred placeholder
+    for an ``<img>``, so the browser reserves the image's space and paints
+    something before the image itself arrives::
+
+        <img src="{{ post.image.url }}" {% image_placeholder post.image post.image_variants %}>
+
+    Renders nothing until the image has been processed.
+    """
+    if not _is_current(image, manifest) or not manifest.get('width'):
+        return ''
+
+    attributes = format_html('width="{}" height="{}"', manifest['width'], manifest['height'])
+    if manifest.get('placeholder'):
+        attributes += format_html(
+            ' style="background: url({}) center / cover no-repeat" data-placeholder',
+            manifest['placeholder'],
+        )
+    return attributes
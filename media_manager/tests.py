@@ -1,3 +1,725 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import sys
+import threading
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from social_platform import background
+from social_platform.test_utils import MediaStorageMixin
+from . import uploads, video
+from .models import MediaBlob, MediaFile, MediaUsage, UploadSession
+from .processing import process_media_file
+from .usage import compute_usage, get_usage
+
+
+def make_image(name='photo.png', size=(2400, 1200), mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class MediaProcessingTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='uploader', password='testpass123')
+        self.client = Client()
+        self.client.login(username='uploader', password='testpass123')
+
+    def upload(self):
+        return self.client.post(reverse('media_manager:upload'), {'file': make_image()})
+
+    def test_upload_returns_before_processing(self):
+        """Test that the upload only stores the original and reports a pending job."""
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+
+        media_file = MediaFile.objects.get()
+        self.assertFalse(media_file.is_processed)
+        self.assertFalse(media_file.thumbnail)
+
+    def test_job_runs_after_commit(self):
+        """Test that the enqueued job fills in dimensions and variants."""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.upload()
+        self.assertEqual(len(callbacks), 1)
+
+        media_file = MediaFile.objects.get()
+        self.assertTrue(media_file.is_processed)
+        self.assertEqual((media_file.width, media_file.height), (2400, 1200))
+        with Image.open(media_file.optimized_file.path) as optimized:
+            self.assertEqual(optimized.size, (1920, 960))
+        with Image.open(media_file.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (300, 150))
+        self.assertEqual(
+            [width for width, _ in media_file.variants['formats']['image/webp']],
+            [320, 640, 1280, 1920],
+        )
+
+    def test_detail_endpoint_reports_status(self):
+        """Test polling the detail endpoint for the processing status."""
+        media_id = self.upload().json()['id']
+        url = reverse('media_manager:detail', args=[media_id])
+
+        response = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['status'], 'pending')
+
+        process_media_file(media_id)
+        data = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(data['status'], 'processed')
+        self.assertIsNotNone(data['thumbnail_url'])
+
+    def test_undecodable_image_is_marked_failed(self):
+        """Test that a broken image records the error instead of raising."""
+        media_file = MediaFile.objects.create(
+            user=self.user,
+            original_file=SimpleUploadedFile('broken.jpg', b'not an image'),
+            media_type='image',
+            file_name='broken.jpg',
+            file_size=12,
+            mime_type='image/jpeg',
+        )
+        process_media_file(media_file.pk)
+        media_file.refresh_from_db()
+        self.assertEqual(media_file.processing_status, 'failed')
+
+    def test_job_for_deleted_file_is_ignored(self):
+        """Test that a job whose media file was deleted is a no-op."""
+        media_id = self.upload().json()['id']
+        MediaFile.objects.filter(pk=media_id).delete()
+        process_media_file(media_id)
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class MediaDeduplicationTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = make_image().read()
+        self.clients = []
+        for username in ('first', 'second'):
+            User.objects.create_user(username=username, password='testpass123')
+            client = Client()
+            client.login(username=username, password='testpass123')
+            self.clients.append(client)
+
+    def upload(self, client):
+        upload = SimpleUploadedFile('meme.png', self.image, content_type='image/png')
+        return client.post(reverse('media_manager:upload'), {'file': upload}).json()
+
+    def test_same_content_is_stored_once(self):
+        """Test that identical uploads share one content-addressed blob."""
+        first, second = (self.upload(client) for client in self.clients)
+
+        blob = MediaBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertIn(blob.digest, blob.file.name)
+        self.assertEqual(first['url'], second['url'])
+        self.assertEqual(MediaFile.objects.filter(blob=blob).count(), 2)
+
+    def test_type_and_digest_come_from_the_content(self):
+        """Test that the upload is typed by its bytes and hashed as it streams in."""
+        fake = SimpleUploadedFile('photo.png', b'<html><script>alert(1)</script></html>', content_type='image/png')
+        response = self.clients[0].post(reverse('media_manager:upload'), {'file': fake})
+        self.assertEqual(response.status_code, 400)
+
+        renamed = SimpleUploadedFile('meme.html', self.image, content_type='text/html')
+        response = self.clients[0].post(reverse('media_manager:upload'), {'file': renamed})
+        self.assertEqual(response.json()['error'], 'File name does not match its content')
+        self.assertFalse(MediaBlob.objects.exists())
+
+        self.upload(self.clients[0])
+        self.assertEqual(MediaBlob.objects.get().digest, hashlib.sha256(self.image).hexdigest())
+
+    def test_upload_still_checks_csrf(self):
+        """Test that installing the hashing handler does not drop the CSRF check."""
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='first', password='testpass123')
+        upload = SimpleUploadedFile('meme.png', self.image, content_type='image/png')
+        self.assertEqual(client.post(reverse('media_manager:upload'), {'file': upload}).status_code, 403)
+
+    def test_processed_blob_is_reused(self):
+        """Test that a duplicate of processed content needs no processing of its own."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(self.clients[0])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.upload(self.clients[1])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(response['status'], 'processed')
+
+        first, second = MediaFile.objects.order_by('created_at')
+        self.assertEqual(second.thumbnail.name, first.thumbnail.name)
+        self.assertEqual(second.variants, first.variants)
+
+    def test_processing_is_shared_with_pending_duplicates(self):
+        """Test that processing one upload completes its pending duplicates too."""
+        first = self.upload(self.clients[0])
+        self.upload(self.clients[1])
+
+        process_media_file(first['id'])
+        self.assertEqual(MediaFile.objects.filter(is_processed=True).count(), 2)
+        self.assertTrue(MediaBlob.objects.get().is_processed)
+
+    def test_files_deleted_with_last_reference(self):
+        """Test that stored files outlive all but the last referencing media file."""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.upload(self.clients[0])
+        second = self.upload(self.clients[1])
+        blob = MediaBlob.objects.get()
+        paths = [blob.file.path, blob.thumbnail.path, blob.optimized_file.path]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.clients[0].delete(reverse('media_manager:delete', args=[first['id']]))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.clients[1].delete(reverse('media_manager:delete', args=[second['id']]))
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_references_released_outside_the_view(self):
+        """Test that account deletion and bulk deletes release their blob references."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(self.clients[0])
+        self.upload(self.clients[1])
+        path = MediaBlob.objects.get().file.path
+
+        User.objects.get(username='first').delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MediaFile.objects.all().delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(BACKGROUND_WORKERS=0, MEDIA_UPLOAD_CHUNK_SIZE=1024)
+class ChunkedUploadTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = self.make_temp_dir()
+        dir_override = override_settings(MEDIA_UPLOAD_TEMP_DIR=self.upload_dir)
+        dir_override.enable()
+        self.addCleanup(dir_override.disable)
+        User.objects.create_user(username='uploader', password='testpass123')
+        self.client = Client()
+        self.client.login(username='uploader', password='testpass123')
+        buffer = BytesIO()
+        Image.effect_noise((64, 64), 64).save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+
+    def start(self, file_size=None, file_name='large.png'):
+        response = self.client.post(reverse('media_manager:upload_session_create'), {
+            'file_name': file_name,
+            'file_size': len(self.data) if file_size is None else file_size,
+        })
+        return response
+
+    def send(self, session, offset, chunk):
+        return self.client.post(
+            session['url'], chunk, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_upload_in_chunks(self):
+        """Test that chunks are appended in order and finalized into a media file."""
+        session = self.start().json()
+        self.assertEqual(session['offset'], 0)
+
+        for offset in range(0, len(self.data), 1024):
+            response = self.send(session, offset, self.data[offset:offset + 1024])
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['offset'], len(self.data))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(session['complete_url'])
+        self.assertEqual(response.status_code, 202)
+        media_file = MediaFile.objects.get()
+        self.assertEqual((media_file.media_type, media_file.mime_type), ('image', 'image/png'))
+        with media_file.original_file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_resume_after_dropped_chunk(self):
+        """Test that a client can ask for the offset and resume from it."""
+        session = self.start().json()
+        self.send(session, 0, self.data[:1024])
+
+        # A retry of an old offset is refused with the offset to resume from
+        response = self.send(session, 0, self.data[:1024])
+        self.assertEqual(response.status_code, 409)
+        offset = self.client.get(session['url']).json()['offset']
+        self.assertEqual(offset, 1024)
+
+        for start in range(offset, len(self.data), 1024):
+            self.send(session, start, self.data[start:start + 1024])
+        self.assertEqual(self.client.post(session['complete_url']).status_code, 202)
+
+    def test_rejects_unknown_type_on_first_chunk(self):
+        """Test that the file type is checked by magic bytes before anything is kept."""
+        session = self.start(file_size=100).json()
+        response = self.send(session, 0, b'MZ' + b'\0' * 98)
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(UploadSession.objects.get().received_bytes, 0)
+
+    def test_stored_extension_follows_detected_type(self):
+        """Test that the client's file name cannot choose how the stored file is served."""
+        data = b'\xff\xd8\xff\xe0' + b'<html><script>alert(1)</script></html>'
+        session = self.start(file_size=len(data), file_name='x.html').json()
+        self.send(session, 0, data)
+        self.assertEqual(self.client.post(session['complete_url']).status_code, 202)
+
+        media_file = MediaFile.objects.get()
+        self.assertTrue(media_file.original_file.name.endswith('.jpg'))
+        response = self.client.get(media_file.original_file.url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_rejects_oversized_chunks_and_files(self):
+        """Test the per-chunk and per-file size limits."""
+        session = self.start().json()
+        self.assertEqual(self.send(session, 0, self.data[:2048]).status_code, 413)
+
+        with override_settings(MEDIA_UPLOAD_MAX_SIZE=100):
+            self.assertEqual(self.start(file_size=101).status_code, 413)
+
+    def test_completion_is_applied_once(self):
+        """Test that a retried completion of a finished session is refused instead of duplicating the file."""
+        session = self.start().json()
+        for offset in range(0, len(self.data), 1024):
+            self.send(session, offset, self.data[offset:offset + 1024])
+        stale = UploadSession.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            uploads.complete(UploadSession.objects.get())
+        with self.assertRaises(uploads.UploadError) as error:
+            uploads.complete(stale)
+        self.assertEqual(error.exception.status, 404)
+        self.assertEqual(MediaFile.objects.count(), 1)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_completion_over_quota_keeps_the_upload(self):
+        """Test that a completion refused by the quota leaves the upload in place to retry."""
+        session = self.start().json()
+        for offset in range(0, len(self.data), 1024):
+            self.send(session, offset, self.data[offset:offset + 1024])
+
+        with override_settings(MEDIA_STORAGE_QUOTA=100):
+            self.assertEqual(self.client.post(session['complete_url']).status_code, 413)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'media/blobs')), [])
+        with open(uploads.temp_path(UploadSession.objects.get()), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        self.assertEqual(self.client.post(session['complete_url']).status_code, 202)
+
+    def test_stale_retry_does_not_overwrite_received_bytes(self):
+        """Test that a retry racing the original chunk request is refused without touching the file."""
+        session = self.start().json()
+        stale = UploadSession.objects.get()
+        self.send(session, 0, self.data[:1024])
+        self.send(session, 1024, self.data[1024:2048])
+
+        with self.assertRaises(uploads.UploadError) as error:
+            uploads.append_chunk(stale, 0, BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 8))
+        self.assertEqual(error.exception.status, 409)
+        with open(uploads.temp_path(stale), 'rb') as f:
+            self.assertEqual(f.read(), self.data[:2048])
+
+    def test_incomplete_upload_cannot_be_finalized(self):
+        """Test that finalizing before all bytes arrived is refused."""
+        session = self.start().json()
+        self.send(session, 0, self.data[:1024])
+        self.assertEqual(self.client.post(session['complete_url']).status_code, 409)
+        self.assertFalse(MediaFile.objects.exists())
+
+
+class MediaUsageTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='collector', password='testpass123')
+        self.client = Client()
+        self.client.login(username='collector', password='testpass123')
+
+    def add_file(self, media_type='image', size=1000):
+        # Rows are created processed so no background job is queued
+        return MediaFile.objects.create(
+            user=self.user,
+            original_file=f'media/original/{media_type}.bin',
+            media_type=media_type,
+            file_name=f'{media_type}.bin',
+            file_size=size,
+            mime_type='application/octet-stream',
+            is_processed=True,
+        )
+
+    def test_totals_follow_uploads_and_deletes(self):
+        """Test that the usage row is adjusted as files are added and removed."""
+        self.add_file('image', 1000)
+        video = self.add_file('video', 5000)
+        self.add_file('audio', 300)
+        video.delete()
+
+        usage = MediaUsage.objects.get(user=self.user)
+        self.assertEqual((usage.total_files, usage.total_size), (2, 1300))
+        self.assertEqual((usage.image_count, usage.image_size), (1, 1000))
+        self.assertEqual((usage.video_count, usage.video_size), (0, 0))
+        expected = compute_usage(self.user.pk)
+        self.assertEqual({field: getattr(usage, field) for field in expected}, expected)
+
+    def test_deleting_owner_drops_usage(self):
+        """Test that deleting a user with media does not recreate their usage row."""
+        self.add_file('image', 1000)
+        self.user.delete()
+        self.assertFalse(MediaUsage.objects.exists())
+
+    def test_missing_row_is_built_from_aggregate(self):
+        """Test that a user without a usage row gets one computed from their files."""
+        self.add_file('image', 1000)
+        self.add_file('image', 2000)
+        MediaUsage.objects.all().delete()
+
+        usage = get_usage(self.user)
+        self.assertEqual((usage.image_count, usage.image_size), (2, 3000))
+
+    def test_stats_endpoint_reads_summary(self):
+        """Test that the stats endpoint reports the totals with a constant number of queries."""
+        self.add_file('image', 1000)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('media_manager:stats'))
+
+        for _ in range(20):
+            self.add_file('video', 2048)
+        with CaptureQueriesContext(connection) as many:
+            data = self.client.get(reverse('media_manager:stats')).json()
+
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(data['total_files'], 21)
+        self.assertEqual(data['by_type']['videos'], 20)
+        self.assertEqual(data['size_by_type']['videos'], 20 * 2048)
+        self.assertEqual(data['total_size'], 1000 + 20 * 2048)
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class StorageQuotaTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='hoarder', password='testpass123')
+        self.client = Client()
+        self.client.login(username='hoarder', password='testpass123')
+        self.image = make_image(size=(800, 600)).read()
+
+    def upload(self, name='photo.png'):
+        upload = SimpleUploadedFile(name, self.image, content_type='image/png')
+        return self.client.post(reverse('media_manager:upload'), {'file': upload})
+
+    def test_upload_over_quota_is_rejected_before_storing(self):
+        """Test that an upload that does not fit is refused and nothing is written."""
+        with override_settings(MEDIA_STORAGE_QUOTA=len(self.image) // 2):
+            response = self.upload()
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'media')))
+
+    def test_processing_bytes_are_charged(self):
+        """Test that generated files count towards usage and are released on delete."""
+        with self.captureOnCommitCallbacks(execute=True):
+            media_id = self.upload().json()['id']
+        media_file = MediaFile.objects.get(pk=media_id)
+        self.assertGreater(media_file.processed_size, 0)
+
+        usage = get_usage(self.user)
+        self.assertEqual(usage.processed_size, media_file.processed_size)
+        self.assertEqual(usage.used_bytes, len(self.image) + media_file.processed_size)
+
+        self.client.delete(reverse('media_manager:delete', args=[media_id]))
+        usage.refresh_from_db()
+        self.assertEqual(usage.used_bytes, 0)
+
+    def test_chunked_uploads_reserve_quota(self):
+        """Test that unfinished chunked uploads count against the quota."""
+        url = reverse('media_manager:upload_session_create')
+        with override_settings(MEDIA_STORAGE_QUOTA=1000):
+            first = self.client.post(url, {'file_name': 'a.mp4', 'file_size': 600})
+            second = self.client.post(url, {'file_name': 'b.mp4', 'file_size': 600})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 413)
+
+    def test_repair_command_fixes_drift(self):
+        """Test that the repair command rebuilds drifted and missing usage rows."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload()
+        expected = compute_usage(self.user.pk)
+        MediaUsage.objects.filter(user=self.user).update(total_files=99, processed_size=0)
+        other = User.objects.create_user(username='other', password='testpass123')
+        MediaFile.objects.create(
+            user=other, original_file='media/original/x.mp4', media_type='video',
+            file_name='x.mp4', file_size=10, mime_type='video/mp4', is_processed=True,
+        )
+        MediaUsage.objects.filter(user=other).delete()
+
+        out = StringIO()
+        call_command('repair_media_usage', chunk_size=1, stdout=out)
+        self.assertIn('2 drifted, 2 fixed', out.getvalue())
+        usage = MediaUsage.objects.get(user=self.user)
+        self.assertEqual({field: getattr(usage, field) for field in expected}, expected)
+        self.assertEqual(MediaUsage.objects.get(user=other).video_size, 10)
+
+
+FAKE_FFPROBE = """
+import json, time
+time.sleep({delay})
+print(json.dumps({{
+    'format': {{'duration': '12.5'}},
+    'streams': [
+        {{'codec_type': 'video', 'codec_name': 'hevc', 'pix_fmt': 'yuv420p', 'width': 1920, 'height': 1080,
+          'side_data_list': [{{'rotation': -90}}]}},
+        {{'codec_type': 'audio', 'codec_name': 'aac'}},
+    ],
+}}))
+"""
+
+FAKE_FFMPEG = """
+import shutil, sys
+from io import BytesIO
+from PIL import Image
+args = sys.argv[1:]
+if args[-1] == '-':
+    buffer = BytesIO()
+    Image.new('RGB', (1080, 1920), 'navy').save(buffer, 'PNG')
+    sys.stdout.buffer.write(buffer.getvalue())
+else:
+    shutil.copy(args[args.index('-i') + 1], args[-1])
+"""
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class VideoProcessingTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='filmmaker', password='testpass123')
+        self.bin_dir = self.make_temp_dir()
+
+    def fake_binary(self, name, source):
+        path = os.path.join(self.bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(f'#!{sys.executable}\n{source}')
+        os.chmod(path, 0o755)
+        return path
+
+    def fake_ffmpeg(self, probe_delay=0):
+        return override_settings(
+            FFMPEG_BINARY=self.fake_binary('ffmpeg', FAKE_FFMPEG),
+            FFPROBE_BINARY=self.fake_binary('ffprobe', FAKE_FFPROBE.format(delay=probe_delay)),
+            VIDEO_PROCESSING_LOCK_DIR=os.path.join(self.bin_dir, 'slots'),
+        )
+
+    def upload_video(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            media_file = MediaFile.objects.create(
+                user=self.user,
+                original_file=SimpleUploadedFile('clip.mp4', b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 64),
+                media_type='video',
+                file_name='clip.mp4',
+                file_size=76,
+                mime_type='video/mp4',
+            )
+        media_file.refresh_from_db()
+        return media_file
+
+    def test_video_without_ffmpeg_is_served_as_uploaded(self):
+        """Test that videos are still marked processed when ffmpeg is not installed."""
+        with override_settings(FFMPEG_BINARY='no-such-ffmpeg', FFPROBE_BINARY='no-such-ffprobe'):
+            media_file = self.upload_video()
+        self.assertTrue(media_file.is_processed)
+        self.assertIsNone(media_file.processing_error)
+        self.assertFalse(media_file.thumbnail)
+
+    def test_video_metadata_poster_and_faststart_copy(self):
+        """Test that probing fills in metadata and the poster and MP4 copy are stored."""
+        with self.fake_ffmpeg():
+            media_file = self.upload_video()
+
+        self.assertTrue(media_file.is_processed)
+        # Rotated phone video: the displayed dimensions are portrait
+        self.assertEqual((media_file.width, media_file.height, media_file.duration), (1080, 1920, 12.5))
+        with Image.open(media_file.thumbnail.path) as poster:
+            self.assertEqual(poster.size, (720, 1280))
+        self.assertTrue(media_file.optimized_file.name.endswith('.mp4'))
+        self.assertEqual(media_file.variants['source'], media_file.thumbnail.name)
+        self.assertIn('placeholder', media_file.variants)
+        self.assertEqual(get_usage(self.user).processed_size, media_file.processed_size)
+
+    def test_slow_ffmpeg_times_out(self):
+        """Test that a hung ffprobe is stopped and recorded as a processing error."""
+        with self.fake_ffmpeg(probe_delay=5), override_settings(VIDEO_PROCESSING_TIMEOUT=0.5):
+            media_file = self.upload_video()
+        self.assertFalse(media_file.is_processed)
+        self.assertIn('timed out', media_file.processing_error)
+        self.assertFalse(media_file.thumbnail)
+
+    def test_processing_slots_limit_concurrency(self):
+        """Test that a video waits for a free slot instead of running alongside another."""
+        with self.fake_ffmpeg(), override_settings(VIDEO_PROCESSING_TIMEOUT=0.5):
+            with video.processing_slot():
+                with self.assertRaisesMessage(video.VideoError, 'processing slot'):
+                    with video.processing_slot():
+                        pass
+            with video.processing_slot():
+                pass
+
+
+class MediaServingTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.digest = hashlib.sha256(self.content).hexdigest()
+        stat = os.stat(self.write('media/original/clip.mp4'))
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def write(self, name):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        return path
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', headers=headers)
+
+    def test_full_response_has_validators(self):
+        """Test that files are served with a stat-based ETag and cache headers."""
+        response = self.get('media/original/clip.mp4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+        self.assertNotIn('attachment', response.get('Content-Disposition', ''))
+
+    def test_only_uploads_are_served(self):
+        """Test that dotfiles and files outside the upload directories are not served."""
+        for name in ('.optimize_images.json', 'media/original/.marker', 'exports/report.mp4'):
+            self.write(name)
+            self.assertEqual(self.get(name).status_code, 404)
+
+    def test_non_media_types_are_attachments(self):
+        """Test that files browsers could render as documents are downloaded instead."""
+        for name in ('media/original/page.html', 'media/original/drawing.svg'):
+            self.write(name)
+            response = self.get(name)
+            self.assertEqual(response['Content-Disposition'], 'attachment')
+            self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_conditional_requests_are_not_modified(self):
+        """Test that matching If-None-Match and If-Modified-Since get a 304."""
+        response = self.get('media/original/clip.mp4', if_none_match=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+
+        last_modified = self.get('media/original/clip.mp4')['Last-Modified']
+        response = self.get('media/original/clip.mp4', if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get('media/original/clip.mp4', if_none_match='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_range_requests(self):
+        """Test that byte ranges return only the requested bytes."""
+        response = self.get('media/original/clip.mp4', range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.get('media/original/clip.mp4', range='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-4:])
+
+        response = self.get('media/original/clip.mp4', range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        """Test that a range for an outdated version is ignored."""
+        response = self.get('media/original/clip.mp4', range='bytes=0-9', if_range='"old"')
+        self.assertEqual(response.status_code, 200)
+        response = self.get('media/original/clip.mp4', range='bytes=0-9', if_range=self.etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_content_addressed_files_are_immutable(self):
+        """Test that blobs and hashed variants may be cached forever."""
+        self.write(f'media/blobs/{self.digest[:2]}/{self.digest}.mp4')
+        self.write('post_images/variants/photo_320.0123456789ab.webp')
+        for name, etag in (
+            (f'media/blobs/{self.digest[:2]}/{self.digest}.mp4', f'"{self.digest}"'),
+            ('post_images/variants/photo_320.0123456789ab.webp', '"0123456789ab"'),
+        ):
+            response = self.get(name)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(response['ETag'], etag)
+
+    def test_sendfile_hands_off_to_proxy(self):
+        """Test that the transfer is left to the proxy when configured."""
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get('media/original/clip.mp4')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/media/original/clip.mp4')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], self.etag)
+
+    def test_rewritten_file_gets_a_new_etag(self):
+        """Test that the ETag follows the file's modification time."""
+        path = os.path.join(self.media_root, 'media/original/clip.mp4')
+        os.utime(path, ns=(0, 10 ** 9))
+        self.assertEqual(self.get('media/original/clip.mp4', if_none_match=self.etag).status_code, 200)
+
+    def test_paths_outside_media_root_are_not_found(self):
+        """Test that missing files and path traversal get a 404."""
+        self.assertEqual(self.get('media/original/missing.mp4').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 404)
+        self.assertEqual(self.get('media/original').status_code, 404)
+
+
+@override_settings(BACKGROUND_WORKERS=1)
+class BackgroundPoolTest(MediaStorageMixin, TransactionTestCase):
+    def tearDown(self):
+        background.shutdown()
+        super().tearDown()
+
+    def test_worker_process_processes_upload(self):
+        """Test that a pooled worker process sees the committed row and processes it."""
+        user = User.objects.create_user(username='pooled', password='testpass123')
+        media_file = MediaFile.objects.create(
+            user=user,
+            original_file=make_image(),
+            media_type='image',
+            file_name='photo.png',
+            file_size=1,
+            mime_type='image/png',
+        )
+        background.submit(process_media_file, str(media_file.pk)).result(timeout=60)
+
+        media_file.refresh_from_db()
+        self.assertTrue(media_file.is_processed)
+        self.assertEqual(media_file.width, 2400)
+
+    def test_failed_job_is_logged(self):
+        """Test that an exception raised by a pooled job is logged."""
+        finished = threading.Event()
+        with self.assertLogs('social_platform.background', level='ERROR') as logs:
+            future = background.submit(int, 'not a number')
+            # Callbacks run in order, so this one runs after the logging one
+            future.add_done_callback(lambda future: finished.set())
+            self.assertTrue(finished.wait(timeout=60))
+        self.assertIn('ValueError', logs.output[0])
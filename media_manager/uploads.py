@@ -0,0 +1,307 @@
+"""
+Media upload handling shared by the single-request and chunked upload views.
+
+Chunked uploads follow a three step protocol:
+
+1. ``POST upload/sessions/`` with ``file_name`` and ``file_size`` opens an
+   ``UploadSession``.
+2. ``POST upload/sessions/<id>/`` with the raw chunk as the body and an
+   ``Upload-Offset`` header appends it to a temporary file. The body is read
+   from the request stream in small pieces, so memory use does not depend on
+   the chunk or file size. The first chunk is checked by its magic bytes. A
+   ``GET`` on the same URL returns the offset to resume from.
+3. ``POST upload/sessions/<id>/complete/`` turns the finished file into a
+   ``MediaFile``.
+
+Single-request uploads go through ``HashingUploadHandler``, which hashes the
+file and keeps its first bytes as Django receives it, so the type is checked
+from the content and the file is not read again to be hashed.
+"""
+import fcntl
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, quota
+from .models import MediaFile
+
+ALLOWED_TYPES = {
+    'image': ['image/jpeg', 'image/png', 'image/gif', 'image/webp'],
+    'video': ['video/mp4', 'video/webm', 'video/ogg'],
+    'audio': ['audio/mp3', 'audio/wav', 'audio/ogg'],
+}
+
+# Bytes needed from the start of a file to recognise its type
+SNIFF_LENGTH = 16
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A chunked upload request that cannot be applied."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_chunk_size():
+    return getattr(settings, 'MEDIA_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)
+
+
+def get_max_upload_size():
+    return getattr(settings, 'MEDIA_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+
+
+def get_upload_dir():
+    return getattr(settings, 'MEDIA_UPLOAD_TEMP_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'media_uploads'
+    )
+
+
+def get_media_type(mime_type):
+    for type_name, types in ALLOWED_TYPES.items():
+        if mime_type in types:
+            return type_name
+    return None
+
+
+def sniff_mime_type(head):
+    """Identify a file from its first bytes. Returns a MIME type or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if head.startswith(b'OggS'):
+        return 'video/ogg'
+    if head.startswith(b'ID3') or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return 'audio/mp3'
+    return None
+
+
+def claims_other_type(mime_type, file_name):
+    """Whether ``file_name`` claims a different kind of file than the detected ``mime_type``."""
+    claimed = mimetypes.guess_type(file_name)[0]
+    if not claimed:
+        return False
+    if mime_type == 'video/ogg':
+        # Ogg holds audio as well as video
+        return claimed not in ('audio/ogg', 'video/ogg', 'application/ogg')
+    return claimed.split('/')[0] != mime_type.split('/')[0]
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Record the SHA-256 digest and first bytes of each uploaded file as it
+    streams in, by form field name, and pass the data on unchanged to the
+    handlers that store it.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self.heads = {}
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self._digest = hashlib.sha256()
+        self._head = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self._digest.update(raw_data)
+        if len(self._head) < SNIFF_LENGTH:
+            self._head += raw_data[:SNIFF_LENGTH - len(self._head)]
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._digest.hexdigest()
+        self.heads[self.field_name] = self._head
+        return None
+
+
+def create_media_file(user, file, file_name, media_type, mime_type, alt_text='', caption='', digest=None):
+    """
+    Store an uploaded file once per distinct content and create its
+    ``MediaFile``. Variants are generated by the background workers, or
+    reused if this content was uploaded and processed before.
+
+    Raises ``QuotaExceeded`` if the file does not fit in the user's quota,
+    in which case nothing is stored. ``digest`` is the content's SHA-256 if
+    it was computed while the file was received.
+    """
+    digest = digest or blobs.hash_file(file)
+    staged = blobs.stage_upload(file)
+    try:
+        return _store(
+            user, staged, digest, file.size,
+            file_name=file_name,
+            media_type=media_type,
+            mime_type=mime_type,
+            alt_text=alt_text,
+            caption=caption,
+        )
+    finally:
+        _remove(staged)
+
+
+def _store(user, staged, digest, size, session=None, **fields):
+    """
+    Create a ``MediaFile`` for a staged file in one short transaction: check
+    the quota, then take a reference on the blob with this content or commit
+    the staged file as a new one. ``session`` is the chunked upload being
+    completed, which is deleted with it and whose reservation the file
+    replaces.
+    """
+    name = None
+    try:
+        with transaction.atomic():
+            if session is not None:
+                # Concurrent or retried completions of the session wait
+                # here, then find it gone
+                session = type(session).objects.select_for_update().filter(pk=session.pk).first()
+                if session is None:
+                    raise UploadError('Upload session not found', status=404)
+            # Keeps the usage row locked until the new file has been counted
+            quota.check_quota(user, size, exclude_session=session, lock=True)
+            blob = blobs.acquire(digest)
+            if blob is None:
+                name = blobs.commit(staged, digest, fields['mime_type'])
+                blob = blobs.create(digest, name, size)
+            media_file = MediaFile.objects.create(
+                user=user,
+                original_file=blob.file.name,
+                blob=blob,
+                file_size=size,
+                **fields,
+                **blobs.shared_fields(blob),
+            )
+            if session is not None:
+                discard(session)
+    except BaseException:
+        if name is not None:
+            blobs.uncommit(name, staged)
+        raise
+    return media_file
+
+
+def temp_path(session):
+    return os.path.join(get_upload_dir(), f'{session.pk}.part')
+
+
+def append_chunk(session, offset, stream):
+    """
+    Write the chunk read from ``stream`` at ``offset`` of the session's
+    temporary file. Returns the new offset.
+    """
+    if offset != session.received_bytes:
+        raise UploadError('Offset does not match the bytes received so far', status=409)
+
+    path = temp_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+b') as f:
+        # A retry may arrive while the original request is still writing;
+        # whichever gets the lock second sees the other's offset and stops
+        fcntl.flock(f, fcntl.LOCK_EX)
+        received = type(session).objects.filter(pk=session.pk).values_list('received_bytes', flat=True).first()
+        if received != offset:
+            raise UploadError('Chunk was already received', status=409)
+        written = _write_chunk(session, f, offset, stream)
+        # Conditional, so a duplicate retry of the same chunk cannot count it twice
+        updated = type(session).objects.filter(pk=session.pk, received_bytes=offset).update(
+            received_bytes=offset + written,
+            media_type=session.media_type,
+            mime_type=session.mime_type,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            raise UploadError('Chunk was already received', status=409)
+    session.received_bytes = offset + written
+    return session.received_bytes
+
+
+def _write_chunk(session, f, offset, stream):
+    limit = min(get_chunk_size(), session.file_size - offset)
+    written = 0
+    f.seek(offset)
+    if offset == 0:
+        # Check the type before a single byte is stored
+        head = stream.read(SNIFF_LENGTH)
+        mime_type = sniff_mime_type(head)
+        if not get_media_type(mime_type):
+            raise UploadError('Unsupported file type', status=415)
+        session.mime_type = mime_type
+        session.media_type = get_media_type(mime_type)
+        f.write(head)
+        written = len(head)
+
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        written += len(data)
+        if written > limit:
+            raise UploadError('Chunk is larger than allowed', status=413)
+        f.write(data)
+    f.truncate(offset + written)
+    return written
+
+
+def complete(session):
+    """Turn a fully received upload into a ``MediaFile`` and clean up."""
+    if not session.is_complete:
+        raise UploadError('Upload is incomplete', status=409)
+
+    # Hashing and any copying happen before anything is locked
+    path = temp_path(session)
+    try:
+        with open(path, 'rb') as f:
+            digest = blobs.hash_file(File(f))
+        staged = blobs.stage_file(path)
+    except FileNotFoundError:
+        raise UploadError('Upload session not found', status=404)
+
+    try:
+        return _store(
+            session.user, staged, digest, session.file_size,
+            session=session,
+            file_name=session.file_name,
+            media_type=session.media_type,
+            mime_type=session.mime_type,
+            alt_text=session.alt_text,
+            caption=session.caption,
+        )
+    finally:
+        if staged != path:
+            _remove(staged)
+
+
+def discard(session):
+    """Delete an upload session, and its temporary file once that is committed."""
+    path = temp_path(session)
+    session.delete()
+    transaction.on_commit(lambda: _remove(path))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
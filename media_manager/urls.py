@@ -6,6 +6,9 @@ app_name = 'media_manager'
 urlpatterns = [
     path('', views.media_library, name='library'),
     path('upload/', views.upload_media, name='upload'),
+    path('upload/sessions/', views.create_upload_session, name='upload_session_create'),
+    path('upload/sessions/<uuid:session_id>/', views.upload_session, name='upload_session'),
+    path('upload/sessions/<uuid:session_id>/complete/', views.complete_upload_session, name='upload_session_complete'),
     path('media/<uuid:media_id>/', views.media_detail, name='detail'),
     path('media/<uuid:media_id>/delete/', views.delete_media, name='delete'),
     path('collections/', views.collections, name='collections'),
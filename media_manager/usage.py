@@ -0,0 +1,101 @@
+"""
+Per-user media usage ledger.
+
+``MediaUsage`` holds one row of running totals per user, adjusted with
+``F()`` expressions in the same transaction as the change they account for:
+new and deleted ``MediaFile`` rows (from the model signals) and bytes added
+by processing (from ``processing.save_results``). Reading a user's stats or
+checking their quota is therefore a primary key lookup.
+
+``compute_usage_for`` derives the same totals from ``MediaFile`` in a single
+grouped aggregate; it builds a user's row the first time one is needed and
+``repair_media_usage`` uses it to fix drift.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from .models import MediaFile, MediaUsage
+
+MEDIA_TYPES = [media_type for media_type, _ in MediaFile.MEDIA_TYPES]
+
+USAGE_FIELDS = ['total_files', 'total_size', 'processed_size'] + [
+    f'{media_type}_{suffix}' for media_type in MEDIA_TYPES for suffix in ('count', 'size')
+]
+
+
+def compute_usage_for(user_ids):
+    """Return ``{user_id: totals}`` computed from the users' media files."""
+    usage = {user_id: dict.fromkeys(USAGE_FIELDS, 0) for user_id in user_ids}
+
+    rows = MediaFile.objects.filter(user_id__in=user_ids).order_by().values(
+        'user_id', 'media_type'
+    ).annotate(files=Count('pk'), size=Sum('file_size'), processed=Sum('processed_size'))
+    for row in rows:
+        totals = usage[row['user_id']]
+        totals['total_files'] += row['files']
+        totals['total_size'] += row['size'] or 0
+        totals['processed_size'] += row['processed'] or 0
+        if row['media_type'] in MEDIA_TYPES:
+            totals[f'{row["media_type"]}_count'] = row['files']
+            totals[f'{row["media_type"]}_size'] = row['size'] or 0
+    return usage
+
+
+def compute_usage(user_id):
+    """Return usage totals for a user, computed from their media files."""
+    return compute_usage_for([user_id])[user_id]
+
+
+def get_usage(user):
+    """Return the user's ``MediaUsage`` row, building it if it does not exist yet."""
+    try:
+        return MediaUsage.objects.get(user=user)
+    except MediaUsage.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return MediaUsage.objects.create(user=user, **compute_usage(user.pk))
+    except IntegrityError:
+        return MediaUsage.objects.get(user=user)
+
+
+def lock_usage(user):
+    """
+    Return the user's ``MediaUsage`` row locked until the end of the current
+    transaction, so concurrent uploads by the same user are checked in turn.
+    """
+    get_usage(user)
+    return MediaUsage.objects.select_for_update().get(user=user)
+
+
+def _adjust(field, delta):
+    if delta < 0:
+        # Totals are unsigned; clamp at zero rather than going negative
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def apply_change(user_id, media_type=None, files=0, size=0, processed_size=0):
+    """Add to (or, with negative values, subtract from) a user's totals."""
+    changes = {'total_files': files, 'total_size': size, 'processed_size': processed_size}
+    if media_type in MEDIA_TYPES:
+        changes.update({f'{media_type}_count': files, f'{media_type}_size': size})
+    updates = {field: _adjust(field, delta) for field, delta in changes.items() if delta}
+    if not updates:
+        return
+
+    if MediaUsage.objects.filter(user_id=user_id).update(**updates):
+        return
+
+    # First change for this user: the computed totals already include it
+    try:
+        with transaction.atomic():
+            MediaUsage.objects.create(user_id=user_id, **compute_usage(user_id))
+    except IntegrityError:
+        MediaUsage.objects.filter(user_id=user_id).update(**updates)
+
+
+def apply_processed(user_id, delta):
+    """Account for bytes added (or removed) by processing a user's file."""
+    apply_change(user_id, processed_size=delta)
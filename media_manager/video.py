@@ -0,0 +1,187 @@
+"""
+Video processing with a local ffmpeg.
+
+``MediaFile.process_video`` uses ffprobe to read a video's dimensions and
+duration, grabs a poster frame and writes a copy of the video as an MP4
+with its index at the front (``+faststart``), so browsers can start playing
+before the whole file has downloaded. Videos that already use H.264/AAC are
+only remuxed, which takes a fraction of the time of a re-encode.
+
+Every ffmpeg and ffprobe call is limited to ``VIDEO_PROCESSING_TIMEOUT``
+seconds. ffmpeg uses several cores on its own, so at most
+``VIDEO_PROCESSING_CONCURRENCY`` videos are processed at a time on the host,
+across all worker processes; the slots are lock files held with
+``flock``.
+
+When the binaries are not installed, videos are marked processed as they
+are and served as uploaded.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+# Codecs every browser plays from an MP4 without re-encoding
+COPY_VIDEO_CODECS = {'h264'}
+COPY_AUDIO_CODECS = {'aac', 'mp3'}
+
+# Longest side of a transcoded video
+MAX_DIMENSION = 1920
+
+
+class VideoError(Exception):
+    """ffmpeg or ffprobe failed, or took longer than allowed."""
+
+
+def get_ffmpeg():
+    return shutil.which(getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'))
+
+
+def get_ffprobe():
+    return shutil.which(getattr(settings, 'FFPROBE_BINARY', 'ffprobe'))
+
+
+def is_available():
+    return bool(get_ffmpeg() and get_ffprobe())
+
+
+def get_timeout():
+    return getattr(settings, 'VIDEO_PROCESSING_TIMEOUT', 600)
+
+
+def get_concurrency():
+    return getattr(settings, 'VIDEO_PROCESSING_CONCURRENCY', 1)
+
+
+def get_lock_dir():
+    return getattr(settings, 'VIDEO_PROCESSING_LOCK_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'media_video_slots'
+    )
+
+
+def _run(args):
+    timeout = get_timeout()
+    try:
+        result = subprocess.run(args, capture_output=True, stdin=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise VideoError(f'{os.path.basename(args[0])} timed out after {timeout}s')
+    if result.returncode:
+        message = result.stderr.decode(errors='replace').strip().splitlines()
+        raise VideoError(message[-1] if message else f'{os.path.basename(args[0])} failed')
+    return result.stdout
+
+
+@contextmanager
+def processing_slot():
+    """Wait for one of the host's video processing slots and hold it."""
+    concurrency = get_concurrency()
+    if fcntl is None or concurrency <= 0:
+        yield
+        return
+
+    lock_dir = get_lock_dir()
+    os.makedirs(lock_dir, exist_ok=True)
+    deadline = time.monotonic() + get_timeout()
+    while True:
+        for slot in range(concurrency):
+            lock_file = open(os.path.join(lock_dir, f'{slot}.lock'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        if time.monotonic() > deadline:
+            raise VideoError('Timed out waiting for a video processing slot')
+        time.sleep(0.5)
+
+
+def probe(path):
+    """
+    Return ``{'width', 'height', 'duration', 'video_codec', 'audio_codec',
+    'pix_fmt'}`` for the video at ``path``, with the dimensions as displayed.
+    """
+    output = _run([
+        get_ffprobe(), '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path,
+    ])
+    try:
+        data = json.loads(output)
+    except ValueError:
+        raise VideoError('Unreadable ffprobe output')
+
+    streams = data.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video is None or not video.get('width'):
+        raise VideoError('No video stream found')
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+
+    width, height = int(video['width']), int(video['height'])
+    rotation = video.get('tags', {}).get('rotate')
+    for side_data in video.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    if rotation is not None and abs(int(float(rotation))) % 180 == 90:
+        # Phones store portrait video as landscape frames plus a rotation
+        width, height = height, width
+
+    duration = data.get('format', {}).get('duration') or video.get('duration')
+    return {
+        'width': width,
+        'height': height,
+        'duration': float(duration) if duration else None,
+        'video_codec': video.get('codec_name'),
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'pix_fmt': video.get('pix_fmt'),
+    }
+
+
+def extract_poster(path, duration=None):
+    """Return a frame from early in the video at ``path`` as PNG bytes."""
+    # Skip the first second, often black or a fade in, if the video is long enough
+    position = min(1.0, duration / 2) if duration else 0
+    data = _run([
+        get_ffmpeg(), '-v', 'error', '-ss', f'{position:.3f}', '-i', path,
+        '-frames:v', '1', '-f', 'image2pipe', '-c:v', 'png', '-',
+    ])
+    if not data:
+        raise VideoError('Could not extract a poster frame')
+    return data
+
+
+def transcode(path, output, metadata):
+    """Write a faststart MP4 of the video at ``path`` to ``output``."""
+    remux = (
+        metadata['video_codec'] in COPY_VIDEO_CODECS
+        and metadata['audio_codec'] in COPY_AUDIO_CODECS | {None}
+        and metadata['pix_fmt'] == 'yuv420p'
+        and max(metadata['width'], metadata['height']) <= MAX_DIMENSION
+    )
+    if remux:
+        codecs = ['-c', 'copy']
+    else:
+        scale = (
+            f"scale='if(gte(iw,ih),min({MAX_DIMENSION},iw),-2)':"
+            f"'if(gte(iw,ih),-2,min({MAX_DIMENSION},ih))'"
+        )
+        codecs = [
+            '-vf', scale, '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k',
+        ]
+    _run([
+        get_ffmpeg(), '-v', 'error', '-y', '-i', path, '-map', '0:v:0', '-map', '0:a:0?',
+        *codecs, '-movflags', '+faststart', '-f', 'mp4', output,
+    ])
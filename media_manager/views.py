@@ -1,12 +1,16 @@
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
 from django.db.models import Q
-from .models import MediaFile, MediaCollection, MediaTag
+from .models import MediaFile, MediaCollection, MediaTag, UploadSession
+from . import serving, uploads
+from .quota import QuotaExceeded, check_quota, get_quota
+from .usage import get_usage
 import json
-import mimetypes
 
 
 @login_required
@@ -45,51 +49,165 @@ def media_library(request):
 
 @login_required
 @require_http_methods(["POST"])
+@csrf_exempt
 def upload_media(request):
     """Handle media file uploads via AJAX"""
+    # Must be installed before anything reads the body; the CSRF check is
+    # therefore made after it, by _upload_media
+    hashing = uploads.HashingUploadHandler(request)
+    request.upload_handlers.insert(0, hashing)
+    return _upload_media(request, hashing)
+
+
+@csrf_protect
+def _upload_media(request, hashing):
+    try:
+        # The request size bounds the file size, so an upload that cannot fit
+        # is refused before Django reads it
+        check_quota(request.user, int(request.META.get('CONTENT_LENGTH') or 0))
+    except QuotaExceeded as e:
+        return _quota_response(e)
+
     if 'file' not in request.FILES:
         return JsonResponse({'error': 'No file provided'}, status=400)
 
     uploaded_file = request.FILES['file']
 
-    # Validate file type
-    allowed_types = {
-        'image': ['image/jpeg', 'image/png', 'image/gif', 'image/webp'],
-        'video': ['video/mp4', 'video/webm', 'video/ogg'],
-        'audio': ['audio/mp3', 'audio/wav', 'audio/ogg'],
+    # Validate the file type from the content, not the client's file name
+    mime_type = uploads.sniff_mime_type(hashing.heads.get('file', b''))
+    media_type = uploads.get_media_type(mime_type)
+
+    if not media_type:
+        return JsonResponse({'error': 'Unsupported file type'}, status=400)
+    if uploads.claims_other_type(mime_type, uploaded_file.name):
+        return JsonResponse({'error': 'File name does not match its content'}, status=400)
+
+    try:
+        media_file = uploads.create_media_file(
+            request.user,
+            uploaded_file,
+            uploaded_file.name,
+            media_type,
+            mime_type,
+            alt_text=request.POST.get('alt_text', ''),
+            caption=request.POST.get('caption', ''),
+            digest=hashing.digests.get('file'),
+        )
+    except QuotaExceeded as e:
+        return _quota_response(e)
+
+    return JsonResponse(_upload_response(media_file), status=202)
+
+
+def _quota_response(error):
+    return JsonResponse({'error': str(error), 'used': error.used, 'quota': error.quota}, status=413)
+
+
+def _upload_response(media_file):
+    return {
+        'id': str(media_file.id),
+        'file_name': media_file.file_name,
+        'media_type': media_file.media_type,
+        'file_size': media_file.file_size_human,
+        'url': media_file.original_file.url,
+        'thumbnail_url': media_file.thumbnail.url if media_file.thumbnail else None,
+        'status': media_file.processing_status,
+        'status_url': reverse('media_manager:detail', args=[media_file.id]),
     }
 
-    mime_type = mimetypes.guess_type(uploaded_file.name)[0]
-    media_type = None
 
-    for type_name, types in allowed_types.items():
-        if mime_type in types:
-            media_type = type_name
-            break
+def _session_status(session):
+    return {
+        'id': str(session.id),
+        'offset': session.received_bytes,
+        'file_size': session.file_size,
+        'chunk_size': uploads.get_chunk_size(),
+        'url': reverse('media_manager:upload_session', args=[session.id]),
+        'complete_url': reverse('media_manager:upload_session_complete', args=[session.id]),
+    }
 
-    if not media_type:
-        return JsonResponse({'error': 'Unsupported file type'}, status=400)
 
-    # Create media file
-    media_file = MediaFile.objects.create(
+@login_required
+@require_http_methods(["POST"])
+def create_upload_session(request):
+    """Start a chunked upload"""
+    file_name = request.POST.get('file_name', '').strip()
+    try:
+        file_size = int(request.POST.get('file_size', ''))
+    except ValueError:
+        file_size = 0
+
+    if not file_name or file_size <= 0:
+        return JsonResponse({'error': 'file_name and file_size are required'}, status=400)
+    if file_size > uploads.get_max_upload_size():
+        return JsonResponse({'error': 'File is too large'}, status=413)
+    try:
+        check_quota(request.user, file_size)
+    except QuotaExceeded as e:
+        return _quota_response(e)
+
+    session = UploadSession.objects.create(
         user=request.user,
-        original_file=uploaded_file,
-        media_type=media_type,
-        file_name=uploaded_file.name,
-        file_size=uploaded_file.size,
-        mime_type=mime_type,
+        file_name=file_name[:255],
+        file_size=file_size,
         alt_text=request.POST.get('alt_text', ''),
         caption=request.POST.get('caption', ''),
     )
+    return JsonResponse(_session_status(session), status=201)
+
 
-    return JsonResponse({
+@login_required
+@require_http_methods(["GET", "POST"])
+def upload_session(request, session_id):
+    """Report the resume offset (GET) or append the request body as a chunk (POST)"""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+
+    if request.method == 'POST':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset header is required'}, status=400)
+
+        try:
+            uploads.append_chunk(session, offset, request)
+        except uploads.UploadError as e:
+            session.refresh_from_db()
+            return JsonResponse({'error': str(e), **_session_status(session)}, status=e.status)
+
+    return JsonResponse(_session_status(session))
+
+
+@login_required
+@require_http_methods(["POST"])
+def complete_upload_session(request, session_id):
+    """Finish a chunked upload and create the media file"""
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+
+    try:
+        media_file = uploads.complete(session)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e), **_session_status(session)}, status=e.status)
+    except QuotaExceeded as e:
+        return _quota_response(e)
+
+    return JsonResponse(_upload_response(media_file), status=202)
+
+
+def _media_status(media_file):
+    """Processing state of a media file, polled by the uploader until it is processed."""
+    return {
         'id': str(media_file.id),
-        'file_name': media_file.file_name,
-        'media_type': media_file.media_type,
-        'file_size': media_file.file_size_human,
+        'status': media_file.processing_status,
+        'is_processed': media_file.is_processed,
+        'processing_error': media_file.processing_error,
+        'width': media_file.width,
+        'height': media_file.height,
+        'duration': media_file.duration,
+        'placeholder': media_file.variants.get('placeholder'),
         'url': media_file.original_file.url,
+        'optimized_url': media_file.optimized_file.url if media_file.optimized_file else None,
         'thumbnail_url': media_file.thumbnail.url if media_file.thumbnail else None,
-    })
+    }
 
 
 @login_required
@@ -106,6 +224,9 @@ def media_detail(request, media_id):
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True})
 
+    elif request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse(_media_status(media_file))
+
     context = {
         'media_file': media_file,
         'collections': MediaCollection.objects.filter(user=request.user),
@@ -190,14 +311,7 @@ def delete_media(request, media_id):
     """Delete a media file"""
     media_file = get_object_or_404(MediaFile, id=media_id, user=request.user)
 
-    # Delete physical files
-    if media_file.original_file:
-        media_file.original_file.delete()
-    if media_file.optimized_file:
-        media_file.optimized_file.delete()
-    if media_file.thumbnail:
-        media_file.thumbnail.delete()
-
+    # Stored files are released by the post_delete signal
     media_file.delete()
 
     return JsonResponse({'success': True})
@@ -206,16 +320,25 @@ def delete_media(request, media_id):
 @login_required
 def media_stats(request):
     """Get media library statistics"""
-    user_media = MediaFile.objects.filter(user=request.user)
+    # Running totals maintained on upload and delete; no scan of the user's files
+    usage = get_usage(request.user)
 
     stats = {
-        'total_files': user_media.count(),
-        'total_size': sum(media.file_size for media in user_media),
+        'total_files': usage.total_files,
+        'total_size': usage.total_size,
         'by_type': {
-            'images': user_media.filter(media_type='image').count(),
-            'videos': user_media.filter(media_type='video').count(),
-            'audio': user_media.filter(media_type='audio').count(),
+            'images': usage.image_count,
+            'videos': usage.video_count,
+            'audio': usage.audio_count,
+        },
+        'size_by_type': {
+            'images': usage.image_size,
+            'videos': usage.video_size,
+            'audio': usage.audio_size,
         },
+        'processed_size': usage.processed_size,
+        'used_bytes': usage.used_bytes,
+        'quota': get_quota() or None,
         'collections': MediaCollection.objects.filter(user=request.user).count(),
     }
 
@@ -228,3 +351,9 @@ def media_stats(request):
         total_size /= 1024.0
 
     return JsonResponse(stats)
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    """Serve an uploaded file with validators, byte ranges and cache headers"""
+    return serving.serve_file(request, path)
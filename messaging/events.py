@@ -0,0 +1,217 @@
+"""
+Real-time messaging events over Server-Sent Events.
+
+Each open conversation page holds one ``text/event-stream`` connection to
+``events_view``, instead of polling for new messages. Views call
+``publish`` once their transaction has committed; the configured backend
+carries the event to every web process, where the process's ``hub`` hands
+it to the open streams of the user it is addressed to.
+
+``LocalBackend``, the default, delivers within the current process, which
+is all a single ASGI worker needs. With several workers, set
+``MESSAGING_EVENTS_BACKEND`` to ``'messaging.events.RedisBackend'`` so an
+event published by one process reaches streams held by the others.
+
+Streams are only served under ASGI, where an idle connection costs a
+suspended coroutine rather than a thread. Each one is closed after
+``MESSAGING_EVENTS_MAX_AGE`` seconds and the browser reconnects on its
+own, so connections a server failed to notice were dropped do not pile up.
+A stream whose client falls too far behind is closed as well. Events are
+not replayed: on every (re)connect the conversation page fetches the
+messages newer than the last one it shows.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per stream; a client that falls further behind is disconnected
+QUEUE_SIZE = 100
+
+# Milliseconds the browser waits before reconnecting
+RETRY_MS = 3000
+
+
+def get_keepalive():
+    return getattr(settings, 'MESSAGING_EVENTS_KEEPALIVE', 15)
+
+
+def get_max_age():
+    return getattr(settings, 'MESSAGING_EVENTS_MAX_AGE', 300)
+
+
+class Hub:
+    """The open event streams in this process, by user id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = defaultdict(set)
+
+    def subscribe(self, user_id):
+        """Register a stream for ``user_id`` on the running event loop and return its queue."""
+        queue = StreamQueue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._streams[user_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            streams = self._streams.get(user_id, set())
+            streams.difference_update({stream for stream in streams if stream[1] is queue})
+            if not streams:
+                self._streams.pop(user_id, None)
+
+    def dispatch(self, user_id, event):
+        """Hand an event to the user's streams. Safe to call from any thread."""
+        with self._lock:
+            streams = list(self._streams.get(user_id, ()))
+        for loop, queue in streams:
+            loop.call_soon_threadsafe(_put, queue, event)
+
+    def stream_count(self, user_id):
+        with self._lock:
+            return len(self._streams.get(user_id, ()))
+
+
+class StreamQueue(asyncio.Queue):
+    # Set once an event had to be dropped
+    overflowed = False
+
+
+def _put(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # The client is not keeping up; its stream is closed so it reconnects
+        # and catches up
+        queue.overflowed = True
+
+
+hub = Hub()
+
+
+class LocalBackend:
+    """Deliver events to streams in the publishing process only."""
+
+    def start(self):
+        pass
+
+    def publish(self, user_id, event):
+        hub.dispatch(user_id, event)
+
+
+class RedisBackend:
+    """
+    Deliver events through a Redis pub/sub channel, so every web process
+    receives them. Each process listens on a background thread once its
+    first stream opens. When the connection drops the listener logs it and
+    resubscribes, waiting longer after each consecutive failure.
+    """
+
+    channel = 'messaging-events'
+    # Seconds before resubscribing, doubled per consecutive failure
+    reconnect_delay = 1
+    max_reconnect_delay = 30
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(
+                getattr(settings, 'MESSAGING_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+            )
+        self.client = client
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def start(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='messaging-events', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        delay = self.reconnect_delay
+        try:
+            while True:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                try:
+                    pubsub.subscribe(self.channel)
+                    delay = self.reconnect_delay
+                    for message in pubsub.listen():
+                        self._dispatch(message)
+                except Exception:
+                    logger.exception('Lost the messaging events subscription; resubscribing in %ss', delay)
+                finally:
+                    pubsub.close()
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        finally:
+            # Let the next stream start a fresh listener should this one die
+            with self._lock:
+                if self._listener is threading.current_thread():
+                    self._listener = None
+
+    def _dispatch(self, message):
+        try:
+            user_id, event = json.loads(message['data'])
+        except (TypeError, ValueError):
+            logger.warning('Ignoring malformed messaging event: %r', message.get('data'))
+            return
+        hub.dispatch(user_id, event)
+
+    def publish(self, user_id, event):
+        self.client.publish(self.channel, json.dumps([user_id, event]))
+
+
+_backends = {}
+
+
+def get_backend():
+    path = getattr(settings, 'MESSAGING_EVENTS_BACKEND', 'messaging.events.LocalBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def publish(user_id, event_type, data):
+    """Send an event to every open stream of ``user_id``."""
+    get_backend().publish(user_id, {'type': event_type, 'data': data})
+
+
+def format_event(event_id, event):
+    return f"id: {event_id}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def stream(user_id):
+    """Yield a user's events in SSE format until the stream's maximum age."""
+    get_backend().start()
+    queue = hub.subscribe(user_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + get_max_age()
+    event_ids = itertools.count(1)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), min(get_keepalive(), remaining))
+            except asyncio.TimeoutError:
+                # A comment line keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            if queue.overflowed:
+                return
+            yield format_event(next(event_ids), event)
+    finally:
+        hub.unsubscribe(user_id, queue)
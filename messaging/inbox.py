@@ -0,0 +1,134 @@
+"""
+Per-user inbox summaries.
+
+Every participant of a conversation has an ``InboxEntry`` holding the
+conversation's latest message (id, time, sender and a preview) and the
+number of messages they have not read. Entries are written in the same
+transaction as the message or read receipt they reflect, so the inbox is a
+range scan over the ``(user, -last_message_at)`` index instead of an
+aggregate over the message table.
+
+Read state is a watermark per participant, ``last_read_id``: the user has
+read every message in the conversation up to that id. Reading a
+conversation moves the watermark with a single row update however many
+messages it covers, and the unread count is the number of others' messages
+above it. ``Message.objects.with_read_state()`` annotates a page of messages
+with whether another participant has read them.
+
+``rebuild`` recomputes entries from the messages themselves, for
+conversations that predate the table; see the ``rebuild_inbox`` command.
+"""
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+
+from .models import PREVIEW_LENGTH, Conversation, InboxEntry, Message
+
+
+def preview(content):
+    return ' '.join(content.split())[:PREVIEW_LENGTH]
+
+
+def _other(user_id, user_ids):
+    return next((other_id for other_id in user_ids if other_id != user_id), None)
+
+
+def create_entries(conversation, user_ids):
+    """Add a new conversation to each participant's inbox."""
+    InboxEntry.objects.bulk_create([
+        InboxEntry(
+            user_id=user_id,
+            conversation=conversation,
+            other_participant_id=_other(user_id, user_ids),
+            last_message_at=conversation.created_at,
+        )
+        for user_id in user_ids
+    ], ignore_conflicts=True)
+
+
+def record_message(message):
+    """Show a new message in every participant's inbox, unread for all but its sender."""
+    InboxEntry.objects.filter(conversation_id=message.conversation_id).update(
+        last_message=message,
+        last_message_at=message.created_at,
+        last_message_preview=preview(message.content),
+        last_sender_id=message.sender_id,
+        unread_count=Case(
+            When(user_id=message.sender_id, then=F('unread_count')),
+            default=F('unread_count') + 1,
+        ),
+    )
+
+
+def mark_read(conversation, user):
+    """
+    Move ``user``'s read watermark in a conversation up to its latest
+    message. Returns whether there was anything unread.
+    """
+    return bool(InboxEntry.objects.filter(conversation=conversation, user=user, unread_count__gt=0).update(
+        last_read_id=Coalesce('last_message', 'last_read_id', output_field=models.PositiveBigIntegerField()),
+        unread_count=0,
+    ))
+
+
+def rebuild(conversation_ids):
+    """
+    Recompute the inbox entries of the given conversations from their
+    participants and messages, keeping existing read watermarks.
+    Participants without an entry start with the whole history read.
+    Returns the number of entries written.
+    """
+    last_message = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-pk')
+    conversations = list(Conversation.objects.filter(pk__in=conversation_ids).annotate(
+        last_message_id=Subquery(last_message.values('pk')[:1]),
+    ))
+    last_messages = Message.objects.in_bulk(
+        [conversation.last_message_id for conversation in conversations if conversation.last_message_id]
+    )
+
+    participants = defaultdict(list)
+    memberships = Conversation.participants.through.objects.filter(
+        conversation_id__in=conversation_ids
+    ).order_by('pk').values_list('conversation_id', 'user_id')
+    for conversation_id, user_id in memberships:
+        participants[conversation_id].append(user_id)
+
+    # The messages others sent above each existing watermark
+    unread_messages = Message.objects.filter(
+        conversation=OuterRef('conversation'), pk__gt=OuterRef('last_read_id')
+    ).exclude(sender=OuterRef('user')).order_by().values('conversation').annotate(count=Count('pk'))
+    read_state = {
+        (conversation_id, user_id): (last_read_id, unread_count or 0)
+        for conversation_id, user_id, last_read_id, unread_count in InboxEntry.objects.filter(
+            conversation_id__in=conversation_ids
+        ).annotate(unread=Subquery(unread_messages.values('count'))).values_list(
+            'conversation_id', 'user_id', 'last_read_id', 'unread'
+        )
+    }
+
+    entries = []
+    for conversation in conversations:
+        message = last_messages.get(conversation.last_message_id)
+        user_ids = participants[conversation.pk]
+        for user_id in user_ids:
+            last_read_id, unread_count = read_state.get(
+                (conversation.pk, user_id), (conversation.last_message_id or 0, 0)
+            )
+            entries.append(InboxEntry(
+                user_id=user_id,
+                conversation_id=conversation.pk,
+                other_participant_id=_other(user_id, user_ids),
+                last_message=message,
+                last_message_at=message.created_at if message else conversation.created_at,
+                last_message_preview=preview(message.content) if message else '',
+                last_sender_id=message.sender_id if message else None,
+                unread_count=unread_count,
+                last_read_id=last_read_id,
+            ))
+
+    with transaction.atomic():
+        InboxEntry.objects.filter(conversation_id__in=conversation_ids).delete()
+        InboxEntry.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
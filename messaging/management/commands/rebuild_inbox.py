@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from messaging.inbox import rebuild
+from messaging.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user inbox summaries from conversations and messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help="Only rebuild this username's conversations",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Conversations rebuilt per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.order_by('pk')
+        if options['user']:
+            conversations = conversations.filter(participants__username=options['user'])
+
+        self.stdout.write('Rebuilding inboxes...')
+        conversation_count = entry_count = 0
+        last_id = 0
+        while True:
+            batch = list(conversations.filter(pk__gt=last_id).values_list('pk', flat=True)[:options['chunk_size']])
+            if not batch:
+                break
+            entry_count += rebuild(batch)
+            conversation_count += len(batch)
+            last_id = batch[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {entry_count} inbox entries for {conversation_count} conversations!')
+        )
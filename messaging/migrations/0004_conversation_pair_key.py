@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:58
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def set_pair_keys(apps, schema_editor):
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Membership = Conversation.participants.through
+
+    participants = defaultdict(list)
+    for conversation_id, user_id in Membership.objects.values_list('conversation_id', 'user_id').iterator(chunk_size=2000):
+        participants[conversation_id].append(user_id)
+
+    # Earlier duplicates of a pair keep a null key; the most recently
+    # active one is where the pair's new messages go
+    keyed = {}
+    for conversation_id, updated_at in Conversation.objects.order_by('updated_at', 'pk').values_list('pk', 'updated_at'):
+        user_ids = participants.get(conversation_id, [])
+        if len(set(user_ids)) == 2:
+            low, high = sorted(set(user_ids))
+            keyed[f'{low}:{high}'] = conversation_id
+
+    Conversation.objects.bulk_update(
+        [Conversation(pk=conversation_id, pair_key=key) for key, conversation_id in keyed.items()],
+        ['pair_key'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(set_pair_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:02
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def set_watermarks(apps, schema_editor):
+    InboxEntry = apps.get_model('messaging', 'InboxEntry')
+    Message = apps.get_model('messaging', 'Message')
+
+    latest = dict(
+        Message.objects.order_by().values_list('conversation_id').annotate(Max('pk'))
+    )
+    # Oldest unread message per conversation and sender; a participant has
+    # read everything below the oldest one the others sent
+    first_unread = defaultdict(dict)
+    rows = Message.objects.filter(is_read=False).order_by().values_list(
+        'conversation_id', 'sender_id'
+    ).annotate(Min('pk'))
+    for conversation_id, sender_id, message_id in rows:
+        first_unread[conversation_id][sender_id] = message_id
+
+    batch = []
+    for entry in InboxEntry.objects.order_by('pk').iterator(chunk_size=1000):
+        unread = [
+            message_id for sender_id, message_id in first_unread[entry.conversation_id].items()
+            if sender_id != entry.user_id
+        ]
+        entry.last_read_id = min(unread) - 1 if unread else latest.get(entry.conversation_id, 0)
+        batch.append(entry)
+        if len(batch) >= 1000:
+            InboxEntry.objects.bulk_update(batch, ['last_read_id'])
+            batch = []
+    InboxEntry.objects.bulk_update(batch, ['last_read_id'])
+
+
+def set_read_flags(apps, schema_editor):
+    InboxEntry = apps.get_model('messaging', 'InboxEntry')
+    Message = apps.get_model('messaging', 'Message')
+
+    for entry in InboxEntry.objects.filter(last_read_id__gt=0).iterator(chunk_size=1000):
+        Message.objects.filter(
+            conversation_id=entry.conversation_id, pk__lte=entry.last_read_id
+        ).exclude(sender_id=entry.user_id).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_conversation_pair_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(set_watermarks, set_read_flags),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_watermark_idx'),
+        ),
+    ]
@@ -2,9 +2,35 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+# Characters of the latest message shown in the inbox
+PREVIEW_LENGTH = 100
+
+
+def time_since(moment):
+    """Return a short human-readable time since ``moment``"""
+    now = timezone.now()
+    diff = now - moment
+
+    if diff.days > 0:
+        return f"{diff.days}d"
+    elif diff.seconds > 3600:
+        return f"{diff.seconds // 3600}h"
+    elif diff.seconds > 60:
+        return f"{diff.seconds // 60}m"
+    else:
+        return "now"
+
+
+def pair_key(user_id, other_id):
+    """Return the key shared by every lookup of the direct conversation between two users"""
+    low, high = sorted((user_id, other_id))
+    return f"{low}:{high}"
+
 
 class Conversation(models.Model):
     participants = models.ManyToManyField(User, related_name='conversations')
+    # Set on two-person conversations, so there is at most one per pair of users
+    pair_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -23,29 +49,94 @@ class Conversation(models.Model):
         return self.messages.order_by('-created_at').first()
 
 
+class MessageQuerySet(models.QuerySet):
+    def with_read_state(self):
+        """
+        Annotate ``is_read`` in bulk: whether another participant's read
+        watermark has passed the message. Also allows ``filter(is_read=...)``.
+        """
+        return self.annotate(_is_read=models.Exists(_read_by_others(
+            models.OuterRef('conversation'), models.OuterRef('pk'), models.OuterRef('sender')
+        ))).alias(is_read=models.F('_is_read'))
+
+
+def _read_by_others(conversation_id, message_id, sender_id):
+    return InboxEntry.objects.filter(
+        conversation_id=conversation_id, last_read_id__gte=message_id
+    ).exclude(user_id=sender_id)
+
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+
+    objects = MessageQuerySet.as_manager()
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Message history pages, newest first
+            models.Index(fields=['conversation', 'created_at']),
+            # Messages above a participant's read watermark (inbox rebuilds,
+            # read state)
+            models.Index(fields=['conversation', 'id'], name='message_watermark_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.username}: {self.content[:50]}"
 
     def time_since_sent(self):
         """Return a human-readable time since the message was sent"""
-        now = timezone.now()
-        diff = now - self.created_at
-
-        if diff.days > 0:
-            return f"{diff.days}d"
-        elif diff.seconds > 3600:
-            return f"{diff.seconds // 3600}h"
-        elif diff.seconds > 60:
-            return f"{diff.seconds // 60}m"
-        else:
-            return "now"
+        return time_since(self.created_at)
+
+    @property
+    def is_read(self):
+        """
+        Whether another participant has read the message. Read state is kept
+        as a watermark per participant (``InboxEntry.last_read_id``) rather
+        than a flag on every message; use ``Message.objects.with_read_state()``
+        to load it for many messages at once.
+        """
+        if '_is_read' in self.__dict__:
+            return self._is_read
+        return _read_by_others(self.conversation_id, self.pk, self.sender_id).exists()
+
+
+class InboxEntry(models.Model):
+    """
+    One participant's view of a conversation, kept up to date as messages
+    are sent and read so the inbox is a single indexed range scan.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='inbox_entries')
+    other_participant = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    # Copied from the latest message so the inbox never reads the message table
+    last_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_message_at = models.DateTimeField(default=timezone.now)
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    unread_count = models.PositiveIntegerField(default=0)
+    # Id of the latest message the user has read; everything above it is unread
+    last_read_id = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-last_message_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='unique_inbox_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at']),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.conversation_id} in {self.user_id}'s inbox"
+
+    def time_since_last_message(self):
+        return time_since(self.last_message_at)
+
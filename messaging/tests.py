@@ -1,3 +1,512 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncClient, TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import events, inbox
+from .models import Conversation, InboxEntry, Message, pair_key
+
+
+class InboxTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.client = Client()
+        self.client.login(username='reader', password='testpass123')
+        self.other_count = 0
+
+    def start_conversation(self, unread=1):
+        self.other_count += 1
+        other = User.objects.create_user(username=f'friend{self.other_count}', password='testpass123')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, other)
+        inbox.create_entries(conversation, [self.user.id, other.id])
+        self.send(conversation, self.user, 'Hi!')
+        for i in range(unread):
+            self.send(conversation, other, f'Reply {i}')
+        return conversation
+
+    def send(self, conversation, sender, content):
+        message = Message.objects.create(conversation=conversation, sender=sender, content=content)
+        inbox.record_message(message)
+        return message
+
+    def get_inbox(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('messaging:list'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_inbox_shows_unread_counts_and_last_messages(self):
+        """Test that each conversation shows its other participant, unread count and latest message."""
+        quiet = self.start_conversation(unread=0)
+        busy = self.start_conversation(unread=2)
+
+        response, _ = self.get_inbox()
+        entries = {entry.conversation_id: entry for entry in response.context['entries']}
+
+        self.assertEqual(entries[busy.pk].unread_count, 2)
+        self.assertEqual(entries[busy.pk].last_message_preview, 'Reply 1')
+        self.assertEqual(entries[busy.pk].other_participant.username, 'friend2')
+        self.assertEqual(entries[quiet.pk].unread_count, 0)
+        self.assertEqual(entries[quiet.pk].last_message_preview, 'Hi!')
+        self.assertContains(response, 'You: Hi!')
+        # Most recent activity first
+        self.assertEqual([entry.conversation_id for entry in response.context['entries']], [busy.pk, quiet.pk])
+
+    def test_inbox_query_count_does_not_grow_with_conversations(self):
+        """Test that the inbox is built with a fixed number of queries."""
+        for _ in range(2):
+            self.start_conversation()
+        # Warm up per-user caches used by the base template
+        self.get_inbox()
+        _, few = self.get_inbox()
+
+        for _ in range(8):
+            self.start_conversation()
+        response, many = self.get_inbox()
+
+        self.assertEqual(len(response.context['entries']), 10)
+        self.assertEqual(few, many)
+
+    def test_sending_and_reading_update_the_summary(self):
+        """Test that sending counts a message as unread for the recipient and opening resets it."""
+        conversation = self.start_conversation(unread=0)
+        other = User.objects.get(username='friend1')
+        other_client = Client()
+        other_client.login(username='friend1', password='testpass123')
+
+        other_client.post(reverse('messaging:send_message', args=[conversation.pk]), {'content': 'Are you there?'})
+        other_client.post(reverse('messaging:send_message', args=[conversation.pk]), {'content': 'Hello?'})
+        entry = InboxEntry.objects.get(user=self.user, conversation=conversation)
+        self.assertEqual(entry.unread_count, 2)
+        self.assertEqual(entry.last_message_preview, 'Hello?')
+        self.assertEqual(entry.last_sender_id, other.id)
+        # Only our 'Hi!' is unread for the sender
+        self.assertEqual(InboxEntry.objects.get(user=other, conversation=conversation).unread_count, 1)
+
+        self.client.get(reverse('messaging:conversation_detail', args=[conversation.pk]))
+        entry.refresh_from_db()
+        self.assertEqual(entry.unread_count, 0)
+        self.assertEqual(entry.last_read_id, entry.last_message_id)
+        self.assertTrue(all(message.is_read for message in Message.objects.filter(sender=other)))
+
+    def test_starting_a_conversation_adds_it_to_both_inboxes(self):
+        """Test that a new conversation shows up in both participants' inboxes."""
+        User.objects.create_user(username='newfriend', password='testpass123')
+        self.client.get(reverse('messaging:start_conversation', args=['newfriend']))
+        self.assertEqual(
+            set(InboxEntry.objects.values_list('user__username', 'other_participant__username')),
+            {('reader', 'newfriend'), ('newfriend', 'reader')},
+        )
+
+    def test_rebuild_matches_incremental_updates(self):
+        """Test that the rebuild command reproduces the incrementally kept summaries."""
+        for unread in (0, 1, 3):
+            self.start_conversation(unread=unread)
+        fields = ['user_id', 'conversation_id', 'other_participant_id', 'last_message_id', 'last_message_at',
+                  'last_message_preview', 'last_sender_id', 'unread_count', 'last_read_id']
+        expected = set(InboxEntry.objects.values_list(*fields))
+
+        InboxEntry.objects.update(last_message=None, last_message_preview='', unread_count=99)
+        out = StringIO()
+        call_command('rebuild_inbox', chunk_size=2, stdout=out)
+
+        self.assertIn('6 inbox entries for 3 conversations', out.getvalue())
+        self.assertEqual(set(InboxEntry.objects.values_list(*fields)), expected)
+
+    def test_rebuild_starts_missing_entries_as_read(self):
+        """Test that conversations without inbox entries are rebuilt with their history read."""
+        conversation = self.start_conversation(unread=2)
+        InboxEntry.objects.all().delete()
+
+        call_command('rebuild_inbox', stdout=StringIO())
+        entry = InboxEntry.objects.get(user=self.user, conversation=conversation)
+        self.assertEqual(entry.unread_count, 0)
+        self.assertEqual(entry.last_read_id, conversation.messages.latest('pk').pk)
+
+
+class ReadWatermarkTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.others = [
+            User.objects.create_user(username=f'member{i}', password='testpass123') for i in range(3)
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, *self.others)
+        inbox.create_entries(self.conversation, [self.user.id] + [other.id for other in self.others])
+
+    def send(self, sender, count):
+        for i in range(count):
+            inbox.record_message(Message.objects.create(conversation=self.conversation, sender=sender, content=f'{i}'))
+
+    def entry(self, user):
+        return InboxEntry.objects.get(conversation=self.conversation, user=user)
+
+    def test_mark_read_is_one_update(self):
+        """Test that reading a long group conversation writes a single row."""
+        self.send(self.others[0], 50)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(inbox.mark_read(self.conversation, self.user))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.entry(self.user).last_read_id, self.conversation.messages.latest('pk').pk)
+
+        # Nothing new: no write and nothing to report
+        self.assertFalse(inbox.mark_read(self.conversation, self.user))
+
+    def test_unread_counts_follow_watermarks(self):
+        """Test that each participant counts only others' messages above their own watermark."""
+        self.send(self.others[0], 2)
+        inbox.mark_read(self.conversation, self.others[1])
+        self.send(self.others[1], 3)
+
+        self.assertEqual(self.entry(self.user).unread_count, 5)
+        self.assertEqual(self.entry(self.others[0]).unread_count, 3)
+        self.assertEqual(self.entry(self.others[1]).unread_count, 0)
+        self.assertEqual(self.entry(self.others[2]).unread_count, 5)
+
+        # Own messages above the watermark are never unread
+        self.assertEqual(self.entry(self.others[1]).last_read_id, self.conversation.messages.order_by('pk')[1].pk)
+
+    def test_is_read_reflects_other_participants(self):
+        """Test that a message counts as read once any other participant's watermark passes it."""
+        self.send(self.user, 1)
+        message = self.conversation.messages.get()
+        self.assertFalse(message.is_read)
+
+        inbox.mark_read(self.conversation, self.others[2])
+        self.assertTrue(message.is_read)
+
+    def test_read_state_is_annotated_in_bulk(self):
+        """Test that read state loads and filters for a whole page in one query."""
+        self.send(self.user, 2)
+        inbox.mark_read(self.conversation, self.others[0])
+        self.send(self.others[0], 1)
+
+        with self.assertNumQueries(1):
+            states = [
+                (message.sender_id, message.is_read)
+                for message in self.conversation.messages.with_read_state().order_by('pk')
+            ]
+        self.assertEqual(states, [(self.user.id, True), (self.user.id, True), (self.others[0].id, False)])
+        self.assertEqual(self.conversation.messages.with_read_state().filter(is_read=False).count(), 1)
+
+
+class MessageHistoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.other = User.objects.create_user(username='writer', password='testpass123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        inbox.create_entries(self.conversation, [self.user.id, self.other.id])
+        self.client = Client()
+        self.client.login(username='reader', password='testpass123')
+
+    def add_messages(self, count):
+        start = Message.objects.count()
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.other if i % 2 else self.user, content=f'Message {i}')
+            for i in range(start, start + count)
+        ])
+
+    def open_conversation(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('messaging:conversation_detail', args=[self.conversation.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_opening_shows_newest_page_in_order(self):
+        """Test that only the newest page is rendered, oldest of the page first."""
+        self.add_messages(45)
+        response, _ = self.open_conversation()
+
+        contents = [message.content for message in response.context['messages']]
+        self.assertEqual(contents, [f'Message {i}' for i in range(15, 45)])
+        self.assertTrue(response.context['next_cursor'])
+
+    def test_older_pages_cover_history_without_gaps(self):
+        """Test that following cursors returns every older message exactly once."""
+        self.add_messages(75)
+        response, _ = self.open_conversation()
+        seen = [message.content for message in response.context['messages']]
+        cursor = response.context['next_cursor']
+
+        url = reverse('messaging:conversation_messages', args=[self.conversation.pk])
+        while cursor:
+            data = self.client.get(url, {'cursor': cursor}).json()
+            seen = [message['content'] for message in data['messages']] + seen
+            cursor = data['next_cursor']
+
+        self.assertEqual(seen, [f'Message {i}' for i in range(75)])
+
+    def test_opening_cost_does_not_grow_with_history(self):
+        """Test that opening a conversation takes the same queries for short and long histories."""
+        self.add_messages(10)
+        self.open_conversation()
+        _, short = self.open_conversation()
+
+        self.add_messages(500)
+        _, long = self.open_conversation()
+        self.assertEqual(short, long)
+
+    def test_newer_messages_catch_up_after_a_reconnect(self):
+        """Test that the messages after a given id are returned oldest first, a page at a time."""
+        self.add_messages(40)
+        ids = list(self.conversation.messages.order_by('pk').values_list('pk', flat=True))
+        url = reverse('messaging:conversation_messages', args=[self.conversation.pk])
+
+        data = self.client.get(url, {'after': ids[4]}).json()
+        self.assertEqual([message['id'] for message in data['messages']], ids[5:35])
+        self.assertTrue(data['has_more'])
+        data = self.client.get(url, {'after': ids[34]}).json()
+        self.assertEqual([message['id'] for message in data['messages']], ids[35:])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code, 400)
+
+    def test_history_requires_participant(self):
+        """Test that other users cannot read a conversation's history."""
+        User.objects.create_user(username='outsider', password='testpass123')
+        self.client.login(username='outsider', password='testpass123')
+        response = self.client.get(reverse('messaging:conversation_messages', args=[self.conversation.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class DirectConversationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.other = User.objects.create_user(username='writer', password='testpass123')
+        self.client = Client()
+        self.client.login(username='reader', password='testpass123')
+
+    def start(self, client, username):
+        response = client.get(reverse('messaging:start_conversation', args=[username]))
+        self.assertEqual(response.status_code, 302)
+        return response.url
+
+    def test_both_participants_reach_the_same_conversation(self):
+        """Test that starting a conversation from either side reuses the pair's conversation."""
+        url = self.start(self.client, 'writer')
+        other_client = Client()
+        other_client.login(username='writer', password='testpass123')
+
+        self.assertEqual(self.start(other_client, 'reader'), url)
+        self.assertEqual(self.start(self.client, 'writer'), url)
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.pair_key, pair_key(self.other.id, self.user.id))
+
+    def test_pair_key_is_unique(self):
+        """Test that the database refuses a second conversation for the same pair."""
+        Conversation.objects.create(pair_key=pair_key(self.user.id, self.other.id))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(pair_key=pair_key(self.other.id, self.user.id))
+
+    def test_backfill_keys_existing_conversations(self):
+        """Test that the migration keys two-person conversations and skips the others."""
+        third = User.objects.create_user(username='third', password='testpass123')
+        older, newer, group = Conversation.objects.create(), Conversation.objects.create(), Conversation.objects.create()
+        older.participants.add(self.user, self.other)
+        newer.participants.add(self.user, self.other)
+        group.participants.add(self.user, self.other, third)
+        Conversation.objects.filter(pk=older.pk).update(updated_at=newer.updated_at - timedelta(days=1))
+
+        migration = import_module('messaging.migrations.0004_conversation_pair_key')
+        migration.set_pair_keys(apps, None)
+
+        self.assertEqual(
+            dict(Conversation.objects.values_list('pk', 'pair_key')),
+            {older.pk: None, newer.pk: pair_key(self.user.id, self.other.id), group.pk: None},
+        )
+        self.assertEqual(self.start(self.client, 'writer'), reverse('messaging:conversation_detail', args=[newer.pk]))
+
+
+class RecordingBackend:
+    """Events backend that keeps published events for assertions."""
+    published = []
+
+    def start(self):
+        pass
+
+    def publish(self, user_id, event):
+        self.published.append((user_id, event))
+
+
+@override_settings(MESSAGING_EVENTS_BACKEND='messaging.tests.RecordingBackend')
+class MessageEventsTest(TestCase):
+    def setUp(self):
+        RecordingBackend.published.clear()
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.other = User.objects.create_user(username='writer', password='testpass123')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        inbox.create_entries(self.conversation, [self.user.id, self.other.id])
+
+    def test_sent_messages_are_published_to_participants(self):
+        """Test that a sent message is pushed to both participants once it commits."""
+        client = Client()
+        client.login(username='writer', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(reverse('messaging:send_message', args=[self.conversation.pk]), {'content': 'Ping'})
+
+        published = {user_id: event for user_id, event in RecordingBackend.published}
+        self.assertEqual(set(published), {self.user.id, self.other.id})
+        self.assertEqual(published[self.user.id]['type'], 'message')
+        self.assertEqual(published[self.user.id]['data']['message']['content'], 'Ping')
+        self.assertFalse(published[self.user.id]['data']['message']['is_own'])
+        self.assertTrue(published[self.other.id]['data']['message']['is_own'])
+
+    def test_reading_publishes_a_receipt_to_the_sender(self):
+        """Test that opening a conversation with unread messages notifies the other participant."""
+        message = Message.objects.create(conversation=self.conversation, sender=self.other, content='Ping')
+        inbox.record_message(message)
+        self.client.login(username='reader', password='testpass123')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('messaging:conversation_detail', args=[self.conversation.pk]))
+        self.assertEqual(RecordingBackend.published, [
+            (self.other.id, {'type': 'read', 'data': {'conversation_id': self.conversation.pk, 'reader': 'reader'}}),
+        ])
+
+        # Nothing new to read: no receipt
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('messaging:conversation_detail', args=[self.conversation.pk]))
+        self.assertEqual(len(RecordingBackend.published), 1)
+
+    def test_live_messages_are_marked_read(self):
+        """Test that the page can mark messages that arrived live as read, sending a receipt."""
+        message = Message.objects.create(conversation=self.conversation, sender=self.other, content='Ping')
+        inbox.record_message(message)
+        self.client.login(username='reader', password='testpass123')
+        url = reverse('messaging:mark_read', args=[self.conversation.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertTrue(response.json()['had_unread'])
+        self.assertEqual(InboxEntry.objects.get(user=self.user, conversation=self.conversation).unread_count, 0)
+        self.assertTrue(Message.objects.get().is_read)
+        self.assertEqual([user_id for user_id, _ in RecordingBackend.published], [self.other.id])
+
+        self.assertFalse(self.client.post(url).json()['had_unread'])
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_stream_requires_asgi_and_login(self):
+        """Test that anonymous users are refused and WSGI requests are told not to reconnect."""
+        self.assertEqual(self.client.get(reverse('messaging:events')).status_code, 401)
+        self.client.login(username='reader', password='testpass123')
+        self.assertEqual(self.client.get(reverse('messaging:events')).status_code, 204)
+
+
+class EventStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='testpass123')
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    async def test_stream_delivers_published_events(self):
+        """Test that an open stream receives events published for its user."""
+        response = await self.async_client.get(reverse('messaging:events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = response.streaming_content.__aiter__()
+
+        self.assertEqual(await chunks.__anext__(), b'retry: 3000\n\n')
+        self.assertEqual(events.hub.stream_count(self.user.id), 1)
+
+        # Published from another thread, as a sync view would
+        await sync_to_async(events.publish, thread_sensitive=False)(self.user.id, 'message', {'text': 'hi'})
+        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=2)
+        self.assertEqual(chunk, b'id: 1\nevent: message\ndata: {"text": "hi"}\n\n')
+
+        await chunks.aclose()
+
+    @override_settings(MESSAGING_EVENTS_KEEPALIVE=0.05, MESSAGING_EVENTS_MAX_AGE=0.12)
+    async def test_idle_stream_sends_keepalives_and_expires(self):
+        """Test that an idle stream sends keepalive comments and ends at its maximum age."""
+        response = await self.async_client.get(reverse('messaging:events'))
+        chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(chunks[0], b'retry: 3000\n\n')
+        self.assertIn(b': keepalive\n\n', chunks[1:])
+        self.assertEqual(events.hub.stream_count(self.user.id), 0)
+
+
+    async def test_stream_closes_when_the_client_falls_behind(self):
+        """Test that a stream whose queue overflowed ends so the client reconnects and catches up."""
+        response = await self.async_client.get(reverse('messaging:events'))
+        chunks = response.streaming_content.__aiter__()
+        self.assertEqual(await chunks.__anext__(), b'retry: 3000\n\n')
+
+        for i in range(events.QUEUE_SIZE + 1):
+            events.hub.dispatch(self.user.id, {'type': 'message', 'data': {'n': i}})
+        await asyncio.sleep(0)
+        rest = await asyncio.wait_for(self.collect(chunks), timeout=2)
+
+        self.assertEqual(rest, [])
+        self.assertEqual(events.hub.stream_count(self.user.id), 0)
+
+    async def collect(self, chunks):
+        return [chunk async for chunk in chunks]
+
+
+class FlakyRedis:
+    """
+    Stand-in Redis client whose first subscription drops, whose second
+    delivers one event and whose third stops the listener thread.
+    """
+    def __init__(self, event):
+        self.event = event
+        self.subscriptions = 0
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FlakyPubSub(self)
+
+
+class FlakyPubSub:
+    def __init__(self, client):
+        self.client = client
+
+    def subscribe(self, channel):
+        self.client.subscriptions += 1
+        if self.client.subscriptions > 2:
+            raise SystemExit
+
+    def listen(self):
+        if self.client.subscriptions == 1:
+            raise ConnectionError('Connection reset by peer')
+        yield {'data': 'not json'}
+        yield {'data': json.dumps(self.client.event)}
+
+    def close(self):
+        pass
+
+
+class RedisBackendTest(TestCase):
+    async def test_listener_resubscribes_after_connection_errors(self):
+        """Test that the listener logs a dropped connection, resubscribes and is reset when it exits."""
+        queue = events.hub.subscribe(7)
+        backend = events.RedisBackend(client=FlakyRedis([7, {'type': 'message', 'data': {'text': 'hi'}}]))
+        backend.reconnect_delay = 0
+        try:
+            with self.assertLogs('messaging.events') as logs:
+                backend.start()
+                event = await asyncio.wait_for(queue.get(), timeout=2)
+                # The third subscription stops the thread
+                for _ in range(200):
+                    if backend._listener is None:
+                        break
+                    await asyncio.sleep(0.01)
+        finally:
+            events.hub.unsubscribe(7, queue)
+
+        self.assertEqual(event, {'type': 'message', 'data': {'text': 'hi'}})
+        self.assertIn('Connection reset by peer', '\n'.join(logs.output))
+        self.assertIn('malformed', '\n'.join(logs.output))
+        self.assertIsNone(backend._listener)
@@ -5,7 +5,10 @@ app_name = 'messaging'
 
 urlpatterns = [
     path('', views.messages_list_view, name='list'),
+    path('events/', views.events_view, name='events'),
     path('<int:conversation_id>/', views.conversation_detail_view, name='conversation_detail'),
+    path('<int:conversation_id>/messages/', views.conversation_messages_view, name='conversation_messages'),
+    path('<int:conversation_id>/read/', views.mark_read_view, name='mark_read'),
     path('<int:conversation_id>/send/', views.send_message_view, name='send_message'),
     path('start/<str:username>/', views.start_conversation_view, name='start_conversation'),
 ]
@@ -1,35 +1,30 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import JsonResponse
-from django.db.models import Q, Max
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.views.decorators.http import require_POST
 from django.contrib import messages as django_messages
-from .models import Conversation, Message
+from social_platform.pagination import CursorPaginator
+from . import events, inbox
+from .models import Conversation, InboxEntry, Message, pair_key
+
+MESSAGES_PER_PAGE = 30
 
 
 @login_required
 def messages_list_view(request):
     """Display list of conversations for the current user"""
-    conversations = Conversation.objects.filter(
-        participants=request.user
-    ).annotate(
-        last_message_time=Max('messages__created_at')
-    ).order_by('-last_message_time')
-
-    # Add unread count for each conversation
-    for conversation in conversations:
-        conversation.unread_count = Message.objects.filter(
-            conversation=conversation,
-            is_read=False
-        ).exclude(sender=request.user).count()
-
-        conversation.other_participant = conversation.get_other_participant(request.user)
-        conversation.last_message = conversation.get_last_message()
+    entries = InboxEntry.objects.filter(
+        user=request.user
+    ).select_related('other_participant__profile').order_by('-last_message_at')
 
     context = {
-        'conversations': conversations,
+        'entries': entries,
     }
-    return render(request, 'messages/messages_list.html', context)
+    return render(request, 'messaging/messages_list.html', context)
 
 
 @login_required
@@ -42,20 +37,89 @@ def conversation_detail_view(request, conversation_id):
     )
 
     # Mark all messages in this conversation as read
-    Message.objects.filter(
-        conversation=conversation,
-        is_read=False
-    ).exclude(sender=request.user).update(is_read=True)
+    _mark_read(conversation, request.user)
 
-    messages = conversation.messages.all().select_related('sender__profile')
+    # Newest page only; older pages are fetched from conversation_messages_view
+    page = _message_page(request, conversation)
     other_participant = conversation.get_other_participant(request.user)
 
     context = {
         'conversation': conversation,
-        'messages': messages,
+        'messages': page.object_list[::-1],
+        'next_cursor': page.next_cursor,
         'other_participant': other_participant,
     }
-    return render(request, 'messages/conversation_detail.html', context)
+    return render(request, 'messaging/conversation_detail.html', context)
+
+
+@login_required
+@require_POST
+def mark_read_view(request, conversation_id):
+    """Mark a conversation read up to its latest message, e.g. after a message arrived live"""
+    conversation = get_object_or_404(
+        Conversation,
+        id=conversation_id,
+        participants=request.user
+    )
+    return JsonResponse({'success': True, 'had_unread': _mark_read(conversation, request.user)})
+
+
+def _mark_read(conversation, user):
+    with transaction.atomic():
+        had_unread = inbox.mark_read(conversation, user)
+        if had_unread:
+            transaction.on_commit(lambda: _publish_read(conversation, user))
+    return had_unread
+
+
+@login_required
+def conversation_messages_view(request, conversation_id):
+    """
+    Return a page of older messages as JSON, oldest first, or with ``after``
+    the messages newer than that id, to catch up after a reconnect
+    """
+    conversation = get_object_or_404(
+        Conversation,
+        id=conversation_id,
+        participants=request.user
+    )
+    if 'after' in request.GET:
+        try:
+            after = int(request.GET['after'])
+        except ValueError:
+            return JsonResponse({'error': 'after must be a message id'}, status=400)
+        newer = list(conversation.messages.select_related('sender__profile').filter(
+            pk__gt=after
+        ).order_by('pk')[:MESSAGES_PER_PAGE + 1])
+        return JsonResponse({
+            'messages': [_message_data(message, request.user.id) for message in newer[:MESSAGES_PER_PAGE]],
+            'has_more': len(newer) > MESSAGES_PER_PAGE,
+        })
+
+    page = _message_page(request, conversation)
+
+    return JsonResponse({
+        'messages': [_message_data(message, request.user.id) for message in reversed(page.object_list)],
+        'next_cursor': page.next_cursor,
+    })
+
+
+def _message_page(request, conversation):
+    # Keyset pagination on (created_at, id): any page is one index range scan
+    paginator = CursorPaginator(conversation.messages.select_related('sender__profile'), MESSAGES_PER_PAGE)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def _message_data(message, viewer_id):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'sender': message.sender.username,
+        'sender_picture': message.sender.profile.profile_picture.url,
+        'is_own': message.sender_id == viewer_id,
+        'time': message.time_since_sent(),
+        'created_at': message.created_at.isoformat(),
+    }
 
 
 @login_required
@@ -70,30 +134,60 @@ def send_message_view(request, conversation_id):
 
         content = request.POST.get('content', '').strip()
         if content:
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=request.user,
-                content=content
-            )
+            with transaction.atomic():
+                message = Message.objects.create(
+                    conversation=conversation,
+                    sender=request.user,
+                    content=content
+                )
+
+                # Update conversation timestamp
+                conversation.save()
+                inbox.record_message(message)
 
-            # Update conversation timestamp
-            conversation.save()
+                participant_ids = list(conversation.participants.values_list('id', flat=True))
+                transaction.on_commit(lambda: _publish_message(message, participant_ids))
 
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({
                     'success': True,
-                    'message': {
-                        'id': message.id,
-                        'content': message.content,
-                        'sender': message.sender.username,
-                        'time': message.time_since_sent(),
-                        'created_at': message.created_at.isoformat(),
-                    }
+                    'message': _message_data(message, request.user.id),
                 })
 
     return redirect('messaging:conversation_detail', conversation_id=conversation_id)
 
 
+def _publish_message(message, participant_ids):
+    for user_id in participant_ids:
+        events.publish(user_id, 'message', {
+            'conversation_id': message.conversation_id,
+            'message': _message_data(message, user_id),
+        })
+
+
+def _publish_read(conversation, reader):
+    read_receipt = {'conversation_id': conversation.id, 'reader': reader.username}
+    for user_id in conversation.participants.exclude(id=reader.id).values_list('id', flat=True):
+        events.publish(user_id, 'read', read_receipt)
+
+
+async def events_view(request):
+    """Stream new messages and read receipts for the user's conversations (Server-Sent Events)"""
+    user_id = await sync_to_async(lambda: request.user.id if request.user.is_authenticated else None)()
+    if user_id is None:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be tied up for the whole stream; 204 tells
+        # EventSource not to reconnect
+        return HttpResponse(status=204)
+
+    response = StreamingHttpResponse(events.stream(user_id), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Deliver events as they are written instead of buffering at the proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def start_conversation_view(request, username):
     """Start a new conversation with a user"""
@@ -103,18 +197,18 @@ def start_conversation_view(request, username):
         django_messages.error(request, "You can't start a conversation with yourself.")
         return redirect('messaging:list')
 
-    # Check if conversation already exists
-    existing_conversation = Conversation.objects.filter(
-        participants=request.user
-    ).filter(
-        participants=other_user
-    ).first()
-
-    if existing_conversation:
-        return redirect('messaging:conversation_detail', conversation_id=existing_conversation.id)
-
-    # Create new conversation
-    conversation = Conversation.objects.create()
-    conversation.participants.add(request.user, other_user)
+    # One indexed lookup on the pair's key instead of joining participants twice
+    key = pair_key(request.user.id, other_user.id)
+    conversation = Conversation.objects.filter(pair_key=key).first()
+
+    if conversation is None:
+        try:
+            with transaction.atomic():
+                conversation = Conversation.objects.create(pair_key=key)
+                conversation.participants.add(request.user, other_user)
+                inbox.create_entries(conversation, [request.user.id, other_user.id])
+        except IntegrityError:
+            # A concurrent request created it first
+            conversation = Conversation.objects.get(pair_key=key)
 
     return redirect('messaging:conversation_detail', conversation_id=conversation.id)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from posts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the post full-text search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Posts indexed per batch (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding search index...')
+        count = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {count} posts!')
+        )
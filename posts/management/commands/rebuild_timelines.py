@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from posts.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from follows and posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Only rebuild the timeline of this username',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+
+        count = 0
+        for user in users.iterator(chunk_size=500):
+            rebuild_timeline(user)
+            count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {count} timelines!')
+        )
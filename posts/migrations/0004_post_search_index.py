@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# The index as it was created by this migration; posts.search may change later
+SEARCH_TABLE = 'posts_search'
+
+CHUNK_SIZE = 1000
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "content, author, tokenize='unicode61 remove_diacritics 2')"
+        )
+        insert = f"INSERT INTO {SEARCH_TABLE} (rowid, content, author) VALUES (%s, %s, %s)"
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "post_id bigint PRIMARY KEY REFERENCES posts(id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+        insert = (
+            f"INSERT INTO {SEARCH_TABLE} (post_id, document) VALUES (%s, "
+            "to_tsvector('simple', %s) || to_tsvector('simple', %s)) "
+            "ON CONFLICT (post_id) DO NOTHING"
+        )
+    else:
+        return
+
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.using(schema_editor.connection.alias).order_by('id').values_list(
+        'id', 'content', 'author__username', 'author__first_name', 'author__last_name'
+    )
+    with schema_editor.connection.cursor() as cursor:
+        batch = []
+        for post_id, content, username, first_name, last_name in posts.iterator(chunk_size=CHUNK_SIZE):
+            batch.append((post_id, content, ' '.join(filter(None, [username, first_name, last_name]))))
+            if len(batch) >= CHUNK_SIZE:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_author_created_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -2,14 +2,14 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
-from PIL import Image
-import os
+from social_platform.images import ResizeImagesMixin
 
 
-class Post(models.Model):
+class Post(ResizeImagesMixin, models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField(max_length=2000)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,6 +17,10 @@ class Post(models.Model):
     likes_count = models.PositiveIntegerField(default=0)
     comments_count = models.PositiveIntegerField(default=0)
 
+    # Uploaded images are shrunk to fit and encoded at smaller widths in the background
+    resize_fields = {'image': (800, 800)}
+    variant_fields = {'image': ('image_variants', (320, 640, 800))}
+
     class Meta:
         db_table = 'posts'
         ordering = ['-created_at']
@@ -24,6 +28,7 @@ class Post(models.Model):
             models.Index(fields=['author']),
             models.Index(fields=['created_at']),
             models.Index(fields=['-created_at']),
+            models.Index(fields=['author', '-created_at']),
         ]
 
     def __str__(self):
@@ -32,17 +37,6 @@ class Post(models.Model):
     def get_absolute_url(self):
         return reverse('posts:detail', kwargs={'pk': self.pk})
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # Resize image if it exists
-        if self.image and os.path.exists(self.image.path):
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
-
     @property
     def time_since_posted(self):
         now = timezone.now()
@@ -103,3 +97,24 @@ class Comment(models.Model):
             return f"{diff.seconds // 60}m"
         else:
             return "now"
+
+
+class TimelineEntry(models.Model):
+    """A post materialized into a user's home timeline (fan-out on write)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copied from the post so the timeline can be read without joining posts
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'timeline_entries'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in {self.user_id}'s timeline"
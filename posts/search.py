@@ -0,0 +1,159 @@
+"""
+Full-text search over posts.
+
+Posts are kept in an inverted index that is updated whenever a post is
+created, edited or deleted, and when its author changes their names:
+
+* SQLite: an FTS5 virtual table ranked with ``bm25()``.
+* PostgreSQL: a ``tsvector`` table with a GIN index ranked with
+  ``ts_rank_cd()`` (PostgreSQL has no built-in BM25; cover density ranking is
+  the closest equivalent).
+
+Any other database falls back to unranked ``icontains`` matching.
+The index table is created by migration ``0004_post_search_index`` and can
+be rebuilt from scratch with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Post
+
+SEARCH_TABLE = 'posts_search'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_results_limit():
+    return getattr(settings, 'SEARCH_RESULTS_LIMIT', 50)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())[:10]
+
+
+def document(content, username, first_name, last_name):
+    return content, ' '.join(filter(None, [username, first_name, last_name]))
+
+
+def write_rows(cursor, rows):
+    """Insert or replace index rows of (post_id, content, author)."""
+    vendor = cursor.db.vendor
+    if vendor == 'sqlite':
+        cursor.executemany(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+        )
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, content, author) VALUES (%s, %s, %s)", rows
+        )
+    elif vendor == 'postgresql':
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (post_id, document) VALUES (%s, "
+            "to_tsvector('simple', %s) || to_tsvector('simple', %s)) "
+            "ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document",
+            rows,
+        )
+
+
+def index_post(post):
+    """Add or refresh a single post in the index."""
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    author = post.author
+    content, names = document(post.content, author.username, author.first_name, author.last_name)
+    with connection.cursor() as cursor:
+        write_rows(cursor, [(post.pk, content, names)])
+
+
+def remove_post(post_id):
+    """Remove a post from the index."""
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    key = 'rowid' if connection.vendor == 'sqlite' else 'post_id'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {key} = %s", [post_id])
+
+
+def _index_posts(cursor, posts, chunk_size):
+    posts = posts.order_by('id').values_list(
+        'id', 'content', 'author__username', 'author__first_name', 'author__last_name'
+    )
+    count = 0
+    batch = []
+    for post_id, content, username, first_name, last_name in posts.iterator(chunk_size=chunk_size):
+        batch.append((post_id, *document(content, username, first_name, last_name)))
+        if len(batch) >= chunk_size:
+            write_rows(cursor, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        write_rows(cursor, batch)
+        count += len(batch)
+    return count
+
+
+def reindex_author(user_id, chunk_size=1000):
+    """Refresh the author names indexed with every post of a user."""
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return 0
+    with connection.cursor() as cursor:
+        return _index_posts(cursor, Post.objects.filter(author_id=user_id), chunk_size)
+
+
+def rebuild_index(chunk_size=1000):
+    """Reindex every post. Returns the number of posts indexed."""
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        return _index_posts(cursor, Post.objects.all(), chunk_size)
+
+
+def search_post_ids(query, limit=None):
+    """Return ids of posts matching ``query``, best match first."""
+    limit = limit or get_results_limit()
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    if connection.vendor == 'sqlite':
+        # Quote every token (so FTS5 operators in user input are inert) and
+        # match it as a prefix, which is what the old icontains search allowed
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        sql = (
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY bm25({SEARCH_TABLE}) LIMIT %s"
+        )
+        params = [match, limit]
+    elif connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        sql = (
+            f"SELECT post_id FROM {SEARCH_TABLE}, to_tsquery('simple', %s) query "
+            "WHERE document @@ query ORDER BY ts_rank_cd(document, query) DESC LIMIT %s"
+        )
+        params = [tsquery, limit]
+    else:
+        filters = Q()
+        for token in tokens:
+            filters &= (
+                Q(content__icontains=token) |
+                Q(author__username__icontains=token) |
+                Q(author__first_name__icontains=token) |
+                Q(author__last_name__icontains=token)
+            )
+        return list(Post.objects.filter(filters).values_list('id', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_posts(query, limit=None):
+    """Return matching posts in rank order, with authors' profiles loaded."""
+    post_ids = search_post_ids(query, limit)
+    posts = Post.objects.filter(id__in=post_ids).select_related('author__profile')
+    rank = {post_id: position for position, post_id in enumerate(post_ids)}
+    return sorted(posts, key=lambda post: rank[post.id])
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import Post
+from . import search
+
+
+@receiver(post_save, sender=Post)
+def index_post_on_save(sender, instance, **kwargs):
+    """Add new posts to the search index and refresh edited ones."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields and 'content' not in update_fields:
+        return
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_on_delete(sender, instance, **kwargs):
+    """Remove deleted posts from the search index."""
+    search.remove_post(instance.pk)
+
+
+AUTHOR_NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def _saves_names(kwargs):
+    update_fields = kwargs.get('update_fields')
+    return not update_fields or bool(set(AUTHOR_NAME_FIELDS) & set(update_fields))
+
+
+@receiver(pre_save, sender=User)
+def remember_author_names(sender, instance, **kwargs):
+    """Note the names a user is saved over, to tell whether their posts need reindexing."""
+    if instance.pk and _saves_names(kwargs):
+        instance._indexed_names = User.objects.filter(pk=instance.pk).values_list(*AUTHOR_NAME_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def reindex_posts_on_rename(sender, instance, created, **kwargs):
+    """Refresh the author names indexed with a user's posts when they change."""
+    old_names = instance.__dict__.pop('_indexed_names', None)
+    if created or old_names is None:
+        return
+    if old_names != tuple(getattr(instance, field) for field in AUTHOR_NAME_FIELDS):
+        search.reindex_author(instance.pk)
@@ -1,10 +1,19 @@
-from django.test import TestCase, Client
-from django.contrib.auth.models import User
+from io import BytesIO
+
+from django.template import Context, Template
+from django.test import TestCase, Client, override_settings
+from django.contrib.auth.models import User, AnonymousUser
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Post, Comment
+from .models import Post, Comment, TimelineEntry
 from .forms import PostForm, CommentForm
-from social.models import Like
+from .timeline import get_timeline_post_ids, rebuild_timeline, trim_timelines
+from .viewer_state import attach_viewer_state
+from .search import search_post_ids, rebuild_index
+from social.models import Like, Follow
+from social_platform.pagination import CursorPaginator
+from social_platform.test_utils import MediaStorageMixin
+from PIL import Image
 
 
 class PostModelTest(TestCase):
@@ -136,3 +145,311 @@ class PostFormsTest(TestCase):
         form_data = {'content': 'This is a test comment'}
         form = CommentForm(data=form_data)
         self.assertTrue(form.is_valid())
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+
+    def test_post_fans_out_to_followers(self):
+        """Test that a new post is pushed into followers' timelines."""
+        Follow.objects.create(follower=self.reader, following=self.author)
+        post = Post.objects.create(author=self.author, content='Fan out')
+        self.assertIn(post.id, get_timeline_post_ids(self.reader))
+        self.assertIn(post.id, get_timeline_post_ids(self.author))
+        self.assertNotIn(post.id, get_timeline_post_ids(self.stranger))
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        """Test that following backfills the timeline and unfollowing trims it."""
+        post = Post.objects.create(author=self.author, content='Older post')
+        self.assertNotIn(post.id, get_timeline_post_ids(self.reader))
+
+        follow = Follow.objects.create(follower=self.reader, following=self.author)
+        self.assertIn(post.id, get_timeline_post_ids(self.reader))
+
+        follow.delete()
+        self.assertNotIn(post.id, get_timeline_post_ids(self.reader))
+
+    @override_settings(TIMELINE_CELEBRITY_THRESHOLD=1)
+    def test_celebrity_posts_are_merged_on_read(self):
+        """Test that celebrity posts are not fanned out but still appear."""
+        Follow.objects.create(follower=self.reader, following=self.author)
+        post = Post.objects.create(author=self.author, content='Celebrity post')
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, post=post).exists())
+        self.assertIn(post.id, get_timeline_post_ids(self.reader))
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_timeline_is_capped(self):
+        """Test that the timeline returns at most the configured number of posts."""
+        Follow.objects.create(follower=self.reader, following=self.author)
+        posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(3)]
+        self.assertEqual(len(get_timeline_post_ids(self.reader)), 2)
+        self.assertNotIn(posts[0].id, get_timeline_post_ids(self.reader))
+
+    @override_settings(TIMELINE_MAX_LENGTH=2, TIMELINE_TRIM_INTERVAL=1)
+    def test_fan_out_trims_stored_entries(self):
+        """Test that fan-out deletes stored entries beyond the cap, not just hides them."""
+        Follow.objects.create(follower=self.reader, following=self.author)
+        posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(4)]
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.reader).values_list('post_id', flat=True)),
+            {posts[3].id, posts[2].id},
+        )
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_trim_keeps_entries_tied_with_the_cutoff(self):
+        """Test that trimming keeps exactly the cap when entries share a timestamp."""
+        posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(3)]
+        Post.objects.update(created_at=posts[0].created_at)
+        TimelineEntry.objects.filter(user=self.author).update(created_at=posts[0].created_at)
+
+        trim_timelines([self.author.id])
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.author).values_list('post_id', flat=True)),
+            {posts[2].id, posts[1].id},
+        )
+
+    @override_settings(TIMELINE_MAX_LENGTH=1)
+    def test_trim_is_one_query_per_batch(self):
+        """Test that trimming many timelines issues a single DELETE."""
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Follow.objects.create(follower=self.stranger, following=self.author)
+        posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(3)]
+        user_ids = [self.author.id, self.reader.id, self.stranger.id]
+
+        with self.assertNumQueries(1):
+            trim_timelines(user_ids)
+        for user_id in user_ids:
+            self.assertEqual(
+                list(TimelineEntry.objects.filter(user_id=user_id).values_list('post_id', flat=True)),
+                [posts[2].id],
+            )
+
+    def test_rebuild_timeline(self):
+        """Test rebuilding a timeline from follows and posts."""
+        post = Post.objects.create(author=self.author, content='Rebuilt')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        TimelineEntry.objects.filter(user=self.reader).delete()
+
+        rebuild_timeline(self.reader)
+        self.assertIn(post.id, get_timeline_post_ids(self.reader))
+
+
+class ViewerStateTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(5)]
+        Like.objects.create(user=self.viewer, post=self.posts[0])
+        Comment.objects.create(post=self.posts[1], author=self.viewer, content='Nice')
+        Comment.objects.create(post=self.posts[1], author=self.viewer, content='Really nice')
+
+    def test_viewer_state_single_query(self):
+        """Test that viewer state for a page of posts is fetched in one query."""
+        posts = list(Post.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            posts = attach_viewer_state(posts, self.viewer)
+
+        self.assertTrue(posts[0].is_liked)
+        self.assertFalse(posts[0].has_commented)
+        self.assertFalse(posts[1].is_liked)
+        self.assertTrue(posts[1].has_commented)
+        self.assertFalse(any(post.is_own for post in posts))
+
+    def test_viewer_state_own_posts(self):
+        """Test that authored posts are flagged without a query."""
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(1):
+            posts = attach_viewer_state(posts, self.author)
+        self.assertTrue(all(post.is_own for post in posts))
+
+    def test_viewer_state_anonymous(self):
+        """Test that anonymous viewers get default state without queries."""
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(0):
+            posts = attach_viewer_state(posts, AnonymousUser())
+        self.assertFalse(any(post.is_liked for post in posts))
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.posts = [Post.objects.create(author=self.user, content=f'Post {i}') for i in range(25)]
+
+    def test_pages_cover_all_posts_in_order(self):
+        """Test that following cursors walks every post exactly once, newest first."""
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        seen = []
+        cursor = None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(post.id for post in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [post.id for post in reversed(self.posts)])
+
+    def test_page_does_not_count(self):
+        """Test that fetching a page issues a single query and no COUNT(*)."""
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        first = paginator.page()
+        with self.assertNumQueries(1):
+            page = paginator.page(first.next_cursor)
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_previous())
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Test that a malformed cursor returns the first page."""
+        page = CursorPaginator(Post.objects.all(), 10).get_page('not-a-cursor')
+        self.assertEqual(page[0], self.posts[-1])
+        self.assertFalse(page.has_previous())
+
+    def test_feed_view_with_cursor(self):
+        """Test that the feed follows the next cursor."""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('posts:feed'))
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertIsNotNone(next_cursor)
+
+        response = self.client.get(reverse('posts:feed'), {'cursor': next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Post 14')
+        self.assertNotContains(response, 'Post 15<')
+
+
+class PostSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='gardener', first_name='Rosa', last_name='Thorn', password='testpass123'
+        )
+        self.tulips = Post.objects.create(author=self.user, content='Tulips tulips and more tulips')
+        self.roses = Post.objects.create(author=self.user, content='Planting roses next to the tulips')
+        self.other = Post.objects.create(author=self.user, content='Nothing to see here')
+
+    def test_search_ranks_results(self):
+        """Test that the post mentioning the term most often ranks first."""
+        self.assertEqual(search_post_ids('tulips'), [self.tulips.id, self.roses.id])
+
+    def test_search_matches_prefixes_and_authors(self):
+        """Test prefix matching on content and matching on author names."""
+        self.assertEqual(search_post_ids('plant'), [self.roses.id])
+        self.assertCountEqual(search_post_ids('thorn'), [self.tulips.id, self.roses.id, self.other.id])
+
+    def test_search_index_follows_edits_and_deletes(self):
+        """Test that edited and deleted posts are reindexed."""
+        self.other.content = 'Sunflowers everywhere'
+        self.other.save()
+        self.assertEqual(search_post_ids('sunflowers'), [self.other.id])
+        self.assertEqual(search_post_ids('nothing'), [])
+
+        self.other.delete()
+        self.assertEqual(search_post_ids('sunflowers'), [])
+
+    def test_search_index_follows_author_renames(self):
+        """Test that renaming the author reindexes their posts."""
+        self.user.first_name = 'Petunia'
+        self.user.save()
+        self.assertCountEqual(search_post_ids('petunia'), [self.tulips.id, self.roses.id, self.other.id])
+        self.assertEqual(search_post_ids('rosa'), [])
+
+    def test_search_limit_and_operators(self):
+        """Test the result limit and that query syntax characters are ignored."""
+        self.assertEqual(len(search_post_ids('tulips', limit=1)), 1)
+        self.assertEqual(search_post_ids('"tulips*) ('), [self.tulips.id, self.roses.id])
+        self.assertEqual(search_post_ids('!!!'), [])
+
+    def test_rebuild_index(self):
+        """Test rebuilding the index from scratch."""
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(search_post_ids('tulips'), [self.tulips.id, self.roses.id])
+
+    def test_search_view(self):
+        """Test the search view returns ranked posts."""
+        response = self.client.get(reverse('posts:search'), {'q': 'roses'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['posts']), [self.roses])
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class ImageResizeTest(MediaStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='photographer', password='testpass123')
+
+    def make_image(self, size=(1600, 1200)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_new_image_is_resized_after_commit(self):
+        """Test that a new post image is shrunk by the background job, not in save()."""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            post = Post.objects.create(author=self.user, content='Photo', image=self.make_image())
+            with Image.open(post.image.path) as img:
+                self.assertEqual(img.size, (1600, 1200))
+        self.assertEqual(len(callbacks), 1)
+
+        with Image.open(post.image.path) as img:
+            self.assertEqual(img.size, (800, 600))
+
+    def test_variants_are_generated_and_rendered(self):
+        """Test that WebP variants are recorded and emitted as srcset candidates."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.user, content='Photo', image=self.make_image())
+        post.refresh_from_db()
+
+        manifest = post.image_variants
+        self.assertEqual(manifest['source'], post.image.name)
+        webp = manifest['formats']['image/webp']
+        self.assertEqual([width for width, _ in webp], [320, 640, 800])
+        with post.image.storage.open(webp[0][1]) as f, Image.open(f) as img:
+            self.assertEqual((img.format, img.width), ('WEBP', 320))
+
+        html = Template(
+            '{% load responsive_images %}{% image_sources post.image post.image_variants "50vw" %}'
+        ).render(Context({'post': post}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'{post.image.storage.url(webp[1][1])} 640w', html)
+        self.assertIn('sizes="50vw"', html)
+
+    def test_stale_variants_are_not_rendered(self):
+        """Test that variants built for a previous image are ignored."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.user, content='Photo', image=self.make_image())
+        post.refresh_from_db()
+        post.image.name = 'post_images/other.jpg'
+
+        html = Template(
+            '{% load responsive_images %}{% image_sources post.image post.image_variants %}'
+        ).render(Context({'post': post}))
+        self.assertEqual(html, '')
+
+    def test_saves_without_image_change_skip_resize(self):
+        """Test that counter updates and unrelated edits do not enqueue image work."""
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.user, content='Photo', image=self.make_image())
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            post.likes_count = 5
+            post.save(update_fields=['likes_count'])
+            post.content = 'Edited'
+            post.save()
+            Post.objects.get(pk=post.pk).save()
+            self.user.profile.bio = 'Hello'
+            self.user.profile.save()
+        self.assertEqual(callbacks, [])
+
+    def test_profile_picture_change_is_resized(self):
+        """Test that uploading a new profile picture shrinks it to 300px."""
+        profile = User.objects.get(pk=self.user.pk).profile
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            profile.profile_picture = self.make_image()
+            profile.save()
+        self.assertEqual(len(callbacks), 1)
+
+        with Image.open(profile.profile_picture.path) as img:
+            self.assertEqual(img.size, (300, 225))
@@ -0,0 +1,155 @@
+"""
+Materialized home timelines.
+
+New posts are pushed into each follower's timeline when they are created
+(fan-out on write), so building the feed is a single indexed range scan over
+``TimelineEntry`` instead of an ``author__in`` query over every followed
+account. Authors with very large audiences are skipped at write time and
+their posts are merged into the timeline when it is read (fan-out on read).
+
+Timelines are capped at ``TIMELINE_MAX_LENGTH`` entries. Trimming every
+recipient on every post would cost an extra index scan per follower, so
+fan-out trims the recipients of one post in ``TIMELINE_TRIM_INTERVAL``,
+one ``DELETE`` per batch of followers;
+between trims a timeline can run a little over the cap, and reads never
+look past it.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from accounts.models import UserProfile
+from social.models import Follow
+from .models import Post, TimelineEntry
+
+
+def get_timeline_max_length():
+    return getattr(settings, 'TIMELINE_MAX_LENGTH', 800)
+
+
+def get_trim_interval():
+    return getattr(settings, 'TIMELINE_TRIM_INTERVAL', 20)
+
+
+def get_celebrity_threshold():
+    return getattr(settings, 'TIMELINE_CELEBRITY_THRESHOLD', 10000)
+
+
+def is_celebrity(user):
+    """Whether posts by this user are merged on read instead of fanned out."""
+    followers_count = UserProfile.objects.filter(user_id=user.id).values_list(
+        'followers_count', flat=True
+    ).first() or 0
+    return followers_count >= get_celebrity_threshold()
+
+
+def _push(user_ids, posts):
+    entries = [
+        TimelineEntry(user_id=user_id, post_id=post.id, created_at=post.created_at)
+        for user_id in user_ids
+        for post in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=500, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """Push a newly created post into its author's and followers' timelines."""
+    # Post ids are sequential, so this trims about one post in every interval
+    trim = post.id % get_trim_interval() == 0
+    _push([post.author_id], [post])
+    if trim:
+        trim_timelines([post.author_id])
+    if is_celebrity(post.author):
+        return
+
+    batch_size = getattr(settings, 'TIMELINE_FAN_OUT_BATCH_SIZE', 1000)
+    follower_ids = Follow.objects.filter(
+        following_id=post.author_id
+    ).values_list('follower_id', flat=True).order_by('follower_id')
+
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=batch_size):
+        batch.append(follower_id)
+        if len(batch) >= batch_size:
+            _push(batch, [post])
+            if trim:
+                trim_timelines(batch)
+            batch = []
+    if batch:
+        _push(batch, [post])
+        if trim:
+            trim_timelines(batch)
+
+
+def backfill_timeline(user, author):
+    """Copy an author's recent posts into a new follower's timeline."""
+    if is_celebrity(author):
+        return
+    backfill_size = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 50)
+    posts = list(Post.objects.filter(author=author).only('id', 'created_at')[:backfill_size])
+    _push([user.id], posts)
+    trim_timelines([user.id])
+
+
+def remove_author_from_timeline(user, author):
+    """Drop an unfollowed author's posts from a user's timeline."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def trim_timelines(user_ids):
+    """Delete the entries that fall beyond the cap of each user's timeline."""
+    # One DELETE for the whole batch: entries are ranked per user in the
+    # (created_at, post) order reads use, and everything past the cap goes
+    ranked = TimelineEntry.objects.filter(user_id__in=user_ids).annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('created_at').desc(), F('post_id').desc()],
+        )
+    )
+    TimelineEntry.objects.filter(
+        pk__in=ranked.filter(rank__gt=get_timeline_max_length()).values('pk')
+    ).delete()
+
+
+@transaction.atomic
+def rebuild_timeline(user):
+    """Recompute a user's timeline from scratch."""
+    max_length = get_timeline_max_length()
+    TimelineEntry.objects.filter(user=user).delete()
+
+    author_ids = list(Follow.objects.filter(
+        follower=user,
+        following__profile__followers_count__lt=get_celebrity_threshold(),
+    ).values_list('following_id', flat=True))
+    author_ids.append(user.id)
+
+    posts = Post.objects.filter(author_id__in=author_ids).only('id', 'created_at')[:max_length]
+    _push([user.id], list(posts))
+
+
+def get_timeline_post_ids(user):
+    """
+    Return the ids of the newest posts in a user's home timeline, merging the
+    materialized entries with recent posts from followed celebrity accounts.
+    """
+    max_length = get_timeline_max_length()
+    stored = list(TimelineEntry.objects.filter(user=user).order_by('-created_at', '-post_id').values_list(
+        'created_at', 'post_id'
+    )[:max_length])
+
+    celebrity_ids = Follow.objects.filter(
+        follower=user,
+        following__profile__followers_count__gte=get_celebrity_threshold(),
+    ).values_list('following_id', flat=True)
+    merged = list(Post.objects.filter(author_id__in=celebrity_ids).values_list(
+        'created_at', 'id'
+    )[:max_length])
+
+    if not merged:
+        return [post_id for _, post_id in stored]
+
+    combined = sorted(set(stored) | set(merged), reverse=True)[:max_length]
+    return [post_id for _, post_id in combined]
+
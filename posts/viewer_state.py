@@ -0,0 +1,50 @@
+"""
+Per-viewer state for lists of posts.
+
+Templates need to know, for every rendered post, whether the current user
+liked it, commented on it or wrote it. Rather than asking the database once
+per post, ``attach_viewer_state`` resolves the whole page in a single query.
+"""
+from django.db.models import CharField, Value
+
+from social.models import Like
+from .models import Comment
+
+
+def attach_viewer_state(posts, user):
+    """
+    Set ``is_liked``, ``has_commented`` and ``is_own`` on each post for the
+    given viewer and return the posts as a list.
+    """
+    posts = list(posts)
+    viewer_id = user.id if user.is_authenticated else None
+
+    for post in posts:
+        post.is_liked = False
+        post.has_commented = False
+        post.is_own = viewer_id is not None and post.author_id == viewer_id
+
+    if viewer_id is None or not posts:
+        return posts
+
+    post_ids = [post.id for post in posts]
+    liked = Like.objects.filter(user_id=viewer_id, post_id__in=post_ids).annotate(
+        kind=Value('like', output_field=CharField())
+    ).order_by().values_list('post_id', 'kind')
+    commented = Comment.objects.filter(author_id=viewer_id, post_id__in=post_ids).annotate(
+        kind=Value('comment', output_field=CharField())
+    ).order_by().values_list('post_id', 'kind')
+
+    liked_ids = set()
+    commented_ids = set()
+    for post_id, kind in liked.union(commented):
+        if kind == 'like':
+            liked_ids.add(post_id)
+        else:
+            commented_ids.add(post_id)
+
+    for post in posts:
+        post.is_liked = post.id in liked_ids
+        post.has_commented = post.id in commented_ids
+
+    return posts
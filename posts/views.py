@@ -1,36 +1,36 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from .models import Post, Comment
+from social_platform.pagination import CursorPaginator
 from .forms import PostForm, CommentForm
-from social.models import Like, Follow
+from .timeline import get_timeline_post_ids
+from .viewer_state import attach_viewer_state
+from .search import search_posts
+from social.models import Like
+from social import counters
+from social.services import toggle_post_like
 
 
 @login_required
 def feed_view(request):
-    # Get posts from users that the current user follows, plus their own posts
-    following_users = Follow.objects.filter(follower=request.user).values_list('following', flat=True)
-    posts = Post.objects.filter(
-        Q(author__in=following_users) | Q(author=request.user)
-    ).select_related('author__profile').prefetch_related('likes', 'comments__author')
-
-    # If user doesn't follow anyone, show recent posts from all users
-    if not posts.exists():
-        posts = Post.objects.all().select_related('author__profile').prefetch_related('likes', 'comments__author')
-
-    # Pagination
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    # Add liked status for each post
-    if request.user.is_authenticated:
-        for post in page_obj:
-            post.is_liked = Like.objects.filter(user=request.user, post=post).exists()
+    # Read the precomputed home timeline (own posts plus followed users' posts)
+    post_ids = get_timeline_post_ids(request.user)
+    posts = Post.objects.filter(id__in=post_ids).select_related('author__profile')
+
+    # If the timeline is empty, show recent posts from all users
+    if not post_ids:
+        posts = Post.objects.all().select_related('author__profile')
+
+    # Keyset pagination: no COUNT(*) and no OFFSET scan
+    paginator = CursorPaginator(posts, 10)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    # Add liked/commented/authored status for the whole page in one query
+    page_obj.object_list = attach_viewer_state(page_obj.object_list, request.user)
+    counters.apply_pending(page_obj.object_list, 'likes_count', 'comments_count')
 
     context = {
         'page_obj': page_obj,
@@ -57,6 +57,7 @@ def create_post_view(request):
 
 def post_detail_view(request, pk):
     post = get_object_or_404(Post, pk=pk)
+    counters.apply_pending([post], 'likes_count', 'comments_count')
     comments = post.comments.filter(parent=None).select_related('author__profile').prefetch_related('replies__author__profile')
 
     # Check if user liked the post
@@ -117,22 +118,12 @@ def delete_post_view(request, pk):
 @require_POST
 def like_post_view(request, pk):
     post = get_object_or_404(Post, pk=pk)
-    like, created = Like.objects.get_or_create(user=request.user, post=post)
-
-    if not created:
-        like.delete()
-        is_liked = False
-    else:
-        is_liked = True
-
-    # Update the likes count
-    post.likes_count = Like.objects.filter(post=post).count()
-    post.save()
+    is_liked, likes_count = toggle_post_like(request.user, post)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
         return JsonResponse({
             'is_liked': is_liked,
-            'likes_count': post.likes_count
+            'likes_count': likes_count
         })
 
     return redirect('posts:detail', pk=pk)
@@ -174,17 +165,15 @@ def delete_comment_view(request, pk):
 
 
 def explore_view(request):
-    posts = Post.objects.all().select_related('author__profile').prefetch_related('likes', 'comments__author')
+    posts = Post.objects.all().select_related('author__profile')
 
-    # Pagination
-    paginator = Paginator(posts, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: no COUNT(*) and no OFFSET scan
+    paginator = CursorPaginator(posts, 12)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
-    # Add liked status for each post
-    if request.user.is_authenticated:
-        for post in page_obj:
-            post.is_liked = Like.objects.filter(user=request.user, post=post).exists()
+    # Add liked/commented/authored status for the whole page in one query
+    page_obj.object_list = attach_viewer_state(page_obj.object_list, request.user)
+    counters.apply_pending(page_obj.object_list, 'likes_count', 'comments_count')
 
     context = {
         'page_obj': page_obj,
@@ -197,17 +186,12 @@ def search_posts_view(request):
     posts = []
 
     if query:
-        posts = Post.objects.filter(
-            Q(content__icontains=query) |
-            Q(author__username__icontains=query) |
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query)
-        ).select_related('author__profile').prefetch_related('likes', 'comments__author')
-
-        # Add liked status for each post
-        if request.user.is_authenticated:
-            for post in posts:
-                post.is_liked = Like.objects.filter(user=request.user, post=post).exists()
+        # Ranked full-text search, capped at SEARCH_RESULTS_LIMIT results
+        posts = search_posts(query)
+
+        # Add liked/commented/authored status for the results in one query
+        posts = attach_viewer_state(posts, request.user)
+        counters.apply_pending(posts, 'likes_count', 'comments_count')
 
     context = {
         'posts': posts,
@@ -219,12 +203,11 @@ def search_posts_view(request):
 def reels_view(request):
     """Display reels in a TikTok/Instagram Reels style interface."""
     # Get all posts to use as reels (in a real app, you'd have a separate Reel model)
-    reels = Post.objects.all().select_related('author__profile').prefetch_related('likes', 'comments__author').order_by('-created_at')
+    reels = Post.objects.all().select_related('author__profile').order_by('-created_at')
 
-    # Add liked status for each reel
-    if request.user.is_authenticated:
-        for reel in reels:
-            reel.is_liked = Like.objects.filter(user=request.user, post=reel).exists()
+    # Add liked/commented/authored status for every reel in one query
+    reels = attach_viewer_state(reels, request.user)
+    counters.apply_pending(reels, 'likes_count', 'comments_count')
 
     context = {
         'reels': reels,
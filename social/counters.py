@@ -0,0 +1,215 @@
+"""
+Write-buffered engagement counters.
+
+Every like, comment and follow adjusts a denormalized counter column
+(``Post.likes_count``, ``UserProfile.followers_count`` ...). On a viral post
+all of those updates land on the same row and serialize on its lock.
+
+When ``ENGAGEMENT_COUNTER_FLUSH_INTERVAL`` is positive, increments are
+accumulated in process memory instead and a background thread folds them
+into the database every interval, one UPDATE per row no matter how many
+increments it received. Reads add the still-buffered deltas to the stored
+value via ``get_count`` / ``apply_pending`` so counts stay close to real
+time. A buffered increment made inside a transaction is only added once
+the transaction commits, so a rolled back like or comment is never
+counted. With an interval of 0 (the default) every increment is written
+through immediately with an ``F()`` expression, as part of the caller's
+transaction.
+
+Code that copies a counter elsewhere listens to ``counter_written``, sent
+with the model as sender, the row's ``lookup`` and the written ``fields``
+whenever a counter reaches the database, immediately or from a flush.
+
+Buffered deltas live in the process that received them, not in a shared
+cache: reads in other processes lag by up to one interval, and a crash loses
+what was not flushed yet. Both are bounded by the interval and by
+``ENGAGEMENT_COUNTER_MAX_PENDING``, the number of buffered increments that
+triggers an early flush. ``reconcile_counters`` repairs lost increments,
+but only runs with buffering switched off: a recount cannot tell which of
+its rows another process still holds a delta for.
+"""
+import atexit
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+
+counter_written = Signal()
+
+
+def get_flush_interval():
+    return getattr(settings, 'ENGAGEMENT_COUNTER_FLUSH_INTERVAL', 0)
+
+
+def get_max_pending():
+    return getattr(settings, 'ENGAGEMENT_COUNTER_MAX_PENDING', 1000)
+
+
+def _make_key(model, field, lookup):
+    return (model._meta.label, tuple(sorted(lookup.items())), field)
+
+
+def _update_expression(field, delta):
+    if delta < 0:
+        # Counters are unsigned; clamp at zero rather than going negative
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def _write(model, lookup, deltas):
+    updates = {
+        field: _update_expression(field, delta)
+        for field, delta in deltas.items() if delta
+    }
+    if updates:
+        model.objects.filter(**dict(lookup)).update(**updates)
+        counter_written.send(sender=model, lookup=dict(lookup), fields=list(updates))
+
+
+class CounterBuffer:
+    """
+    Thread-safe accumulator of pending counter deltas. ``interval`` and
+    ``max_pending`` override ``ENGAGEMENT_COUNTER_FLUSH_INTERVAL`` and
+    ``ENGAGEMENT_COUNTER_MAX_PENDING`` for this buffer.
+    """
+
+    def __init__(self, interval=None, max_pending=None):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)
+        # Increments added since the last drain
+        self._count = 0
+        self._wake = threading.Event()
+        self._flusher = None
+
+    def increment(self, model, field, delta=1, **lookup):
+        self.add(_make_key(model, field, lookup), delta)
+
+    def add(self, key, delta):
+        max_pending = get_max_pending() if self.max_pending is None else self.max_pending
+        with self._lock:
+            self._deltas[key] += delta
+            self._count += 1
+            if max_pending and self._count >= max_pending:
+                # Flush early rather than risk more than this many increments
+                self._wake.set()
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._run, name='counter-flusher', daemon=True
+                )
+                self._flusher.start()
+
+    def pending(self, key):
+        with self._lock:
+            return self._deltas.get(key, 0)
+
+    def drain(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+            self._count = 0
+        return deltas
+
+    def restore(self, deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._deltas[key] += delta
+            self._count += len(deltas)
+
+    def _run(self):
+        while True:
+            interval = get_flush_interval() if self.interval is None else self.interval
+            if interval > 0:
+                self._wake.wait(interval)
+                self._wake.clear()
+            try:
+                flush_counters(self)
+            finally:
+                connection.close()
+            if interval <= 0:
+                return
+
+
+_buffer = CounterBuffer()
+
+
+def increment(model, field, delta=1, **lookup):
+    """
+    Add ``delta`` to ``field`` on the row matching ``lookup``, e.g.
+    ``increment(Post, 'likes_count', pk=post_id)``.
+
+    Always use the same lookup for a given counter so buffered deltas for it
+    are merged and can be found again by ``get_count``.
+    """
+    if get_flush_interval() > 0:
+        key = _make_key(model, field, lookup)
+        # Buffered deltas outlive the transaction; only keep committed ones
+        transaction.on_commit(lambda: _buffer.add(key, delta))
+    else:
+        write_through(model, field, delta, **lookup)
+
+
+def write_through(model, field, delta=1, **lookup):
+    """Write an increment to the database immediately, bypassing the buffer."""
+    _write(model, lookup.items(), {field: delta})
+
+
+def get_pending(model, field, **lookup):
+    """Return the buffered, not yet flushed delta for a counter."""
+    return _buffer.pending(_make_key(model, field, lookup))
+
+
+def get_count(obj, field, key='pk'):
+    """
+    Return the stored value of a counter plus its buffered delta. ``key``
+    names the attribute the counter's increments were looked up by.
+    """
+    lookup = {key: getattr(obj, key)}
+    return max(0, getattr(obj, field) + get_pending(type(obj), field, **lookup))
+
+
+def apply_pending(objects, *fields, key='pk'):
+    """Add buffered deltas to counter attributes of already loaded objects."""
+    if get_flush_interval() <= 0:
+        return objects
+    for obj in objects:
+        for field in fields:
+            setattr(obj, field, get_count(obj, field, key=key))
+    return objects
+
+
+def flush_counters(buffer=None):
+    """
+    Fold all buffered deltas (of ``buffer``, by default the process's
+    shared buffer) into the database.
+
+    Deltas for the same row are merged into a single UPDATE. Returns the
+    number of rows written.
+    """
+    buffer = buffer or _buffer
+    deltas = buffer.drain()
+    if not deltas:
+        return 0
+
+    rows = defaultdict(dict)
+    for (label, lookup, field), delta in deltas.items():
+        rows[(label, lookup)][field] = delta
+
+    try:
+        with transaction.atomic():
+            for (label, lookup), fields in rows.items():
+                _write(apps.get_model(label), lookup, fields)
+    except Exception:
+        # Keep the increments for the next pass rather than dropping them
+        buffer.restore(deltas)
+        raise
+
+    return len(rows)
+
+
+atexit.register(flush_counters)
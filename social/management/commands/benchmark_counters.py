@@ -0,0 +1,82 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection
+from posts.models import Post
+from social import counters
+
+
+class Command(BaseCommand):
+    help = 'Measure like-counter write throughput on a single hot post'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Number of concurrent writer threads (default: 8)',
+        )
+        parser.add_argument(
+            '--increments',
+            type=int,
+            default=250,
+            help='Increments per thread (default: 250)',
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            default=1.0,
+            help='Flush interval used for the buffered run (default: 1.0s)',
+        )
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        increments = options['increments']
+        total = threads * increments
+
+        user = User.objects.create_user(username=f'counter-bench-{uuid.uuid4().hex[:8]}')
+        post = Post.objects.create(author=user, content='Counter benchmark')
+
+        try:
+            direct = self.run(post, threads, increments, counters.write_through)
+
+            buffer = counters.CounterBuffer(interval=options['flush_interval'])
+            # Timed up to the final flush, so the buffered writes are paid for
+            buffered = self.run(
+                post, threads, increments, buffer.increment, finish=lambda: counters.flush_counters(buffer)
+            )
+
+            post.refresh_from_db()
+            self.stdout.write(f'Write-through: {total / direct:,.0f} increments/s')
+            self.stdout.write(f'Buffered:      {total / buffered:,.0f} increments/s')
+            self.stdout.write(f'Speedup:       {direct / buffered:.1f}x')
+
+            if post.likes_count != total * 2:
+                self.stdout.write(
+                    self.style.ERROR(f'Expected {total * 2} likes, found {post.likes_count}')
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS('All increments were applied.'))
+        finally:
+            user.delete()
+
+    def run(self, post, threads, increments, increment, finish=None):
+        def worker():
+            try:
+                for _ in range(increments):
+                    increment(Post, 'likes_count', pk=post.pk)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if finish is not None:
+            finish()
+        return time.perf_counter() - start
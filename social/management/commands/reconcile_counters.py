@@ -0,0 +1,152 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from accounts.models import UserProfile
+from posts.models import Post, Comment
+from social import counters as engagement_counters
+from social_platform import repair
+from social.models import Like, Follow
+
+
+# target name -> (model, key field, {counter field: (source model, source fk)})
+TARGETS = {
+    'posts': (Post, 'id', {
+        'likes_count': (Like, 'post_id'),
+        'comments_count': (Comment, 'post_id'),
+    }),
+    'profiles': (UserProfile, 'user_id', {
+        'followers_count': (Follow, 'following_id'),
+        'following_count': (Follow, 'follower_id'),
+        'posts_count': (Post, 'author_id'),
+    }),
+}
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like/comment/follow/post counters and fix drifted rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only',
+            choices=sorted(TARGETS),
+            help='Only reconcile one kind of counter',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows scanned per chunk (default: 1000)',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to pause between chunks to limit database load (default: 0)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted counters without writing anything',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue from the last checkpoint instead of starting over',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='Checkpoint file used to resume an interrupted run '
+                 '(default: reconcile_counters.json in COMMAND_STATE_DIR)',
+        )
+
+    def handle(self, *args, **options):
+        if engagement_counters.get_flush_interval() > 0:
+            # Deltas still buffered in web processes are already part of the
+            # recount, and would be counted again when they are flushed
+            raise CommandError(
+                'Counter buffering is enabled. Set ENGAGEMENT_COUNTER_FLUSH_INTERVAL=0 and restart '
+                'the web processes so their buffers are flushed, then run this command.'
+            )
+        engagement_counters.flush_counters()
+
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.checkpoint_path = options['checkpoint'] or os.path.join(
+            getattr(settings, 'COMMAND_STATE_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'state')),
+            'reconcile_counters.json',
+        )
+        checkpoint = self.load_checkpoint() if options['resume'] else {}
+
+        targets = [options['only']] if options['only'] else list(TARGETS)
+        for name in targets:
+            scanned, drifted, fixed = self.reconcile(
+                name, checkpoint, options['chunk_size'], options['sleep']
+            )
+            if self.dry_run:
+                self.stdout.write(f'{name}: scanned {scanned} rows, {drifted} drifted')
+            else:
+                self.stdout.write(f'{name}: scanned {scanned} rows, {drifted} drifted, {fixed} fixed')
+
+        if not self.dry_run and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        self.stdout.write(self.style.SUCCESS('Counter reconciliation complete!'))
+
+    def reconcile(self, name, checkpoint, chunk_size, sleep):
+        model, key, counters = TARGETS[name]
+        fields = list(counters)
+        scanned = drifted = fixed = 0
+
+        chunks = repair.iter_chunks(
+            model.objects.all(), key, fields, chunk_size, start_after=checkpoint.get(name, 0), sleep=sleep
+        )
+        for rows in chunks:
+            keys = [row[0] for row in rows]
+            actual = {field: self.count_by(source, fk, keys) for field, (source, fk) in counters.items()}
+
+            for row in rows:
+                stored = dict(zip(fields, row[1:]))
+                expected = {field: actual[field].get(row[0], 0) for field in fields}
+                if stored == expected:
+                    continue
+
+                drifted += 1
+                if self.verbosity > 1:
+                    self.stdout.write(f'{name} {key}={row[0]}: {repair.describe_changes(stored, expected)}')
+                if not self.dry_run:
+                    # A like, comment or follow committed since the count was
+                    # taken changes the row; it is left for the next run
+                    fixed += repair.compare_and_swap(model.objects.filter(**{key: row[0]}), stored, expected)
+
+            scanned += len(rows)
+            if not self.dry_run:
+                checkpoint[name] = keys[-1]
+                self.save_checkpoint(checkpoint)
+
+        return scanned, drifted, fixed
+
+    def count_by(self, source, fk, keys):
+        """Count source rows grouped by foreign key in a single aggregate query."""
+        return dict(
+            source.objects.filter(**{f'{fk}__in': keys}).order_by().values(fk).annotate(
+                n=Count('pk')
+            ).values_list(fk, 'n')
+        )
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_checkpoint(self, checkpoint):
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
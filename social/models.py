@@ -77,6 +77,8 @@ class Follow(models.Model):
             models.Index(fields=['follower']),
             models.Index(fields=['following']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['follower', '-created_at']),
+            models.Index(fields=['following', '-created_at']),
         ]
 
     def __str__(self):
@@ -107,6 +109,7 @@ class Notification(models.Model):
             models.Index(fields=['sender']),
             models.Index(fields=['is_read']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['recipient', '-created_at']),
         ]
 
     def __str__(self):
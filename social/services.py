@@ -0,0 +1,49 @@
+from django.db import IntegrityError, transaction
+from posts.models import Post
+from .models import Like
+from . import counters
+
+
+def like_post(user, post):
+    """
+    Like a post if the user has not already liked it.
+
+    The insert relies on the unique_post_like constraint, so concurrent
+    requests from the same user produce exactly one Like (and therefore one
+    counter increment and one notification, both fired by the post_save
+    receiver). Returns True if a new like was created.
+    """
+    try:
+        with transaction.atomic():
+            Like.objects.create(user=user, post=post)
+    except IntegrityError:
+        return False
+    return True
+
+
+def unlike_post(user, post):
+    """Remove a user's like from a post. Returns True if a like was removed."""
+    deleted, _ = Like.objects.filter(user=user, post=post).delete()
+    return deleted > 0
+
+
+def toggle_post_like(user, post):
+    """
+    Like the post if the user has not liked it yet, otherwise unlike it.
+
+    Returns a ``(is_liked, likes_count)`` tuple, where ``likes_count`` is the
+    counter value after the change rather than a fresh COUNT(*) of likes.
+    """
+    with transaction.atomic():
+        if unlike_post(user, post):
+            is_liked = False
+        else:
+            # A concurrent request may have liked it first; either way it is liked now
+            like_post(user, post)
+            is_liked = True
+
+        likes_count = Post.objects.filter(pk=post.pk).values_list('likes_count', flat=True).get()
+
+    # Include increments still waiting in the counter write buffer
+    likes_count = max(0, likes_count + counters.get_pending(Post, 'likes_count', pk=post.pk))
+    return is_liked, likes_count
@@ -2,33 +2,36 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import Like, Follow, Notification
+from . import counters
+from accounts.models import UserProfile
 from posts.models import Post, Comment
+from posts import timeline
 
 
 @receiver(post_save, sender=Like)
 def update_like_count_on_create(sender, instance, created, **kwargs):
     """Update like count when a like is created."""
     if created:
-        if instance.post:
-            instance.post.likes_count += 1
-            instance.post.save(update_fields=['likes_count'])
-            
+        if instance.post_id:
+            # Atomic (or buffered) increment, safe under concurrent likes
+            counters.increment(Post, 'likes_count', pk=instance.post_id)
+
             # Create notification for post like
-            if instance.user != instance.post.author:
+            post = instance.post
+            if instance.user_id != post.author_id:
                 Notification.objects.create(
-                    recipient=instance.post.author,
-                    sender=instance.user,
+                    recipient_id=post.author_id,
+                    sender_id=instance.user_id,
                     notification_type='like',
-                    post=instance.post
+                    post=post
                 )
 
 
 @receiver(post_delete, sender=Like)
 def update_like_count_on_delete(sender, instance, **kwargs):
     """Update like count when a like is deleted."""
-    if instance.post:
-        instance.post.likes_count = max(0, instance.post.likes_count - 1)
-        instance.post.save(update_fields=['likes_count'])
+    if instance.post_id:
+        counters.increment(Post, 'likes_count', -1, pk=instance.post_id)
 
 
 @receiver(post_save, sender=Follow)
@@ -36,15 +39,11 @@ def update_follow_count_on_create(sender, instance, created, **kwargs):
     """Update follow counts when a follow relationship is created."""
     if created:
         # Update follower's following count
-        follower_profile = instance.follower.profile
-        follower_profile.following_count += 1
-        follower_profile.save(update_fields=['following_count'])
-        
+        counters.increment(UserProfile, 'following_count', user_id=instance.follower_id)
+
         # Update following's followers count
-        following_profile = instance.following.profile
-        following_profile.followers_count += 1
-        following_profile.save(update_fields=['followers_count'])
-        
+        counters.increment(UserProfile, 'followers_count', user_id=instance.following_id)
+
         # Create notification for follow
         Notification.objects.create(
             recipient=instance.following,
@@ -52,45 +51,49 @@ def update_follow_count_on_create(sender, instance, created, **kwargs):
             notification_type='follow'
         )
 
+        # Bring the followed user's recent posts into the follower's timeline
+        timeline.backfill_timeline(instance.follower, instance.following)
+
 
 @receiver(post_delete, sender=Follow)
 def update_follow_count_on_delete(sender, instance, **kwargs):
     """Update follow counts when a follow relationship is deleted."""
     # Update follower's following count
-    follower_profile = instance.follower.profile
-    follower_profile.following_count = max(0, follower_profile.following_count - 1)
-    follower_profile.save(update_fields=['following_count'])
-    
+    counters.increment(UserProfile, 'following_count', -1, user_id=instance.follower_id)
+
     # Update following's followers count
-    following_profile = instance.following.profile
-    following_profile.followers_count = max(0, following_profile.followers_count - 1)
-    following_profile.save(update_fields=['followers_count'])
+    counters.increment(UserProfile, 'followers_count', -1, user_id=instance.following_id)
+
+    # Remove the unfollowed user's posts from the follower's timeline
+    timeline.remove_author_from_timeline(instance.follower, instance.following)
 
 
 @receiver(post_save, sender=Post)
 def update_post_count_on_create(sender, instance, created, **kwargs):
     """Update post count when a post is created."""
     if created:
-        profile = instance.author.profile
-        profile.posts_count += 1
-        profile.save(update_fields=['posts_count'])
+        counters.increment(UserProfile, 'posts_count', user_id=instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post_on_create(sender, instance, created, **kwargs):
+    """Push a new post into the author's and followers' home timelines."""
+    if created:
+        timeline.fan_out_post(instance)
 
 
 @receiver(post_delete, sender=Post)
 def update_post_count_on_delete(sender, instance, **kwargs):
     """Update post count when a post is deleted."""
-    profile = instance.author.profile
-    profile.posts_count = max(0, profile.posts_count - 1)
-    profile.save(update_fields=['posts_count'])
+    counters.increment(UserProfile, 'posts_count', -1, user_id=instance.author_id)
 
 
 @receiver(post_save, sender=Comment)
 def update_comment_count_on_create(sender, instance, created, **kwargs):
     """Update comment count when a comment is created."""
     if created:
-        instance.post.comments_count += 1
-        instance.post.save(update_fields=['comments_count'])
-        
+        counters.increment(Post, 'comments_count', pk=instance.post_id)
+
         # Create notification for comment
         if instance.author != instance.post.author:
             Notification.objects.create(
@@ -105,5 +108,4 @@ def update_comment_count_on_create(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Comment)
 def update_comment_count_on_delete(sender, instance, **kwargs):
     """Update comment count when a comment is deleted."""
-    instance.post.comments_count = max(0, instance.post.comments_count - 1)
-    instance.post.save(update_fields=['comments_count'])
+    counters.increment(Post, 'comments_count', -1, pk=instance.post_id)
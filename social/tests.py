@@ -1,8 +1,20 @@
-from django.test import TestCase, Client
+import json
+import os
+import threading
+import time
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from .models import Like, Follow, Notification
+from . import counters
+from .services import like_post, unlike_post, toggle_post_like
 from posts.models import Post, Comment
+from social_platform.test_utils import TempDirMixin
+from accounts.models import UserProfile
 
 
 class LikeModelTest(TestCase):
@@ -168,3 +180,235 @@ class SocialViewTest(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(user=self.user2, post=self.post).exists())
+
+
+class LikeServiceTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.fan = User.objects.create_user(username='fan', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='This is a test post')
+
+    def test_toggle_like_and_unlike(self):
+        """Test that toggling likes then unlikes and returns the new count."""
+        self.assertEqual(toggle_post_like(self.fan, self.post), (True, 1))
+        self.assertEqual(toggle_post_like(self.fan, self.post), (False, 0))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_like_is_idempotent(self):
+        """Test that liking twice creates one like, one increment and one notification."""
+        self.assertTrue(like_post(self.fan, self.post))
+        self.assertFalse(like_post(self.fan, self.post))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(notification_type='like').count(), 1)
+
+    def test_unlike_without_like(self):
+        """Test that unliking a post that was not liked leaves the count alone."""
+        self.assertFalse(unlike_post(self.fan, self.post))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+
+class LikeConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Hot post')
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', password='testpass123')
+            for i in range(8)
+        ]
+
+    def _hammer(self, users):
+        errors = []
+
+        def worker(user):
+            try:
+                for _ in range(5):
+                    like_post(user, self.post)
+            except Exception as e:  # Surface failures from worker threads
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_likes_from_many_users(self):
+        """Test that concurrent likes from many users are all counted."""
+        errors = self._hammer(self.fans)
+        self.assertEqual(errors, [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, len(self.fans))
+        self.assertEqual(self.post.likes_count, Like.objects.filter(post=self.post).count())
+
+    def test_concurrent_likes_from_one_user(self):
+        """Test that concurrent likes from one user count once and notify once."""
+        errors = self._hammer([self.fans[0]] * 8)
+        self.assertEqual(errors, [])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(Notification.objects.filter(notification_type='like').count(), 1)
+
+
+class CounterBufferTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', password='testpass123')
+            for i in range(3)
+        ]
+        self.post = Post.objects.create(author=self.author, content='Buffered post')
+
+    def tearDown(self):
+        counters.flush_counters()
+
+    def test_write_through_by_default(self):
+        """Test that increments are written immediately without a flush interval."""
+        counters.increment(Post, 'likes_count', pk=self.post.pk)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_buffered_increments_flush_as_one_update(self):
+        """Test that buffered increments are merged into one write on flush."""
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in self.fans:
+                Like.objects.create(user=fan, post=self.post)
+            Comment.objects.create(post=self.post, author=self.fans[0], content='Hi')
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(counters.get_count(self.post, 'likes_count'), 3)
+
+        with self.assertNumQueries(3):  # savepoint, UPDATE, release
+            self.assertEqual(counters.flush_counters(), 1)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 3)
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(counters.get_pending(Post, 'likes_count', pk=self.post.pk), 0)
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_buffered_follow_counts(self):
+        """Test that profile counters are buffered and merged on read."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.fans[0], following=self.author)
+        profile = self.author.profile
+        profile.refresh_from_db()
+        self.assertEqual(counters.get_count(profile, 'followers_count', key='user_id'), 1)
+
+        counters.flush_counters()
+        profile.refresh_from_db()
+        self.assertEqual(profile.followers_count, 1)
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_rolled_back_increments_are_not_buffered(self):
+        """Test that a like whose transaction rolls back never reaches the buffer."""
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Like.objects.create(user=self.fans[0], post=self.post)
+                    raise RuntimeError('request failed')
+            except RuntimeError:
+                pass
+        self.assertEqual(counters.get_pending(Post, 'likes_count', pk=self.post.pk), 0)
+
+
+class CommittedCounterBufferTest(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', password='testpass123')
+            for i in range(2)
+        ]
+        self.post = Post.objects.create(author=self.author, content='Buffered post')
+
+    def tearDown(self):
+        counters.flush_counters()
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_toggle_like_includes_buffered_delta(self):
+        """Test that the like service reports counts that include its own committed, buffered delta."""
+        self.assertEqual(toggle_post_like(self.fans[0], self.post), (True, 1))
+        self.assertEqual(toggle_post_like(self.fans[1], self.post), (True, 2))
+        self.assertEqual(toggle_post_like(self.fans[0], self.post), (False, 1))
+
+
+    def test_full_buffer_flushes_early(self):
+        """Test that reaching the pending increment limit flushes without waiting for the interval."""
+        buffer = counters.CounterBuffer(interval=60, max_pending=3)
+        for _ in range(3):
+            buffer.increment(Post, 'likes_count', pk=self.post.pk)
+
+        for _ in range(100):
+            self.post.refresh_from_db()
+            if self.post.likes_count:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.post.likes_count, 3)
+
+
+class ReconcileCountersTest(TempDirMixin, TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='testpass123')
+        self.user2 = User.objects.create_user(username='user2', password='testpass123')
+        self.post = Post.objects.create(author=self.user1, content='Drifting post')
+        Like.objects.create(user=self.user2, post=self.post)
+        Follow.objects.create(follower=self.user2, following=self.user1)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=7, comments_count=3)
+        UserProfile.objects.filter(user=self.user1).update(followers_count=0, posts_count=5)
+        self.checkpoint = os.path.join(self.make_temp_dir(), 'checkpoint.json')
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_counters', '--checkpoint', self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def test_reconcile_fixes_drifted_counters(self):
+        """Test that drifted counters are recomputed from the source tables."""
+        output = self.reconcile('--chunk-size', '1')
+        self.post.refresh_from_db()
+        profile = UserProfile.objects.get(user=self.user1)
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (1, 0))
+        self.assertEqual((profile.followers_count, profile.posts_count), (1, 1))
+        self.assertIn('posts: scanned 1 rows, 1 drifted, 1 fixed', output)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run_writes_nothing(self):
+        """Test that a dry run only reports drift."""
+        output = self.reconcile('--dry-run')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 7)
+        self.assertIn('posts: scanned 1 rows, 1 drifted', output)
+
+    def test_resume_from_checkpoint(self):
+        """Test that a resumed run skips rows before the checkpoint."""
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'posts': self.post.pk}, f)
+        output = self.reconcile('--only', 'posts', '--resume')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 7)
+        self.assertIn('posts: scanned 0 rows', output)
+
+    @override_settings(ENGAGEMENT_COUNTER_FLUSH_INTERVAL=60)
+    def test_refuses_to_run_while_buffering(self):
+        """Test that counters are not recounted while increments may still be buffered."""
+        with self.assertRaisesMessage(CommandError, 'buffering is enabled'):
+            self.reconcile()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 7)
+
+    def test_checkpoint_defaults_to_state_dir(self):
+        """Test that the checkpoint is kept in COMMAND_STATE_DIR."""
+        state_dir = self.make_temp_dir()
+        with override_settings(COMMAND_STATE_DIR=state_dir):
+            with open(os.path.join(state_dir, 'reconcile_counters.json'), 'w') as f:
+                json.dump({'posts': self.post.pk}, f)
+            output = StringIO()
+            call_command('reconcile_counters', '--only', 'posts', '--resume', stdout=output)
+        self.assertIn('posts: scanned 0 rows', output.getvalue())
@@ -1,24 +1,23 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from .models import Notification
+from social_platform.pagination import CursorPaginator
 
 
 @login_required
 def notifications_view(request):
     notifications = Notification.objects.filter(
         recipient=request.user
-    ).select_related('sender__profile', 'post', 'comment').order_by('-created_at')
+    ).select_related('sender__profile', 'post', 'comment')
 
     # Mark all notifications as read
     notifications.filter(is_read=False).update(is_read=True)
 
-    # Pagination
-    paginator = Paginator(notifications, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: no COUNT(*) and no OFFSET scan
+    paginator = CursorPaginator(notifications, 20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'page_obj': page_obj,
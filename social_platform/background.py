@@ -0,0 +1,123 @@
+"""
+Local background worker pool.
+
+Slow work that does not have to finish before a response is sent (image
+decoding and resizing) is handed to a pool of worker processes instead of
+running inside the request. No broker is needed: the pool lives in the web
+process and is started on first use.
+
+Jobs are plain module-level functions called with picklable arguments,
+normally a primary key; the worker loads the row itself. ``enqueue`` submits
+the job once the current transaction commits so the worker never looks for a
+row that is not visible yet.
+
+``BACKGROUND_WORKERS`` sets the pool size. With 0, jobs run inline in the
+calling process; the settings force 0 under ``manage.py test``.
+
+Exceptions raised by pooled jobs are logged when the job finishes, as
+nothing else waits on the returned ``Future``.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_count():
+    return getattr(settings, 'BACKGROUND_WORKERS', 0)
+
+
+def _init_worker(settings_module, database_names, media_root):
+    """Set up Django in a freshly spawned worker process."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+    # Use the same databases and storage as the parent, which may differ from
+    # the settings module (e.g. the test database)
+    for alias, name in database_names.items():
+        connections[alias].settings_dict['NAME'] = name
+    settings.MEDIA_ROOT = media_root
+
+
+def _run_job(func, args):
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            database_names = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+            _pool = ProcessPoolExecutor(
+                max_workers=get_worker_count(),
+                # Spawn rather than fork so workers never share the parent's
+                # database connections or background threads
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(settings.SETTINGS_MODULE, database_names, str(settings.MEDIA_ROOT)),
+            )
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _log_failure(future):
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        logger.error('Background job failed', exc_info=(type(exc), exc, exc.__traceback__))
+
+
+def submit(func, *args):
+    """
+    Run ``func(*args)`` on the worker pool, or inline when the pool is
+    disabled. Returns a ``Future`` for pooled jobs and ``None`` otherwise.
+    """
+    if get_worker_count() <= 0:
+        func(*args)
+        return None
+
+    pool = _get_pool()
+    try:
+        future = pool.submit(_run_job, func, args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed by the OOM killer); start a fresh pool
+        _reset_pool(pool)
+        future = _get_pool().submit(_run_job, func, args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def enqueue(func, *args):
+    """Submit a job once the current transaction has committed."""
+    transaction.on_commit(lambda: submit(func, *args))
+
+
+def shutdown(wait=True):
+    """Stop the worker pool, e.g. before the process exits."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
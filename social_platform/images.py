@@ -0,0 +1,329 @@
+"""
+Background normalization of uploaded images.
+
+Models list the image fields to keep within a maximum size in
+``resize_fields`` and the fields to build responsive variants for in
+``variant_fields``. ``ResizeImagesMixin`` remembers the file name each field
+had when the row was loaded and, on save, enqueues ``process_image`` on the
+background worker pool only for fields whose file actually changed. Saves
+that touch other columns, such as counter updates, never open the image.
+
+The worker writes the resized image to a temporary file next to the
+original and renames it into place, so readers never see a partial file.
+It then encodes the image at several widths in WebP (and AVIF when Pillow
+supports it) and stores a manifest of the variants on the row, which the
+``responsive_images`` template tags turn into ``srcset`` candidates.
+Variant file names include a hash of their content, so they never change
+and can be cached by browsers indefinitely.
+
+The manifest also records the image's dimensions and a tiny blurred JPEG
+as a data URI, so templates can reserve the image's space and paint a
+placeholder before any image request is made. ``generate_placeholders``
+backfills them for images processed before placeholders existed.
+"""
+import base64
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from PIL import ExifTags, Image, ImageOps, features
+
+from . import background
+
+# (MIME type, Pillow format, extension, encoder options), best compression first
+VARIANT_FORMATS = [
+    ('image/avif', 'AVIF', 'avif', {'quality': 60}),
+    ('image/webp', 'WEBP', 'webp', {'quality': 80, 'method': 6}),
+]
+
+# Hex digits of the content hash in variant file names
+CONTENT_HASH_LENGTH = 12
+
+# Width of the inline placeholder; it is stretched and smoothed by the browser
+PLACEHOLDER_WIDTH = 16
+
+
+def get_variant_formats():
+    """Return the variant formats the installed Pillow can encode."""
+    Image.init()
+    return [
+        variant for variant in VARIANT_FORMATS
+        if variant[1] in Image.SAVE and features.check(variant[2])
+    ]
+
+
+def write_atomic(path, data):
+    """Replace the file at ``path`` with ``data`` without exposing a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def resize_image(path, max_size):
+    """Shrink the image at ``path`` in place to fit within ``max_size``."""
+    try:
+        with Image.open(path) as img:
+            if img.width <= max_size[0] and img.height <= max_size[1]:
+                return
+            image_format = img.format
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            img.save(buffer, format=image_format)
+        write_atomic(path, buffer.getvalue())
+    except (FileNotFoundError, Image.UnidentifiedImageError):
+        # Missing or not an image; nothing to normalize
+        return
+
+
+def optimize_image(path, quality, max_size, known_hash=None):
+    """
+    Recompress the image at ``path`` in its own format, shrinking it to fit
+    ``max_size`` x ``max_size``. The file is only rewritten if it was resized
+    or the result is smaller, and never if its SHA-256 equals ``known_hash``
+    (it was optimized before; recompressing again would only lose quality).
+
+    Returns ``(status, bytes_before, bytes_after, sha256)`` where status is
+    ``'optimized'``, ``'kept'`` or ``'unchanged'``. Needs no Django setup,
+    so it can run in a bare worker process.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == known_hash:
+        return 'unchanged', len(data), len(data), digest
+
+    with Image.open(BytesIO(data)) as img:
+        image_format = img.format
+        resized = img.width > max_size or img.height > max_size
+        if resized:
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+        options = {}
+        for key in ('exif', 'icc_profile'):
+            if img.info.get(key):
+                options[key] = img.info[key]
+        if image_format == 'JPEG':
+            if img.mode not in ('RGB', 'L', 'CMYK'):
+                img = img.convert('RGB')
+            options.update(quality=quality, optimize=True, progressive=True)
+        elif image_format == 'PNG':
+            options.update(optimize=True)
+        elif image_format == 'WEBP':
+            options.update(quality=quality, method=6)
+        elif not resized:
+            # Nothing to gain from re-encoding other formats (e.g. animated GIFs)
+            return 'kept', len(data), len(data), digest
+
+        buffer = BytesIO()
+        img.save(buffer, image_format, **options)
+
+    optimized = buffer.getvalue()
+    if not resized and len(optimized) >= len(data):
+        return 'kept', len(data), len(data), digest
+
+    write_atomic(path, optimized)
+    return 'optimized', len(data), len(optimized), hashlib.sha256(optimized).hexdigest()
+
+
+def optimize_image_batch(batch, quality):
+    """
+    Run ``optimize_image`` over ``(name, path, max_size, known_hash)`` tuples
+    in a worker process. Returns ``(name, status, bytes_before, bytes_after,
+    marker)`` per image, where marker records the optimized file's hash and
+    stat, or the error message if status is ``'error'``.
+    """
+    results = []
+    for name, path, max_size, known_hash in batch:
+        try:
+            status, before, after, digest = optimize_image(path, quality, max_size, known_hash)
+            stat = os.stat(path)
+            results.append((name, status, before, after, {
+                'sha256': digest,
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'quality': quality,
+                'max_size': max_size,
+            }))
+        except Exception as e:
+            results.append((name, 'error', 0, 0, str(e)))
+    return results
+
+
+def _prepare(img):
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    return img
+
+
+def make_placeholder(img):
+    """Return a ``PLACEHOLDER_WIDTH`` pixel wide JPEG of ``img`` as a data URI."""
+    height = max(1, round(img.height * PLACEHOLDER_WIDTH / img.width))
+    small = img.convert('RGB').resize((PLACEHOLDER_WIDTH, height), Image.Resampling.BOX)
+    buffer = BytesIO()
+    small.save(buffer, 'JPEG', quality=50, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def generate_placeholder(storage, name):
+    """
+    Return ``{'source', 'width', 'height', 'placeholder'}`` for the image
+    stored at ``name``, the manifest keys ``generate_variants`` also sets.
+    """
+    with storage.open(name) as f, Image.open(f) as img:
+        # Dimensions as displayed, after EXIF rotation
+        width, height = img.size
+        if img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEGs can be decoded at a fraction of their size, which is all we need
+        img.draft('RGB', (PLACEHOLDER_WIDTH * 8, PLACEHOLDER_WIDTH * 8))
+        return {
+            'source': name,
+            'width': width,
+            'height': height,
+            'placeholder': make_placeholder(_prepare(img)),
+        }
+
+
+def generate_variants(storage, name, widths):
+    """
+    Encode the image stored at ``name`` at each of ``widths`` (never wider
+    than the source) in every supported variant format. Returns a manifest::
+
+        {'source': name, 'width': 1080, 'height': 720, 'placeholder': 'data:image/jpeg;base64,...',
+         'formats': {'image/webp': [[320, 'post_images/variants/a_320.1f2e3d4c5b6a.webp'], ...]}}
+    """
+    with storage.open(name) as f, Image.open(f) as img:
+        img = _prepare(img)
+
+        targets = sorted({min(width, img.width) for width in widths})
+        stem = os.path.splitext(os.path.basename(name))[0]
+        directory = os.path.join(os.path.dirname(name), 'variants')
+
+        formats = {}
+        for mime_type, image_format, extension, options in get_variant_formats():
+            candidates = []
+            for width in targets:
+                height = max(1, round(img.height * width / img.width))
+                resized = img if width == img.width else img.resize((width, height), Image.Resampling.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, image_format, **options)
+                data = buffer.getvalue()
+                # Named after their content, so they can be cached forever
+                digest = hashlib.sha256(data).hexdigest()[:CONTENT_HASH_LENGTH]
+                variant_name = storage.save(
+                    os.path.join(directory, f'{stem}_{width}.{digest}.{extension}'), ContentFile(data)
+                )
+                candidates.append([width, variant_name])
+            formats[mime_type] = candidates
+
+        return {
+            'source': name,
+            'width': img.width,
+            'height': img.height,
+            'placeholder': make_placeholder(img),
+            'formats': formats,
+        }
+
+
+def variant_names(manifest):
+    """Return the storage names of the files listed in a variant manifest."""
+    return [
+        variant_name
+        for candidates in (manifest or {}).get('formats', {}).values()
+        for _, variant_name in candidates
+    ]
+
+
+def delete_variants(storage, manifest):
+    """Remove the files listed in a variant manifest."""
+    for variant_name in variant_names(manifest):
+        storage.delete(variant_name)
+
+
+def process_image(label, pk, field_name, name):
+    """
+    Resize a changed image field and rebuild its variants.
+
+    Does nothing if the row was deleted or the field has since been pointed
+    at another file; that file gets its own job.
+    """
+    model = apps.get_model(label)
+    queryset = model._default_manager.filter(pk=pk, **{field_name: name})
+    if not queryset.exists():
+        return
+
+    storage = model._meta.get_field(field_name).storage
+    if field_name in model.resize_fields:
+        resize_image(storage.path(name), model.resize_fields[field_name])
+
+    if field_name in model.variant_fields:
+        manifest_field, widths = model.variant_fields[field_name]
+        try:
+            manifest = generate_variants(storage, name, widths)
+        except (FileNotFoundError, Image.UnidentifiedImageError):
+            return
+        old_manifest = queryset.values_list(manifest_field, flat=True).first()
+        if queryset.update(**{manifest_field: manifest}):
+            delete_variants(storage, old_manifest)
+        else:
+            # The image changed while we were encoding; these variants are stale
+            delete_variants(storage, manifest)
+
+
+class ResizeImagesMixin:
+    """Resize changed image fields and build their variants in the background after save."""
+
+    # image field name -> (max width, max height)
+    resize_fields = {}
+    # image field name -> (manifest JSONField name, variant widths)
+    variant_fields = {}
+
+    @classmethod
+    def image_fields(cls):
+        return list(dict.fromkeys([*cls.resize_fields, *cls.variant_fields]))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image_names = {
+            field: instance.__dict__[field]
+            for field in cls.image_fields() if field in instance.__dict__
+        }
+        return instance
+
+    def changed_image_fields(self, update_fields=None):
+        loaded = getattr(self, '_loaded_image_names', {})
+        changed = []
+        for field_name in self.image_fields():
+            if update_fields is not None and field_name not in update_fields:
+                continue
+            file = getattr(self, field_name)
+            if not file:
+                continue
+            if not file._committed:
+                # A new upload assigned to the field
+                changed.append(field_name)
+            elif field_name in loaded:
+                if file.name != loaded[field_name]:
+                    changed.append(field_name)
+            elif self._state.adding and file.name != self._meta.get_field(field_name).get_default():
+                changed.append(field_name)
+        return changed
+
+    def save(self, *args, **kwargs):
+        changed = self.changed_image_fields(kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
+
+        for field_name in changed:
+            name = getattr(self, field_name).name
+            self._loaded_image_names = {**getattr(self, '_loaded_image_names', {}), field_name: name}
+            background.enqueue(process_image, self._meta.label, self.pk, field_name, name)
@@ -0,0 +1,94 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """
+    A page of results from a CursorPaginator.
+
+    Mirrors the parts of django.core.paginator.Page that templates use, but
+    exposes an opaque ``next_cursor`` instead of page numbers.
+    """
+
+    def __init__(self, object_list, next_cursor, has_previous):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator ordered by ``(created_at, id)``, newest first.
+
+    Each page is fetched with a ``WHERE (created_at, id) < cursor`` range
+    scan and a LIMIT, so no COUNT(*) is issued and page 100 costs the same as
+    page 1. The queryset must not be sliced.
+    """
+
+    def __init__(self, queryset, per_page, time_field='created_at'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.time_field = time_field
+
+    def encode_cursor(self, obj):
+        value = getattr(obj, self.time_field).isoformat()
+        payload = json.dumps([value, obj.pk]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(value), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise InvalidCursor(cursor)
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(f'-{self.time_field}', '-pk')
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.time_field}__lt': value}) |
+                Q(**{self.time_field: value, 'pk__lt': pk})
+            )
+
+        # Fetch one extra row to find out whether there is a next page
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(object_list[-1])
+
+        return CursorPage(object_list, next_cursor, has_previous=bool(cursor))
+
+    def get_page(self, cursor=None):
+        """Return a page, falling back to the first page for a bad cursor."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
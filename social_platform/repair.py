@@ -0,0 +1,45 @@
+"""
+Building blocks of the commands that recompute denormalized values and fix
+drifted rows (``reconcile_counters``, ``repair_media_usage``).
+
+Rows are walked in primary key order, one chunk per query, so a run over a
+large table neither holds long locks nor loads the table at once. Drifted
+rows are overwritten with a compare-and-swap ``UPDATE`` conditioned on the
+values that were read: a row a concurrent request changed in the meantime
+is left alone and repaired by the next run.
+"""
+import time
+
+
+def iter_chunks(queryset, key, fields=(), chunk_size=1000, start_after=0, sleep=0):
+    """
+    Yield lists of ``(key, *fields)`` tuples of ``queryset`` in ascending
+    ``key`` order, starting after ``start_after``, pausing ``sleep``
+    seconds between chunks.
+    """
+    last_key = start_after
+    while True:
+        rows = list(queryset.filter(**{f'{key}__gt': last_key}).order_by(key).values_list(
+            key, *fields
+        )[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][0]
+        if sleep:
+            time.sleep(sleep)
+
+
+def compare_and_swap(queryset, stored, expected):
+    """
+    Set ``expected`` on the rows of ``queryset`` that still hold the
+    ``stored`` values. Returns the number of rows written.
+    """
+    return queryset.filter(**stored).update(**expected)
+
+
+def describe_changes(stored, expected):
+    return ', '.join(
+        f'{field} {stored[field]} -> {expected[field]}'
+        for field in expected if stored[field] != expected[field]
+    )
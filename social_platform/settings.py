@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from decouple import config
 
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     'posts',
     'social',
     'media_manager',
+    'messaging',
 ]
 
 MIDDLEWARE = [
@@ -93,6 +95,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+        },
+        'TEST': {
+            # A file (rather than shared in-memory) test database lets
+            # concurrency tests wait on SQLite's lock instead of failing
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -159,6 +169,33 @@ LOGOUT_REDIRECT_URL = 'accounts:login'
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 
+# Chunked media uploads (media_manager upload sessions)
+MEDIA_UPLOAD_CHUNK_SIZE = 4194304  # 4MB per chunk request
+MEDIA_UPLOAD_MAX_SIZE = config('MEDIA_UPLOAD_MAX_SIZE', default=2147483648, cast=int)  # 2GB
+# On the same filesystem as MEDIA_ROOT, finished uploads are renamed into place
+MEDIA_UPLOAD_TEMP_DIR = config('MEDIA_UPLOAD_TEMP_DIR', default=str(BASE_DIR / 'tmp' / 'uploads'))
+
+# Checkpoints of resumable management commands; never under MEDIA_ROOT
+COMMAND_STATE_DIR = config('COMMAND_STATE_DIR', default=str(BASE_DIR / 'tmp' / 'state'))
+
+# Per-user media storage quota in bytes, including generated copies. 0 disables it.
+MEDIA_STORAGE_QUOTA = config('MEDIA_STORAGE_QUOTA', default=5368709120, cast=int)  # 5GB
+
+# Media serving: seconds browsers may reuse files whose names are not
+# content-addressed, and optional hand-off of the transfer to the front proxy
+# ('x-sendfile' or 'x-accel-redirect', served from MEDIA_ACCEL_REDIRECT_PREFIX)
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=3600, cast=int)
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+# Directories of MEDIA_ROOT holding uploads; nothing else there is served
+MEDIA_SERVE_PREFIXES = ('media/', 'post_images/', 'profile_pics/')
+
+# Video processing with a local ffmpeg; videos are served as uploaded without it
+FFMPEG_BINARY = config('FFMPEG_BINARY', default='ffmpeg')
+FFPROBE_BINARY = config('FFPROBE_BINARY', default='ffprobe')
+VIDEO_PROCESSING_TIMEOUT = config('VIDEO_PROCESSING_TIMEOUT', default=600, cast=int)  # seconds per ffmpeg run
+VIDEO_PROCESSING_CONCURRENCY = config('VIDEO_PROCESSING_CONCURRENCY', default=1, cast=int)  # videos at a time per host
+
 # Security Settings
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -179,3 +216,32 @@ CACHES = {
 # Session Configuration
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_SAVE_EVERY_REQUEST = True
+
+# Home timeline (fan-out on write)
+TIMELINE_MAX_LENGTH = 800  # posts kept per user timeline
+TIMELINE_BACKFILL_SIZE = 50  # posts copied in when following someone
+TIMELINE_TRIM_INTERVAL = 20  # fan-outs trim one post's recipients in this many
+TIMELINE_CELEBRITY_THRESHOLD = config('TIMELINE_CELEBRITY_THRESHOLD', default=10000, cast=int)
+
+# Engagement counters: seconds between flushes of buffered like/comment/follow
+# counter increments. 0 writes every increment through immediately.
+ENGAGEMENT_COUNTER_FLUSH_INTERVAL = config('ENGAGEMENT_COUNTER_FLUSH_INTERVAL', default=0, cast=float)
+# Buffered increments that trigger an early flush, bounding what a crash loses
+ENGAGEMENT_COUNTER_MAX_PENDING = 1000
+
+# Post search
+SEARCH_RESULTS_LIMIT = 50
+
+# Real-time messaging (Server-Sent Events, served under ASGI). LocalBackend
+# delivers within one process; use messaging.events.RedisBackend with several.
+MESSAGING_EVENTS_BACKEND = config('MESSAGING_EVENTS_BACKEND', default='messaging.events.LocalBackend')
+MESSAGING_EVENTS_REDIS_URL = config('MESSAGING_EVENTS_REDIS_URL', default='redis://localhost:6379/0')
+MESSAGING_EVENTS_KEEPALIVE = 15  # seconds between keepalive comments on idle streams
+MESSAGING_EVENTS_MAX_AGE = 300  # seconds before a stream is closed and the browser reconnects
+
+# Worker processes for image processing and other jobs kept off the request
+# path. 0 runs jobs inline in the calling process.
+BACKGROUND_WORKERS = config('BACKGROUND_WORKERS', default=2, cast=int)
+if sys.argv[1:2] == ['test']:
+    # The test suite runs jobs inline; tests that need the pool opt in
+    BACKGROUND_WORKERS = 0
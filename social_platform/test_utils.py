@@ -0,0 +1,26 @@
+"""
+Helpers shared by the apps' test suites.
+"""
+import shutil
+import tempfile
+
+from django.test import override_settings
+
+
+class TempDirMixin:
+    def make_temp_dir(self):
+        """Return a new temporary directory, removed when the test ends."""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+
+class MediaStorageMixin(TempDirMixin):
+    """Store each test's uploads in a fresh ``MEDIA_ROOT``."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = self.make_temp_dir()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
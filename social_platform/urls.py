@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.shortcuts import redirect
+from media_manager.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,11 +27,13 @@ urlpatterns = [
     path('posts/', include('posts.urls')),
     path('social/', include('social.urls')),
     path('media/', include('media_manager.urls')),
+    path('messaging/', include('messaging.urls')),
     path('messages/', lambda request: redirect('social:messages')),
     path('', lambda request: redirect('posts:feed'), name='home'),
+    # Uploaded files, with ranges and validators; offloaded to the proxy when MEDIA_SENDFILE is set
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', serve_media, name='serve_media'),
 ]
 
-# Serve media files during development
+# Serve static files during development
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -19,20 +19,39 @@ document.addEventListener('DOMContentLoaded', function() {
         imageObserver.observe(img);
     });
 
+    // Drop the inline blurred placeholder once the real image has painted,
+    // so it never shows through transparent images
+    const clearPlaceholder = (img) => {
+        img.style.background = '';
+        img.removeAttribute('data-placeholder');
+    };
+    const watchPlaceholders = (root) => {
+        root.querySelectorAll('img[data-placeholder]').forEach(img => {
+            if (img.complete && img.naturalWidth) {
+                clearPlaceholder(img);
+            } else {
+                img.addEventListener('load', () => clearPlaceholder(img), { once: true });
+            }
+        });
+    };
+    watchPlaceholders(document);
+
     // Infinite scroll for posts
     const postContainer = document.getElementById('posts-container');
     const loadMoreButton = document.getElementById('load-more-posts');
     
     if (postContainer && loadMoreButton) {
-        let page = 2;
+        // Keyset pagination: each page hands us an opaque cursor for the next one
+        let nextCursor = loadMoreButton.dataset.nextCursor;
         let loading = false;
 
-        const loadMorePosts = async () => {
-            if (loading) return;
+        const loadMorePosts = async (event) => {
+            if (event) event.preventDefault();
+            if (loading || !nextCursor) return;
             loading = true;
             
             try {
-                const response = await fetch(`?page=${page}`, {
+                const response = await fetch(`?cursor=${encodeURIComponent(nextCursor)}`, {
                     headers: {
                         'X-Requested-With': 'XMLHttpRequest',
                     }
@@ -42,20 +61,24 @@ document.addEventListener('DOMContentLoaded', function() {
                     const html = await response.text();
                     const parser = new DOMParser();
                     const doc = parser.parseFromString(html, 'text/html');
-                    const newPosts = doc.querySelectorAll('.post-item');
+                    const newPosts = doc.querySelectorAll('#posts-container .post-item');
                     
                     newPosts.forEach(post => {
                         postContainer.appendChild(post);
                         // Observe new lazy images
                         const newLazyImages = post.querySelectorAll('img[data-src]');
                         newLazyImages.forEach(img => imageObserver.observe(img));
+                        watchPlaceholders(post);
                     });
                     
-                    page++;
+                    const nextButton = doc.getElementById('load-more-posts');
+                    nextCursor = nextButton ? nextButton.dataset.nextCursor : null;
                     
                     // Hide load more button if no more posts
-                    if (newPosts.length === 0) {
+                    if (!nextCursor) {
                         loadMoreButton.style.display = 'none';
+                    } else {
+                        loadMoreButton.href = `?cursor=${encodeURIComponent(nextCursor)}`;
                     }
                 }
             } catch (error) {